@@ -5,17 +5,44 @@ Checks the chess engine with test cases to see all possible moves
 import torch
 import ChessEngine
 import time
-from ChessEngine import Move, AlgToMove
+import os
+import sys
+import csv
+import json
+import platform
+import argparse
+from array import array
+from multiprocessing import Pool
+from ChessEngine import Move, AlgToMove, MOVE_SQUARES_MASK, PACKED_MOVE_MASK, PROMOTION_SHIFT, PROMOTION_CODES
+try:
+    import resource # peak memory, not available on windows
+except ImportError:
+    resource = None
 
 # https://www.chessprogramming.org/Perft_Results
 POS5FEN = "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8  "
 PROMOTIONS = ('q', 'n', 'r', 'b')
+UNDERPROMOTIONS = ('n', 'r', 'b')
+
+# reference positions and their known node counts for depth 1, 2, 3...
+PERFT_POSITIONS = {
+    "start": (ChessEngine.STARTINGFEN, (20, 400, 8902, 197281, 4865609, 119060324)),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", (48, 2039, 97862, 4085603, 193690690)),
+    "position3": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", (14, 191, 2812, 43238, 674624, 11030083)),
+    "position4": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", (6, 264, 9467, 422333, 15833292)),
+    "position5": (POS5FEN, (44, 1486, 62379, 2103487, 89941194)),
+    "position6": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", (46, 2079, 89890, 3894594, 164075551)),
+}
+BENCHMARK_FIELDS = ("position", "depth", "backend", "nodes", "expected", "correct", "seconds", "nodesPerSecond", "peakMemoryKB", "hitRate")
 """
 A recursive function that finds all possible moves x turns into the future
 """
 def NoPrintSearch (depth, gameState):
     if depth == 0:
         return 1
+    # bulk count the last ply instead of making and undoing every move
+    if depth == 1:
+        return gameState.countValidMoves()
     positions = 0
     validMoves = gameState.getValidMoves()
     # recursivly calls itself
@@ -33,6 +60,150 @@ def NoPrintSearch (depth, gameState):
 
     return positions
 
+"""
+Bounded cache of perft sub tree sizes keyed by (zobrist key, remaining depth)
+Two slot buckets like the transposition table, slot 0 keeps the deepest sub tree and slot 1 is always replaced
+"""
+class PerftCache():
+    def __init__(self, sizeMB = 64):
+        # each slot is a 64 bit key, a 64 bit node count and a depth byte
+        buckets = 1
+        while buckets * 4 * 17 <= sizeMB * 1024 * 1024:
+            buckets *= 2
+        self.bucketMask = buckets - 1
+        self.keys = array('Q', bytes(8 * 2 * buckets))
+        self.counts = array('Q', bytes(8 * 2 * buckets))
+        self.depths = array('B', bytes(2 * buckets))
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key, depth):
+        self.probes += 1
+        index = ((key ^ (depth * 0x9E3779B97F4A7C15)) & self.bucketMask) * 2
+        for slot in (index, index + 1):
+            if self.depths[slot] == depth and self.keys[slot] == key:
+                self.hits += 1
+                return self.counts[slot]
+        return None
+
+    def store(self, key, depth, count):
+        index = ((key ^ (depth * 0x9E3779B97F4A7C15)) & self.bucketMask) * 2
+        if depth < self.depths[index]:
+            index += 1
+        self.keys[index] = key
+        self.depths[index] = depth
+        self.counts[index] = count
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+"""
+Same as NoPrintSearch but looks every sub tree up in the cache first so transpositions are only counted once
+"""
+def HashedSearch (depth, gameState, cache):
+    if depth == 0:
+        return 1
+    if depth == 1:
+        return gameState.countValidMoves()
+    positions = cache.probe(gameState.zobristKey, depth)
+    if positions is not None:
+        return positions
+    positions = 0
+    validMoves = gameState.getValidMoves()
+    for move in validMoves:
+        if move.isPawnPromotion:
+            for i in PROMOTIONS:
+                move.promotionChoice = i
+                gameState.makeMove(move)
+                positions += HashedSearch(depth - 1, gameState, cache)
+                gameState.undoMove()
+        else:
+            gameState.makeMove(move)
+            positions += HashedSearch(depth - 1, gameState, cache)
+            gameState.undoMove()
+    cache.store(gameState.zobristKey, depth, positions)
+    return positions
+
+"""
+Runs the hashed perft next to the plain one and prints both counts, the cache hit rate and the speedup
+"""
+def CompareHashedSearch (FEN, depth, sizeMB = 64, backend = "mailbox"):
+    gameState = ChessEngine.set_board(FEN = FEN, backend = backend)
+    start = time.time()
+    rawCount = NoPrintSearch(depth, gameState)
+    rawTime = time.time() - start
+
+    cache = PerftCache(sizeMB)
+    start = time.time()
+    hashedCount = HashedSearch(depth, gameState, cache)
+    hashedTime = time.time() - start
+
+    print("depth: " + str(depth) + " raw: " + str(rawCount) + " in " + str(round(rawTime*1000)) + " ms" +
+          " hashed: " + str(hashedCount) + " in " + str(round(hashedTime*1000)) + " ms" +
+          " hit rate: " + str(round(cache.hitRate()*100, 1)) + "%" +
+          " speedup: " + str(round(rawTime / hashedTime, 2)) + "x" +
+          (" MATCH" if rawCount == hashedCount else " MISMATCH"))
+    return rawCount == hashedCount
+
+"""
+Same count as NoPrintSearch but every node's moves come from generateMoves with a hash move, checked against the plain list
+the hash move is an underpromotion where the node has a promotion and its last move otherwise,
+the hashed list has to start with exactly that move and hold the same start and end squares as the plain one
+raises ValueError at the first node where it doesn't
+"""
+def HashMoveSearch (depth, gameState):
+    if depth == 0:
+        return 1
+    plainMoves = gameState.getValidMoves()
+    if plainMoves == []:
+        return 0
+    hashMove = plainMoves[-1].code & PACKED_MOVE_MASK
+    for move in plainMoves:
+        if move.isPawnPromotion:
+            hashMove = (move.code & MOVE_SQUARES_MASK) | (PROMOTION_CODES[UNDERPROMOTIONS[depth % 3]] << PROMOTION_SHIFT)
+            break
+    hashedMoves = list(gameState.generateMoves(hashMove))
+    if hashedMoves[0].code & PACKED_MOVE_MASK != hashMove or \
+            sorted(move.code & MOVE_SQUARES_MASK for move in hashedMoves) != sorted(move.code & MOVE_SQUARES_MASK for move in plainMoves):
+        raise ValueError("hash move " + hex(hashMove) + " changed the moves of " + gameState.to_fen())
+    positions = 0
+    for move in hashedMoves:
+        if move.isPawnPromotion:
+            for i in PROMOTIONS:
+                move.promotionChoice = i
+                gameState.makeMove(move)
+                positions += HashMoveSearch(depth - 1, gameState)
+                gameState.undoMove()
+        else:
+            gameState.makeMove(move)
+            positions += HashMoveSearch(depth - 1, gameState)
+            gameState.undoMove()
+    return positions
+
+"""
+Runs HashMoveSearch on the reference positions at every depth with at most maxNodes known nodes
+prints one line per run and returns True if every count is right
+"""
+def CheckHashMoveSearch (positions = None, maxNodes = 100000, backend = "mailbox"):
+    allCorrect = True
+    for name in positions or PERFT_POSITIONS:
+        FEN, expectedCounts = PERFT_POSITIONS[name]
+        for depth in range(1, len(expectedCounts) + 1):
+            if expectedCounts[depth - 1] > maxNodes:
+                break
+            gameState = ChessEngine.set_board(FEN = FEN, backend = backend)
+            try:
+                nodes = HashMoveSearch(depth, gameState)
+            except ValueError as error:
+                print(name + " depth: " + str(depth) + " " + str(error))
+                allCorrect = False
+                break
+            correct = nodes == expectedCounts[depth - 1]
+            allCorrect = allCorrect and correct
+            print(name + " depth: " + str(depth) + " nodes: " + str(nodes) +
+                  (" OK" if correct else " WRONG expected " + str(expectedCounts[depth - 1])))
+    return allCorrect
+
 def PrintSearchTree ():
     gameState = ChessEngine.set_board(FEN = POS5FEN) # initilizes board
     #newMove = AlgToMove('e2f4', gameState)
@@ -62,16 +233,198 @@ def PrintSearchTree ():
     print("total number of positions: " + str(total))
 
 
-def BasicSearch ():
-     for depth in range(1,6): # number of half turns in the future
-        start = time.time()
-        gameState = ChessEngine.set_board(FEN = POS5FEN) # initilizes board
-        positions = NoPrintSearch(depth, gameState) 
-        end = time.time()
-        print("depth: " + str(depth) + " ply " + "number of positions: " + str(positions) + " time taken: " + str(round((end-start)*1000)) + " milliseconds")
+"""
+Runs in a worker process, rebuilds the position from the FEN, plays one root move and counts the tree below it
+moveText is the root move in algebraic notation with the promotion piece on the end if it promotes
+"""
+def DivideWorker (args):
+    FEN, moveText, depth, backend, hashSizeMB = args
+    gameState = ChessEngine.set_board(FEN = FEN, backend = backend)
+    move = AlgToMove(moveText, gameState)
+    if move.isPawnPromotion:
+        move.promotionChoice = moveText[4]
+    gameState.makeMove(move)
+    if hashSizeMB:
+        counter = HashedSearch(depth - 1, gameState, PerftCache(hashSizeMB))
+    else:
+        counter = NoPrintSearch(depth - 1, gameState)
+    return moveText, counter
 
-     return positions
+"""
+PrintSearchTree split across a process pool, one task per root move and promotion piece
+prints the same per move counts in root move order once every worker is done
+"""
+def ParallelSearchTree (FEN = POS5FEN, depth = 4, workers = None, backend = "mailbox", hashSizeMB = 0):
+    gameState = ChessEngine.set_board(FEN = FEN, backend = backend)
+    rootMoves = []
+    for move in gameState.getValidMoves():
+        if move.isPawnPromotion:
+            for i in PROMOTIONS:
+                rootMoves.append(move.getAlgebraicNotation() + i)
+        else:
+            rootMoves.append(move.getAlgebraicNotation())
+
+    tasks = [(FEN, moveText, depth, backend, hashSizeMB) for moveText in rootMoves]
+    counts = {}
+    with Pool(processes = workers or os.cpu_count()) as pool:
+        # unordered so a worker picks up the next root move as soon as it finishes one
+        for moveText, counter in pool.imap_unordered(DivideWorker, tasks, chunksize = 1):
+            counts[moveText] = counter
+
+    total = 0
+    for moveText in rootMoves:
+        print(moveText + ": " + str(counts[moveText]))
+        total += counts[moveText]
+    print("total number of positions: " + str(total))
+    return total
+
+# peak resident memory of this process in KB, None where the platform can't tell us
+def PeakMemoryKB ():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak # mac reports bytes, linux reports KB
+
+"""
+Times one perft in its own process so the peak memory belongs to this position alone
+the memory is the absolute peak RSS of that process, so it includes the interpreter, torch and move tables
+"""
+def BenchmarkWorker (args):
+    name, depth, backend, hashSizeMB = args
+    FEN, expectedCounts = PERFT_POSITIONS[name]
+    gameState = ChessEngine.set_board(FEN = FEN, backend = backend)
+    cache = PerftCache(hashSizeMB) if hashSizeMB else None
+    start = time.perf_counter()
+    if cache is not None:
+        nodes = HashedSearch(depth, gameState, cache)
+    else:
+        nodes = NoPrintSearch(depth, gameState)
+    seconds = time.perf_counter() - start
+    return {
+        "position": name,
+        "depth": depth,
+        "backend": backend,
+        "nodes": nodes,
+        "expected": expectedCounts[depth - 1],
+        "correct": nodes == expectedCounts[depth - 1],
+        "seconds": round(seconds, 4),
+        "nodesPerSecond": int(nodes / seconds) if seconds > 0 else 0,
+        "peakMemoryKB": PeakMemoryKB(),
+        "hitRate": round(cache.hitRate(), 4) if cache is not None else None, # None when no cache was used
+    }
+
+"""
+Runs every reference position at every depth whose known node count is at most maxNodes
+each run gets a fresh process, results are printed as they finish and returned as a list of dicts
+"""
+def RunBenchmark (positions = None, maxNodes = 1000000, maxDepth = None, backend = "mailbox", hashSizeMB = 0):
+    tasks = []
+    for name in positions or PERFT_POSITIONS:
+        expectedCounts = PERFT_POSITIONS[name][1]
+        for depth in range(1, len(expectedCounts) + 1):
+            if expectedCounts[depth - 1] > maxNodes or (maxDepth is not None and depth > maxDepth):
+                break
+            tasks.append((name, depth, backend, hashSizeMB))
+
+    results = []
+    with Pool(processes = 1, maxtasksperchild = 1) as pool:
+        for result in pool.imap(BenchmarkWorker, tasks):
+            results.append(result)
+            print(result["position"] + " depth: " + str(result["depth"]) + " nodes: " + str(result["nodes"]) +
+                  (" OK" if result["correct"] else " WRONG expected " + str(result["expected"])) +
+                  " time: " + str(round(result["seconds"]*1000)) + " ms nodes/sec: " + str(result["nodesPerSecond"]) +
+                  " peak memory: " + str(result["peakMemoryKB"]) + " KB" +
+                  (" hit rate: " + str(round(result["hitRate"]*100, 1)) + "%" if result["hitRate"] is not None else ""))
+    return results
+
+def WriteBenchmarkJSON (results, path):
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "results": results,
+    }
+    with open(path, "w") as file:
+        json.dump(report, file, indent = 2)
+
+def WriteBenchmarkCSV (results, path):
+    with open(path, "w", newline = "") as file:
+        writer = csv.DictWriter(file, fieldnames = BENCHMARK_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+"""
+Compares nodes/sec with an earlier JSON report and returns the runs that got slower by more than threshold
+only runs long enough to time (at least 10ms in the baseline) are compared
+"""
+def FindRegressions (results, baselinePath, threshold = 0.1):
+    with open(baselinePath) as file:
+        baseline = json.load(file)["results"]
+    baselineRuns = {(run["position"], run["depth"], run["backend"]): run for run in baseline}
+    regressions = []
+    for result in results:
+        old = baselineRuns.get((result["position"], result["depth"], result["backend"]))
+        if old is not None and old["seconds"] >= 0.01 and result["nodesPerSecond"] < old["nodesPerSecond"] * (1 - threshold):
+            regressions.append((result, old))
+    return regressions
+
+def BasicSearch ():
+    return RunBenchmark(positions = ["position5"], maxNodes = 3000000)
 
 
 if __name__ == "__main__":
-    BasicSearch()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description = "perft tools, runs BasicSearch when no command is given")
+    commands = parser.add_subparsers(dest = "command")
+    divide = commands.add_parser("divide", help = "count positions below each root move across a process pool")
+    divide.add_argument("--fen", default = POS5FEN)
+    divide.add_argument("--depth", type = int, default = 4)
+    divide.add_argument("--workers", type = int, default = None, help = "worker processes, defaults to the cpu count")
+    divide.add_argument("--backend", default = "mailbox", choices = ("mailbox", "bitboard"))
+    divide.add_argument("--hash", type = int, default = 0, help = "MB of perft cache per worker, 0 turns it off")
+    hashed = commands.add_parser("hashed", help = "run the hashed perft next to the plain one and report the hit rate and speedup")
+    hashed.add_argument("--fen", default = POS5FEN)
+    hashed.add_argument("--depth", type = int, default = 4)
+    hashed.add_argument("--backend", default = "mailbox", choices = ("mailbox", "bitboard"))
+    hashed.add_argument("--hash", type = int, default = 64, help = "MB of perft cache")
+    hashMove = commands.add_parser("hashmove", help = "check perft on the reference positions with a hash move, underpromotions included, at every node")
+    hashMove.add_argument("--positions", nargs = "+", choices = tuple(PERFT_POSITIONS), default = None)
+    hashMove.add_argument("--max-nodes", type = int, default = 100000, help = "skip depths with more known nodes than this")
+    hashMove.add_argument("--backend", default = "mailbox", choices = ("mailbox", "bitboard"))
+    bench = commands.add_parser("bench", help = "check and time perft on the reference positions")
+    bench.add_argument("--positions", nargs = "+", choices = tuple(PERFT_POSITIONS), default = None)
+    bench.add_argument("--max-nodes", type = int, default = 1000000, help = "skip depths with more known nodes than this")
+    bench.add_argument("--max-depth", type = int, default = None)
+    bench.add_argument("--backend", default = "mailbox", choices = ("mailbox", "bitboard"))
+    bench.add_argument("--hash", type = int, default = 0, help = "MB of perft cache, 0 turns it off")
+    bench.add_argument("--json", default = None, help = "write the results to this JSON file")
+    bench.add_argument("--csv", default = None, help = "write the results to this CSV file")
+    bench.add_argument("--baseline", default = None, help = "JSON results of an earlier run to compare nodes/sec with")
+    bench.add_argument("--threshold", type = float, default = 0.1, help = "allowed nodes/sec drop against the baseline")
+    args = parser.parse_args()
+
+    if args.command == "divide":
+        start = time.time()
+        ParallelSearchTree(args.fen, args.depth, args.workers, args.backend, args.hash)
+        print("time taken: " + str(round((time.time() - start)*1000)) + " milliseconds")
+    elif args.command == "hashed":
+        sys.exit(0 if CompareHashedSearch(args.fen, args.depth, args.hash, args.backend) else 1)
+    elif args.command == "hashmove":
+        sys.exit(0 if CheckHashMoveSearch(args.positions, args.max_nodes, args.backend) else 1)
+    elif args.command == "bench":
+        results = RunBenchmark(args.positions, args.max_nodes, args.max_depth, args.backend, args.hash)
+        if args.json:
+            WriteBenchmarkJSON(results, args.json)
+        if args.csv:
+            WriteBenchmarkCSV(results, args.csv)
+        failed = False
+        for result in results:
+            if not result["correct"]:
+                failed = True
+        if args.baseline:
+            for result, old in FindRegressions(results, args.baseline, args.threshold):
+                print("regression: " + result["position"] + " depth " + str(result["depth"]) + " " +
+                      str(old["nodesPerSecond"]) + " -> " + str(result["nodesPerSecond"]) + " nodes/sec")
+                failed = True
+        sys.exit(1 if failed else 0)
+    else:
+        BasicSearch()
\ No newline at end of file
@@ -0,0 +1,258 @@
+"""
+Vectorised attack maps, check status and legal move counts for a whole batch of positions at once
+Works on stacked numpy arrays of mailbox boards so labelling a dataset doesn't go through getPinsChecks and getValidMoves one GameState at a time
+Each position becomes one uint64 bitboard per piece (bit i is square i like BitboardEngine) and every ray step, knight jump and pawn move
+is one shift over the whole batch, positions with black to move are flipped so the side to move is always white moving up the board
+"""
+
+import sys
+import time
+import random
+import numpy as np
+from ChessEngine import BOARD_DIM, DIRECTIONS, RAYS, SQUARE_TO_POS, OPPOSITE_DIRECTION, set_board
+
+SQUARES = BOARD_DIM * BOARD_DIM
+FULL = np.uint64((1 << SQUARES) - 1)
+ROW_0 = np.uint64(0xFF) # the promotion row once every position is flipped to white to move
+ROW_5 = np.uint64(0xFF << 40) # where a pawn that can still push twice lands after one push
+
+# line a ray direction runs along, 0 file, 1 rank, 2 and 3 the two diagonals, a pinned piece only moves along its pin line
+DIRECTION_LINE = (0, 1, 0, 1, 2, 3, 3, 2)
+
+def _toMask(squares):
+    mask = 0
+    for sq in squares:
+        mask |= 1 << sq
+    return mask
+
+# castling rights bits as in GameState.getCastlingRights with the two colours swapped
+SWAP_CASTLING = np.array([((rights & 3) << 2) | (rights >> 2) for rights in range(16)], dtype = np.uint8)
+
+# (index step, squares the step can start from) for each ray direction, masking the start squares first stops a shift wrapping round the board
+RAY_STEPS = tuple((dr*BOARD_DIM + dc, np.uint64(_toMask(sq for sq in range(SQUARES) if RAYS[sq][d]))) for d, (dr, dc) in enumerate(DIRECTIONS))
+KNIGHT_STEPS = tuple((dr*BOARD_DIM + dc, np.uint64(_toMask(sq for sq, (row, col) in enumerate(SQUARE_TO_POS)
+                                                            if 0 <= row + dr < BOARD_DIM and 0 <= col + dc < BOARD_DIM)))
+                     for dr, dc in ((2,1), (1,2), (-2,1), (-1,2), (2,-1), (1,-2), (-2,-1), (-1,-2)))
+WHITE_PAWN_CAPTURES = (4, 5) # ray directions a white pawn captures in
+BLACK_PAWN_CAPTURES = (6, 7)
+
+if hasattr(np, "bitwise_count"):
+    popcount = np.bitwise_count
+else: # numpy before 2.0
+    _BYTE_COUNTS = np.array([bin(byte).count("1") for byte in range(256)], dtype = np.uint8)
+    def popcount(bitboards):
+        return _BYTE_COUNTS[bitboards.view(np.uint8).reshape(-1, 8)].sum(axis = 1)
+
+
+def _shift(bitboards, step):
+    step, sources = step
+    bitboards = bitboards & sources
+    if step > 0:
+        return bitboards << np.uint64(step)
+    return bitboards >> np.uint64(-step)
+
+
+# squares reached from every set bit along direction d, stopping on and including the first square that isn't empty
+# two pieces on the same line never reach the same square because the nearer one stops the other
+def _rayFill(pieces, d, empty):
+    reached = np.zeros_like(pieces)
+    frontier = pieces
+    for _ in range(BOARD_DIM - 1):
+        frontier = _shift(frontier, RAY_STEPS[d])
+        reached |= frontier
+        frontier &= empty
+        if not frontier.any():
+            break
+    return reached
+
+
+def _knightAttacks(knights):
+    attacks = np.zeros_like(knights)
+    for step in KNIGHT_STEPS:
+        attacks |= _shift(knights, step)
+    return attacks
+
+
+def _kingAttacks(kings):
+    attacks = np.zeros_like(kings)
+    for step in RAY_STEPS:
+        attacks |= _shift(kings, step)
+    return attacks
+
+
+"""
+Pulls the arrays the batch functions take out of GameStates
+boards N x 64 uint8 piece codes, sides N bools (True for white to move), castling N rights bits as in GameState.getCastlingRights
+and enPassant N en passant square indexes with -1 for none, the same layout as BoardEncoder.statesToArrays
+"""
+def statesToArrays(gameStates):
+    boards = np.frombuffer(b''.join(bytes(gameState.board) for gameState in gameStates), dtype = np.uint8).reshape(-1, SQUARES)
+    sides = np.array([gameState.whitesMove for gameState in gameStates], dtype = bool)
+    castling = np.array([gameState.getCastlingRights() for gameState in gameStates], dtype = np.uint8)
+    enPassant = np.array([gameState.enPassant[0]*BOARD_DIM + gameState.enPassant[1] if gameState.enPassant != () else -1
+                          for gameState in gameStates], dtype = np.int64)
+    return boards, sides, castling, enPassant
+
+
+# one uint64 bitboard per piece code for every board, index 0 is unused
+def toBitboards(boards):
+    bitboards = [None]
+    for piece in range(1, 13):
+        bitboards.append(np.packbits(boards == piece, axis = 1, bitorder = 'little').view('<u8').ravel().astype(np.uint64))
+    return bitboards
+
+
+"""
+Works out for every position in the batch:
+inCheck N bools, whether the side to move is in check
+moveCounts N ints, the number of legal moves counted like GameState.countValidMoves (each promotion piece is a move)
+attacked N x 64 bools, the squares the side not to move attacks, the same squares as GameState.getAttackMap
+The arrays can be torch tensors from BoardEncoder as well, every position needs exactly one king of each colour
+"""
+def analyseBatch(boards, sides, castling, enPassant):
+    boards = np.asarray(boards, dtype = np.uint8).reshape(-1, SQUARES)
+    sides = np.asarray(sides, dtype = bool)
+    castling = np.asarray(castling, dtype = np.uint8)
+    enPassant = np.asarray(enPassant, dtype = np.int64)
+    n = boards.shape[0]
+
+    # flipping the board top to bottom is a byte swap, the colours swap with it
+    bitboards = toBitboards(boards)
+    own = [None] + [np.where(sides, bitboards[piece], bitboards[piece + 6].byteswap()) for piece in range(1, 7)]
+    enemy = [None] + [np.where(sides, bitboards[piece + 6], bitboards[piece].byteswap()) for piece in range(1, 7)]
+    castling = np.where(sides, castling, SWAP_CASTLING[castling])
+    enPassant = np.where(sides | (enPassant < 0), enPassant, enPassant ^ 56)
+    epSquares = np.where(enPassant >= 0, np.uint64(1) << np.maximum(enPassant, 0).astype(np.uint64), np.uint64(0))
+
+    king, queens, rooks, bishops, knights, pawns = own[1:]
+    ownPieces = king | queens | rooks | bishops | knights | pawns
+    enemyPieces = enemy[1] | enemy[2] | enemy[3] | enemy[4] | enemy[5] | enemy[6]
+    empty = ~(ownPieces | enemyPieces)
+    enemySliders = [enemy[2] | (enemy[3] if d < 4 else enemy[4]) for d in range(len(DIRECTIONS))]
+
+    # sliders see through the king so it can't step back along the line of a check, like GameState.computeAttackMap
+    attacked = _kingAttacks(enemy[1]) | _knightAttacks(enemy[5])
+    for d in BLACK_PAWN_CAPTURES:
+        attacked |= _shift(enemy[6], RAY_STEPS[d])
+    for d in range(len(DIRECTIONS)):
+        attacked |= _rayFill(enemySliders[d], d, empty | king)
+
+    # checks and pins, looking out from the king along every ray
+    numChecks = np.zeros(n, dtype = np.int64)
+    blockSquares = np.zeros(n, dtype = np.uint64)
+    pinned = np.zeros(n, dtype = np.uint64)
+    pinnedOnLine = [np.zeros(n, dtype = np.uint64) for _ in range(4)]
+    for d in range(len(DIRECTIONS)):
+        ray = _rayFill(king, d, empty)
+        checked = (ray & enemySliders[d]) != 0
+        numChecks += checked
+        blockSquares |= np.where(checked, ray, np.uint64(0))
+        blocker = ray & ownPieces
+        pin = np.where((_rayFill(blocker, d, empty) & enemySliders[d]) != 0, blocker, np.uint64(0))
+        pinned |= pin
+        pinnedOnLine[DIRECTION_LINE[d]] |= pin
+    knightCheckers = _knightAttacks(king) & enemy[5]
+    pawnCheckers = (_shift(king, RAY_STEPS[4]) | _shift(king, RAY_STEPS[5])) & enemy[6]
+    numChecks += popcount(knightCheckers) + popcount(pawnCheckers)
+    inCheck = numChecks > 0
+
+    # squares a piece other than the king can move to, anywhere out of check, the checker or a square between in single check
+    evasion = np.where(numChecks == 0, FULL, np.where(numChecks == 1, blockSquares | knightCheckers | pawnCheckers, np.uint64(0)))
+    targets = evasion & ~ownPieces
+
+    moveCounts = np.zeros(n, dtype = np.int64)
+    for d in range(len(DIRECTIONS)):
+        movers = (queens | (rooks if d < 4 else bishops)) & ~(pinned & ~pinnedOnLine[DIRECTION_LINE[d]])
+        moveCounts += popcount(_rayFill(movers, d, empty) & targets)
+    for step in KNIGHT_STEPS:
+        moveCounts += popcount(_shift(knights & ~pinned, step) & targets)
+    moveCounts += popcount(_kingAttacks(king) & ~ownPieces & ~attacked)
+    # the rights say the king and rook are still home so only the squares in between and the king's path are looked at
+    kingSide = np.uint64(0x3 << 61)
+    queenSide = np.uint64(0x7 << 57)
+    queenSidePath = np.uint64(0x3 << 58)
+    moveCounts += ~inCheck & ((castling & 1) != 0) & ((kingSide & ~empty) == 0) & ((kingSide & attacked) == 0)
+    moveCounts += ~inCheck & ((castling & 2) != 0) & ((queenSide & ~empty) == 0) & ((queenSidePath & attacked) == 0)
+
+    # pawn moves onto row 0 count once per promotion piece
+    pushers = pawns & ~(pinned & ~pinnedOnLine[0])
+    single = _shift(pushers, RAY_STEPS[0]) & empty
+    double = _shift(single & ROW_5, RAY_STEPS[0]) & empty
+    moveCounts += popcount(single & evasion) + 3*popcount(single & evasion & ROW_0) + popcount(double & evasion)
+    for d in WHITE_PAWN_CAPTURES:
+        captures = _shift(pawns & ~(pinned & ~pinnedOnLine[DIRECTION_LINE[d]]), RAY_STEPS[d]) & enemyPieces & evasion
+        moveCounts += popcount(captures) + 3*popcount(captures & ROW_0)
+
+    # en passant takes two pawns off one rank so it can uncover the king in ways a pin doesn't show
+    # each capture is played on the bitboards of the few positions that have one and the king is checked for slider attacks
+    withEnPassant = np.nonzero(epSquares)[0]
+    if len(withEnPassant):
+        epSq = epSquares[withEnPassant]
+        captured = epSq << np.uint64(BOARD_DIM)
+        epKing = king[withEnPassant]
+        occupied = ~empty[withEnPassant]
+        stillChecked = (knightCheckers[withEnPassant] | (pawnCheckers[withEnPassant] & ~captured)) != 0
+        for d in WHITE_PAWN_CAPTURES:
+            capturer = _shift(epSq, RAY_STEPS[OPPOSITE_DIRECTION[d]]) & pawns[withEnPassant]
+            epEmpty = ~(occupied ^ capturer ^ captured ^ epSq)
+            exposed = stillChecked.copy()
+            for kingDirection in range(len(DIRECTIONS)):
+                exposed |= (_rayFill(epKing, kingDirection, epEmpty) & enemySliders[kingDirection][withEnPassant]) != 0
+            moveCounts[withEnPassant] += (capturer != 0) & ~exposed
+
+    attacked = np.where(sides, attacked, attacked.byteswap())
+    attackedSquares = np.unpackbits(attacked.astype('<u8').view(np.uint8).reshape(n, 8), axis = 1, bitorder = 'little').astype(bool)
+    return inCheck, moveCounts, attackedSquares
+
+
+def analyseStates(gameStates):
+    return analyseBatch(*statesToArrays(gameStates))
+
+
+"""
+Runs the scalar GameState code on every position and returns the indexes where the batch results disagree with it
+Meant for checking a sample of a dataset before labelling the rest in batches
+"""
+def checkAgainstScalar(gameStates):
+    inCheck, moveCounts, attacked = analyseStates(gameStates)
+    mismatches = []
+    for i, gameState in enumerate(gameStates):
+        count = 0
+        for move in gameState.generateMoves():
+            count += 4 if move.isPawnPromotion else 1
+        attackMap = int.from_bytes(np.packbits(attacked[i], bitorder = 'little').tobytes(), 'little')
+        if gameState.inCheck != inCheck[i] or count != moveCounts[i] or gameState.getAttackMap() != attackMap:
+            mismatches.append(i)
+    return mismatches
+
+
+# the end positions of random games of random length, so the sample covers openings, middlegames and endings
+def randomPositions(count, seed = 0):
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        gameState = set_board()
+        for _ in range(rng.randrange(1, 200)):
+            moves = gameState.getValidMoves()
+            if not moves:
+                break
+            gameState.makeMove(rng.choice(moves))
+        positions.append(gameState)
+    return positions
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    gameStates = randomPositions(count)
+    mismatches = checkAgainstScalar(gameStates)
+    print(str(len(gameStates) - len(mismatches)) + " of " + str(len(gameStates)) + " positions match the scalar code")
+    start = time.perf_counter()
+    analyseStates(gameStates)
+    batchSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for gameState in gameStates:
+        gameState.countValidMoves()
+        gameState.getAttackMap()
+    scalarSeconds = time.perf_counter() - start
+    print("batch: " + str(int(len(gameStates) / batchSeconds)) + " positions/sec scalar: " + str(int(len(gameStates) / scalarSeconds)) + " positions/sec")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,500 @@
+"""
+Bitboard backend for GameState
+Keeps one 64 bit integer per piece type and colour and generates legal moves with shifts and masks
+Bit i of a bitboard is mailbox square i, so a1 is bit 56 and h8 is bit 7
+"""
+
+from ChessEngine import GameState, packedMove, BOARD_DIM, DIRECTIONS, ROOK_DIRECTIONS, BISHOP_DIRECTIONS, \
+    RAYS, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, BETWEEN, LINE, SQUARE_MASK, MOVE_SQUARES_MASK, PROMOTION_BITS, \
+    FLAG_EN_PASSANT, FLAG_CASTLING, FLAG_PROMOTION, DEFAULT_PROMOTION, captureOrder
+
+FULL = (1 << 64) - 1
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+NOT_FILE_A = FULL ^ FILE_A
+NOT_FILE_H = FULL ^ FILE_H
+BACK_RANKS = 0xFF000000000000FF
+DOUBLE_PUSH_RANKS = (0xFF << 40, 0xFF << 16) # the rank a double pawn push passes over, white then black
+# king side then queen side castling, white then black
+CASTLING_CODES = (60 | (62 << 6) | FLAG_CASTLING, 60 | (58 << 6) | FLAG_CASTLING, 4 | (6 << 6) | FLAG_CASTLING, 4 | (2 << 6) | FLAG_CASTLING)
+
+def _toMask(squares):
+    mask = 0
+    for sq in squares:
+        mask |= 1 << sq
+    return mask
+
+# bitmask versions of the ChessEngine tables
+# RAY_MASKS is indexed [direction][square] and a ray with a positive index step has its nearest blocker at the lowest set bit
+RAY_MASKS = [[_toMask(RAYS[sq][d]) for sq in range(64)] for d in range(len(DIRECTIONS))]
+POSITIVE = [dr*BOARD_DIM + dc > 0 for dr, dc in DIRECTIONS]
+ROOK_EMPTY = [_toMask(sq for d in ROOK_DIRECTIONS for sq in RAYS[start][d]) for start in range(64)]
+BISHOP_EMPTY = [_toMask(sq for d in BISHOP_DIRECTIONS for sq in RAYS[start][d]) for start in range(64)]
+
+# slider attacks found by walking each ray up to its first blocker, only used to fill the lookup tables below
+def _rayAttacks(sq, occupied, directions):
+    attacks = 0
+    for d in directions:
+        ray = RAY_MASKS[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if POSITIVE[d]:
+                ray ^= RAY_MASKS[d][(blockers & -blockers).bit_length() - 1]
+            else:
+                ray ^= RAY_MASKS[d][blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+# every subset of mask (walked with the carry rippler trick) to the attacks from sq with those squares occupied
+# identical attack sets share one int so the table stays small
+def _attackTable(sq, mask, directions):
+    table = {}
+    shared = {}
+    subset = 0
+    while True:
+        attacks = _rayAttacks(sq, subset, directions)
+        table[subset] = shared.setdefault(attacks, attacks)
+        subset = (subset - mask) & mask
+        if subset == 0:
+            return table
+
+"""
+Slider attacks by table lookup instead of ray walks, ROOK_TABLE[sq][occupied & ROOK_MASK[sq]] is a rook's attacks from sq
+the masks are the squares whose occupancy matters, a ray's last square never blocks anything behind it so it is left out
+about 100,000 rook and 5,000 bishop entries, built once at import in around 0.1 seconds
+the move generator inlines these lookups, rookAttacks and bishopAttacks are the same thing as functions
+"""
+ROOK_MASK = [_toMask(sq for d in ROOK_DIRECTIONS for sq in RAYS[start][d][:-1]) for start in range(64)]
+BISHOP_MASK = [_toMask(sq for d in BISHOP_DIRECTIONS for sq in RAYS[start][d][:-1]) for start in range(64)]
+ROOK_TABLE = [_attackTable(sq, ROOK_MASK[sq], ROOK_DIRECTIONS) for sq in range(64)]
+BISHOP_TABLE = [_attackTable(sq, BISHOP_MASK[sq], BISHOP_DIRECTIONS) for sq in range(64)]
+
+def rookAttacks(sq, occupied):
+    return ROOK_TABLE[sq][occupied & ROOK_MASK[sq]]
+
+def bishopAttacks(sq, occupied):
+    return BISHOP_TABLE[sq][occupied & BISHOP_MASK[sq]]
+
+
+class BitboardGameState(GameState):
+    def __init__(self, board, *position):
+        super().__init__(board, *position)
+        # bitboards[piece] holds every square with that piece on it, index 0 is unused
+        self.bitboards = [0] * 13
+        for sq in range(64):
+            if board[sq] != 0:
+                self.bitboards[board[sq]] |= 1 << sq
+        # every white piece and every black piece, kept up to date with the piece bitboards
+        bb = self.bitboards
+        self.occupancy = [bb[1] | bb[2] | bb[3] | bb[4] | bb[5] | bb[6], bb[7] | bb[8] | bb[9] | bb[10] | bb[11] | bb[12]]
+        # the bitboards and occupancy from before each move in moveLog, undoMove puts them back instead of flipping bits
+        self.bitboardLog = []
+
+    # flips the bits a move touches in fresh copies of the bitboards, the old lists go on bitboardLog for undoMove
+    def toggleMoveBits(self, thisMove, finalPiece):
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        self.bitboardLog.append((bitboards, occupancy))
+        self.bitboards = bitboards = bitboards[:]
+        code = thisMove.code
+        end = (code >> 6) & SQUARE_MASK
+        startBit = 1 << (code & SQUARE_MASK)
+        endBit = 1 << end
+        movingPiece = thisMove.movingPiece
+        capturedPiece = thisMove.capturedPiece
+        color = 0 if movingPiece <= 6 else 1
+        bitboards[movingPiece] ^= startBit
+        bitboards[finalPiece] ^= endBit
+        if color == 0:
+            self.occupancy = occupancy = [occupancy[0] ^ startBit ^ endBit, occupancy[1]]
+        else:
+            self.occupancy = occupancy = [occupancy[0], occupancy[1] ^ startBit ^ endBit]
+        if capturedPiece != 0:
+            if code & FLAG_EN_PASSANT:
+                capturedBit = 1 << (((code & SQUARE_MASK) & ~7) | (end & 7))
+            else:
+                capturedBit = endBit
+            bitboards[capturedPiece] ^= capturedBit
+            occupancy[1 - color] ^= capturedBit
+        if code & FLAG_CASTLING:
+            if end & 7 == 2: # queen side rook jumps from the a file to the d file
+                rookBits = (1 << (end - 2)) | (1 << (end + 1))
+            else: # king side rook jumps from the h file to the f file
+                rookBits = (1 << (end + 1)) | (1 << (end - 1))
+            bitboards[3 if color == 0 else 9] ^= rookBits
+            occupancy[color] ^= rookBits
+
+    def makeMove(self, thisMove):
+        GameState.makeMove(self, thisMove)
+        self.toggleMoveBits(thisMove, self.board[(thisMove.code >> 6) & SQUARE_MASK])
+
+    def undoMove(self):
+        if len(self.moveLog) != 0:
+            GameState.undoMove(self)
+            self.bitboards, self.occupancy = self.bitboardLog.pop()
+
+    # whether the side not to move attacks sq, occupied is the set of pieces that block its sliders
+    def isAttacked(self, sq, occupied):
+        bb = self.bitboards
+        if self.whitesMove:
+            enemyKing, enemyQueens, enemyRooks, enemyBishops, enemyKnights, enemyPawns, color = bb[7], bb[8], bb[9], bb[10], bb[11], bb[12], 0
+        else:
+            enemyKing, enemyQueens, enemyRooks, enemyBishops, enemyKnights, enemyPawns, color = bb[1], bb[2], bb[3], bb[4], bb[5], bb[6], 1
+        return (KNIGHT_ATTACKS[sq] & enemyKnights) != 0 or (PAWN_ATTACKS[color][sq] & enemyPawns) != 0 or \
+               (KING_ATTACKS[sq] & enemyKing) != 0 or (ROOK_TABLE[sq][occupied & ROOK_MASK[sq]] & (enemyRooks | enemyQueens)) != 0 or \
+               (BISHOP_TABLE[sq][occupied & BISHOP_MASK[sq]] & (enemyBishops | enemyQueens)) != 0
+
+    """
+    What every legal move of the side to move has to respect, shared by getMoveTargets and countValidMoves
+    returns the king's square and the squares it can move to, the pieces giving check, the squares a non king move has to land on
+    (every square when not in check) and the pinned pieces with the line each of them can still move along
+    """
+    def getLegalMasks(self):
+        bb = self.bitboards
+        white, black = self.occupancy
+        occupied = white | black
+        if self.whitesMove:
+            us, king, color = white, bb[1], 0
+            enemyKing, enemyLines, enemyDiagonals, enemyKnights, enemyPawns = bb[7], bb[9] | bb[8], bb[10] | bb[8], bb[11], bb[12]
+        else:
+            us, king, color = black, bb[7], 1
+            enemyKing, enemyLines, enemyDiagonals, enemyKnights, enemyPawns = bb[1], bb[3] | bb[2], bb[4] | bb[2], bb[5], bb[6]
+        kingSq = king.bit_length() - 1
+        checkers = (KNIGHT_ATTACKS[kingSq] & enemyKnights) | (PAWN_ATTACKS[color][kingSq] & enemyPawns) | \
+                   (ROOK_TABLE[kingSq][occupied & ROOK_MASK[kingSq]] & enemyLines) | \
+                   (BISHOP_TABLE[kingSq][occupied & BISHOP_MASK[kingSq]] & enemyDiagonals)
+        self.inCheck = checkers != 0
+
+        # pawn, knight and king attacks come off the king's squares all at once, then sliders, which see through the king
+        # so it can't step back along a check, either by looking up each square left or by taking every slider's attacks off
+        kingTargets = KING_ATTACKS[kingSq] & ~us & ~KING_ATTACKS[enemyKing.bit_length() - 1]
+        if color == 0:
+            kingTargets &= ~(((enemyPawns & NOT_FILE_A) << 7) | ((enemyPawns & NOT_FILE_H) << 9))
+        else:
+            kingTargets &= ~(((enemyPawns & NOT_FILE_A) >> 9) | ((enemyPawns & NOT_FILE_H) >> 7))
+        pieces = enemyKnights if kingTargets else 0
+        while pieces:
+            lsb = pieces & -pieces
+            kingTargets &= ~KNIGHT_ATTACKS[lsb.bit_length() - 1]
+            pieces ^= lsb
+        withoutKing = occupied ^ king
+        if kingTargets.bit_count() * 2 <= enemyLines.bit_count() + enemyDiagonals.bit_count():
+            candidates = kingTargets
+            while candidates:
+                lsb = candidates & -candidates
+                sq = lsb.bit_length() - 1
+                if (ROOK_TABLE[sq][withoutKing & ROOK_MASK[sq]] & enemyLines) or (BISHOP_TABLE[sq][withoutKing & BISHOP_MASK[sq]] & enemyDiagonals):
+                    kingTargets ^= lsb
+                candidates ^= lsb
+        else:
+            pieces = enemyLines
+            while pieces:
+                lsb = pieces & -pieces
+                sq = lsb.bit_length() - 1
+                kingTargets &= ~ROOK_TABLE[sq][withoutKing & ROOK_MASK[sq]]
+                pieces ^= lsb
+            pieces = enemyDiagonals
+            while pieces:
+                lsb = pieces & -pieces
+                sq = lsb.bit_length() - 1
+                kingTargets &= ~BISHOP_TABLE[sq][withoutKing & BISHOP_MASK[sq]]
+                pieces ^= lsb
+
+        # squares a non king move has to land on, none in double check
+        if not checkers:
+            evasions = FULL
+        elif checkers & (checkers - 1):
+            evasions = 0
+        else:
+            evasions = checkers | BETWEEN[kingSq][checkers.bit_length() - 1]
+
+        # pieces pinned to the king and the line they are allowed to move along
+        pinned = 0
+        pinLines = {}
+        snipers = (ROOK_EMPTY[kingSq] & enemyLines) | (BISHOP_EMPTY[kingSq] & enemyDiagonals)
+        while snipers:
+            lsb = snipers & -snipers
+            sniperSq = lsb.bit_length() - 1
+            blockers = BETWEEN[kingSq][sniperSq] & occupied
+            if blockers and not (blockers & (blockers - 1)) and blockers & us:
+                pinned |= blockers
+                pinLines[blockers.bit_length() - 1] = LINE[kingSq][sniperSq]
+            snipers ^= lsb
+        return kingSq, kingTargets, checkers, evasions, pinned, pinLines
+
+    """
+    Same stages as GameState.generateMoves, the target masks are all found up front
+    and Move objects are only built for a stage once the search asks for it
+    """
+    def generateMoves(self, hashMove = 0, quiets = True):
+        board = self.board
+        targetList, specialMoves = self.getMoveTargets()
+        inCheck = self.inCheck
+        them = self.occupancy[1] if self.whitesMove else self.occupancy[0]
+
+        # hash move, legal if its end square is one of the targets of its start square
+        # later stages skip its start and end squares, so a hashed underpromotion takes the queen's place
+        yielded = 0
+        if hashMove:
+            start = hashMove & SQUARE_MASK
+            end = (hashMove >> 6) & SQUARE_MASK
+            for sq, targets in targetList:
+                if sq == start and (targets >> end) & 1:
+                    movingPiece = board[start]
+                    code = start | (end << 6)
+                    if (movingPiece == 6 or movingPiece == 12) and (1 << end) & BACK_RANKS:
+                        code |= (FLAG_PROMOTION | (hashMove & PROMOTION_BITS)) if hashMove & PROMOTION_BITS else DEFAULT_PROMOTION
+                    yielded = code & MOVE_SQUARES_MASK
+                    yield packedMove(code, movingPiece, board[end])
+                    break
+            if not yielded:
+                for move in specialMoves:
+                    if move.code & MOVE_SQUARES_MASK == hashMove & MOVE_SQUARES_MASK:
+                        yielded = hashMove & MOVE_SQUARES_MASK
+                        yield move
+                        break
+
+        # captures and promotions, the quiet targets are only kept as masks until the search asks for a quiet move
+        moves = []
+        quietTargets = []
+        for start, targets in targetList:
+            movingPiece = board[start]
+            code = start
+            if movingPiece == 6 or movingPiece == 12:
+                # a pawn that can reach the back row only has promotions and they go with the captures
+                if targets & BACK_RANKS:
+                    code |= DEFAULT_PROMOTION
+                stageMask = them | BACK_RANKS
+            else:
+                stageMask = them
+            if targets & ~stageMask:
+                quietTargets.append((code, movingPiece, targets & ~stageMask))
+            targets &= stageMask
+            while targets:
+                lsb = targets & -targets
+                end = lsb.bit_length() - 1
+                if not yielded or (code | (end << 6)) & MOVE_SQUARES_MASK != yielded:
+                    moves.append(packedMove(code | (end << 6), movingPiece, board[end]))
+                targets ^= lsb
+        for move in specialMoves:
+            if move.code & FLAG_EN_PASSANT and move.code & MOVE_SQUARES_MASK != yielded:
+                moves.append(move)
+        moves.sort(key = captureOrder)
+        yield from moves
+
+        # quiet moves land on empty squares, then castling last
+        if quiets:
+            for code, movingPiece, targets in quietTargets:
+                while targets:
+                    lsb = targets & -targets
+                    end = lsb.bit_length() - 1
+                    if not yielded or (code | (end << 6)) & MOVE_SQUARES_MASK != yielded:
+                        yield packedMove(code | (end << 6), movingPiece, 0)
+                    targets ^= lsb
+            for move in specialMoves:
+                if move.code & FLAG_CASTLING and move.code & MOVE_SQUARES_MASK != yielded:
+                    yield move
+        # searching the moves changes inCheck, leave it as it was for this position
+        self.inCheck = inCheck
+
+    # counts legal moves from the same masks as getMoveTargets without building a target list or Move objects
+    # pawns that aren't pinned are counted a whole side at a time, each promotion is four moves, one per piece
+    def countValidMoves(self):
+        kingSq, kingTargets, checkers, evasions, pinned, pinLines = self.getLegalMasks()
+        bb = self.bitboards
+        white, black = self.occupancy
+        occupied = white | black
+        if self.whitesMove:
+            us, them, color = white, black, 0
+            queens, rooks, bishops, knights, pawns = bb[2], bb[3], bb[4], bb[5], bb[6]
+        else:
+            us, them, color = black, white, 1
+            queens, rooks, bishops, knights, pawns = bb[8], bb[9], bb[10], bb[11], bb[12]
+        count = kingTargets.bit_count()
+        # double check, king has to move
+        if checkers & (checkers - 1):
+            return count
+        targetMask = ~us & evasions
+
+        pieces = knights & ~pinned
+        while pieces:
+            lsb = pieces & -pieces
+            count += (KNIGHT_ATTACKS[lsb.bit_length() - 1] & targetMask).bit_count()
+            pieces ^= lsb
+        pieces = bishops | queens
+        while pieces:
+            lsb = pieces & -pieces
+            sq = lsb.bit_length() - 1
+            targets = BISHOP_TABLE[sq][occupied & BISHOP_MASK[sq]] & targetMask
+            if lsb & pinned:
+                targets &= pinLines[sq]
+            count += targets.bit_count()
+            pieces ^= lsb
+        pieces = rooks | queens
+        while pieces:
+            lsb = pieces & -pieces
+            sq = lsb.bit_length() - 1
+            targets = ROOK_TABLE[sq][occupied & ROOK_MASK[sq]] & targetMask
+            if lsb & pinned:
+                targets &= pinLines[sq]
+            count += targets.bit_count()
+            pieces ^= lsb
+
+        empty = ~occupied & FULL
+        single, double, left, right = self.pawnMasks(pawns & ~pinned, color, empty, them, evasions)
+        count += single.bit_count() + double.bit_count() + left.bit_count() + right.bit_count() + \
+                 3 * (((single | left) & BACK_RANKS).bit_count() + (right & BACK_RANKS).bit_count())
+        pieces = pawns & pinned
+        while pieces:
+            lsb = pieces & -pieces
+            sq = lsb.bit_length() - 1
+            targets = self.pawnTargets(lsb, sq, color, empty, them, evasions) & pinLines[sq]
+            count += targets.bit_count() + 3 * (targets & BACK_RANKS).bit_count()
+            pieces ^= lsb
+
+        return count + len(self.getSpecialMoves(kingSq, occupied, checkers))
+
+    """
+    Where the given pawns can go, a side at a time: single pushes, double pushes, captures towards the a file and towards the h file
+    each mask holds end squares and every end square has only one pawn it can come from
+    """
+    def pawnMasks(self, pawns, color, empty, them, evasions):
+        if color == 0:
+            single = (pawns >> 8) & empty
+            double = ((single & DOUBLE_PUSH_RANKS[0]) >> 8) & empty
+            left = ((pawns & NOT_FILE_A) >> 9) & them
+            right = ((pawns & NOT_FILE_H) >> 7) & them
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & DOUBLE_PUSH_RANKS[1]) << 8) & empty
+            left = ((pawns & NOT_FILE_A) << 7) & them
+            right = ((pawns & NOT_FILE_H) << 9) & them
+        return single & evasions, double & evasions, left & evasions, right & evasions
+
+    # pushes and captures of the one pawn on sq, lsb is its bit
+    def pawnTargets(self, lsb, sq, color, empty, them, evasions):
+        if color == 0:
+            push = (lsb >> 8) & empty
+            if push and sq >> 3 == 6:
+                push |= (push >> 8) & empty
+        else:
+            push = (lsb << 8) & empty
+            if push and sq >> 3 == 1:
+                push |= (push << 8) & empty
+        return (push | (PAWN_ATTACKS[color][sq] & them)) & evasions
+
+    # legal target squares as (start square, target bitboard) pairs, the king first and then only pieces that can move
+    # plus the en passant and castling moves which are built directly
+    def getMoveTargets(self):
+        kingSq, kingTargets, checkers, evasions, pinned, pinLines = self.getLegalMasks()
+        bb = self.bitboards
+        white, black = self.occupancy
+        occupied = white | black
+        if self.whitesMove:
+            us, them, color = white, black, 0
+            queens, rooks, bishops, knights, pawns = bb[2], bb[3], bb[4], bb[5], bb[6]
+        else:
+            us, them, color = black, white, 1
+            queens, rooks, bishops, knights, pawns = bb[8], bb[9], bb[10], bb[11], bb[12]
+        targetList = [(kingSq, kingTargets)]
+        # double check, king has to move
+        if checkers & (checkers - 1):
+            return targetList, []
+        targetMask = ~us & evasions
+
+        # knights, a pinned knight can never move
+        pieces = knights & ~pinned
+        while pieces:
+            lsb = pieces & -pieces
+            sq = lsb.bit_length() - 1
+            targets = KNIGHT_ATTACKS[sq] & targetMask
+            if targets:
+                targetList.append((sq, targets))
+            pieces ^= lsb
+
+        # sliding pieces, a queen gets one entry for its diagonals and one for its lines
+        pieces = bishops | queens
+        while pieces:
+            lsb = pieces & -pieces
+            sq = lsb.bit_length() - 1
+            targets = BISHOP_TABLE[sq][occupied & BISHOP_MASK[sq]] & targetMask
+            if lsb & pinned:
+                targets &= pinLines[sq]
+            if targets:
+                targetList.append((sq, targets))
+            pieces ^= lsb
+        pieces = rooks | queens
+        while pieces:
+            lsb = pieces & -pieces
+            sq = lsb.bit_length() - 1
+            targets = ROOK_TABLE[sq][occupied & ROOK_MASK[sq]] & targetMask
+            if lsb & pinned:
+                targets &= pinLines[sq]
+            if targets:
+                targetList.append((sq, targets))
+            pieces ^= lsb
+
+        # pawns that aren't pinned pick their targets out of the masks for the whole side
+        empty = ~occupied & FULL
+        single, double, left, right = self.pawnMasks(pawns & ~pinned, color, empty, them, evasions)
+        pieces = pawns & ~pinned
+        while pieces:
+            lsb = pieces & -pieces
+            if color == 0:
+                targets = ((lsb >> 8) & single) | ((lsb >> 16) & double) | ((lsb >> 9) & left) | ((lsb >> 7) & right)
+            else:
+                targets = ((lsb << 8) & single) | ((lsb << 16) & double) | ((lsb << 7) & left) | ((lsb << 9) & right)
+            if targets:
+                targetList.append((lsb.bit_length() - 1, targets))
+            pieces ^= lsb
+        pieces = pawns & pinned
+        while pieces:
+            lsb = pieces & -pieces
+            sq = lsb.bit_length() - 1
+            targets = self.pawnTargets(lsb, sq, color, empty, them, evasions) & pinLines[sq]
+            if targets:
+                targetList.append((sq, targets))
+            pieces ^= lsb
+
+        return targetList, self.getSpecialMoves(kingSq, occupied, checkers)
+
+    # en passant and castling moves, built as Moves since they move a second piece
+    def getSpecialMoves(self, kingSq, occupied, checkers):
+        specialMoves = []
+        # en passant, tested by lifting both pawns off the board and looking for a slider on the king
+        if self.enPassant != ():
+            bb = self.bitboards
+            if self.whitesMove:
+                color, pawn, enemyPawn = 0, 6, 12
+                enemyLines, enemyDiagonals = bb[9] | bb[8], bb[10] | bb[8]
+            else:
+                color, pawn, enemyPawn = 1, 12, 6
+                enemyLines, enemyDiagonals = bb[3] | bb[2], bb[4] | bb[2]
+            epSq = self.enPassant[0]*BOARD_DIM + self.enPassant[1]
+            capturedSq = epSq + 8 if color == 0 else epSq - 8
+            nonSliderCheckers = checkers & ~enemyLines & ~enemyDiagonals & ~(1 << capturedSq)
+            capturers = PAWN_ATTACKS[1 - color][epSq] & bb[pawn]
+            while capturers and not nonSliderCheckers:
+                lsb = capturers & -capturers
+                sq = lsb.bit_length() - 1
+                after = (occupied ^ lsb ^ (1 << capturedSq)) | (1 << epSq)
+                if not (ROOK_TABLE[kingSq][after & ROOK_MASK[kingSq]] & enemyLines) and \
+                        not (BISHOP_TABLE[kingSq][after & BISHOP_MASK[kingSq]] & enemyDiagonals):
+                    specialMoves.append(packedMove(sq | (epSq << 6) | FLAG_EN_PASSANT, pawn, enemyPawn))
+                capturers ^= lsb
+
+        # castling, the king can't be in check or pass through an attacked square
+        if not checkers:
+            if self.whitesMove:
+                if self.noWKRMove and not (occupied & 0x6000000000000000) and \
+                        not self.isAttacked(61, occupied) and not self.isAttacked(62, occupied):
+                    specialMoves.append(packedMove(CASTLING_CODES[0], 1, 0))
+                if self.noWQRMove and not (occupied & 0x0E00000000000000) and \
+                        not self.isAttacked(59, occupied) and not self.isAttacked(58, occupied):
+                    specialMoves.append(packedMove(CASTLING_CODES[1], 1, 0))
+            else:
+                if self.noBKRMove and not (occupied & 0x60) and not self.isAttacked(5, occupied) and not self.isAttacked(6, occupied):
+                    specialMoves.append(packedMove(CASTLING_CODES[2], 7, 0))
+                if self.noBQRMove and not (occupied & 0x0E) and not self.isAttacked(3, occupied) and not self.isAttacked(2, occupied):
+                    specialMoves.append(packedMove(CASTLING_CODES[3], 7, 0))
+        return specialMoves
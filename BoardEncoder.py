@@ -0,0 +1,136 @@
+"""
+Batched board to tensor encoder for training pipelines
+Turns many GameStates or FEN strings into one N x 18 x 8 x 8 tensor with whole batch tensor ops instead of a Python loop per square
+Planes 0-11 are one per piece (piece code - 1, so white K Q R B N P then black k q r b n p), 12 is all ones when white is to move,
+13-16 are the castling rights (white king side, white queen side, black king side, black queen side) and 17 marks the en passant square
+Row 0 of every plane is rank 8, the same layout as GameState.board and GameState.to_tensor
+"""
+
+import torch
+from ChessEngine import BOARD_DIM, inverseALGNDIC, _EXPAND_PLACEMENT, _PLACEMENT_CODES, _CASTLING_LETTERS
+
+PIECE_PLANES = 12
+SIDE_PLANE = 12
+CASTLING_PLANE = 13 # first of four
+EN_PASSANT_PLANE = 17
+NUM_PLANES = 18
+
+# piece codes 1 to 12 lined up against the piece planes
+_PIECE_CODES = torch.arange(1, PIECE_PLANES + 1, dtype=torch.uint8).view(1, PIECE_PLANES, 1)
+_CASTLING_BITS = torch.tensor([1, 2, 4, 8], dtype=torch.uint8).view(1, 4)
+
+
+"""
+Keeps one output buffer and writes every batch into the front of it so a training loop doesn't allocate per batch
+The tensor returned by encode is a view of the buffer, copy it if it has to outlive the next call
+"""
+class BoardEncoder():
+    def __init__(self, batchSize = 256, dtype = torch.float32, device = "cpu"):
+        self.dtype = dtype
+        self.device = device
+        self.buffer = torch.zeros((batchSize, NUM_PLANES, BOARD_DIM, BOARD_DIM), dtype = dtype, device = device)
+
+    # positions is a list of GameStates, FEN strings or snapshots, the buffer grows if the batch doesn't fit
+    def encode(self, positions):
+        if len(positions) > self.buffer.shape[0]:
+            self.buffer = torch.zeros((len(positions), NUM_PLANES, BOARD_DIM, BOARD_DIM), dtype = self.dtype, device = self.device)
+        return encodeBatch(positions, out = self.buffer[:len(positions)])
+
+
+"""
+Encodes a list of GameStates, FEN strings or snapshots
+out is an optional preallocated N x 18 x 8 x 8 tensor of any dtype that gets filled and returned, otherwise a new tensor is made
+"""
+def encodeBatch(positions, out = None, dtype = torch.float32):
+    if len(positions) == 0:
+        return out if out is not None else torch.empty((0, NUM_PLANES, BOARD_DIM, BOARD_DIM), dtype = dtype)
+    if isinstance(positions[0], str):
+        boards, sides, castling, enPassant = fensToArrays(positions)
+    elif isinstance(positions[0], tuple):
+        boards, sides, castling, enPassant = snapshotsToArrays(positions)
+    else:
+        boards, sides, castling, enPassant = statesToArrays(positions)
+    return encodeArrays(boards, sides, castling, enPassant, out, dtype)
+
+
+# pulls the fields the encoder needs out of GameStates, each mailbox goes through bytes() in C rather than one step per square
+def statesToArrays(gameStates):
+    boards = torch.frombuffer(bytearray(b''.join(bytes(gameState.board) for gameState in gameStates)), dtype = torch.uint8).view(-1, BOARD_DIM * BOARD_DIM)
+    sides = torch.tensor([gameState.whitesMove for gameState in gameStates], dtype = torch.bool)
+    castling = torch.tensor([gameState.getCastlingRights() for gameState in gameStates], dtype = torch.uint8)
+    enPassant = torch.tensor([gameState.enPassant[0]*BOARD_DIM + gameState.enPassant[1] if gameState.enPassant != () else -1
+                              for gameState in gameStates], dtype = torch.long)
+    return boards, sides, castling, enPassant
+
+
+# the fields the encoder reads from a GameState, taken now so the game state can move on before the batch is encoded
+def snapshot(gameState):
+    enPassant = gameState.enPassant[0]*BOARD_DIM + gameState.enPassant[1] if gameState.enPassant != () else -1
+    return (bytes(gameState.board), gameState.whitesMove, gameState.getCastlingRights(), enPassant)
+
+
+def snapshotsToArrays(snapshots):
+    boards = torch.frombuffer(bytearray(b''.join(board for board, side, castling, enPassant in snapshots)), dtype = torch.uint8).view(-1, BOARD_DIM * BOARD_DIM)
+    sides = torch.tensor([side for board, side, castling, enPassant in snapshots], dtype = torch.bool)
+    castling = torch.tensor([castling for board, side, castling, enPassant in snapshots], dtype = torch.uint8)
+    enPassant = torch.tensor([enPassant for board, side, castling, enPassant in snapshots], dtype = torch.long)
+    return boards, sides, castling, enPassant
+
+
+# parses FEN strings without building GameStates, the piece placements of the whole batch are decoded in one table lookup
+# uses ChessEngine.parseFen's tables and raises ValueError on the same bad placements and en passant squares
+def fensToArrays(fens):
+    placements = []
+    sides = []
+    castling = []
+    enPassant = []
+    for fen in fens:
+        fields = fen.split()
+        if not fields:
+            raise ValueError("empty FEN")
+        placement = fields[0].translate(_EXPAND_PLACEMENT)
+        if len(placement) != BOARD_DIM * BOARD_DIM:
+            raise ValueError("FEN placement doesn't describe 64 squares: " + fields[0])
+        placements.append(placement)
+        sides.append(len(fields) < 2 or fields[1] == 'w')
+        rights = 0
+        if len(fields) > 2:
+            for letter in fields[2]:
+                rights |= _CASTLING_LETTERS.get(letter, 0)
+        castling.append(rights)
+        if len(fields) > 3 and fields[3] != '-':
+            if len(fields[3]) != 2 or fields[3][0] not in inverseALGNDIC or fields[3][1] not in "36":
+                raise ValueError("bad en passant square in FEN: " + fields[3])
+            enPassant.append((8 - int(fields[3][1]))*BOARD_DIM + inverseALGNDIC[fields[3][0]])
+        else:
+            enPassant.append(-1)
+    codes = ''.join(placements).encode('ascii', 'replace').translate(_PLACEMENT_CODES)
+    bad = codes.find(255)
+    if bad != -1:
+        raise ValueError("FEN placement doesn't describe 64 squares: " + fens[bad // (BOARD_DIM * BOARD_DIM)].split()[0])
+    boards = torch.frombuffer(bytearray(codes), dtype = torch.uint8).view(len(fens), BOARD_DIM * BOARD_DIM)
+    return boards, torch.tensor(sides, dtype = torch.bool), torch.tensor(castling, dtype = torch.uint8), torch.tensor(enPassant, dtype = torch.long)
+
+
+"""
+Builds the planes from batch arrays: boards N x 64 piece codes, sides N bools (True for white to move),
+castling N rights bits as in GameState.getCastlingRights and enPassant N square indexes with -1 for none
+"""
+def encodeArrays(boards, sides, castling, enPassant, out = None, dtype = torch.float32):
+    n = boards.shape[0]
+    if out is None:
+        out = torch.empty((n, NUM_PLANES, BOARD_DIM, BOARD_DIM), dtype = dtype)
+    elif out.shape != (n, NUM_PLANES, BOARD_DIM, BOARD_DIM):
+        raise ValueError("out has shape " + str(tuple(out.shape)) + ", expected " + str((n, NUM_PLANES, BOARD_DIM, BOARD_DIM)))
+    squares = BOARD_DIM * BOARD_DIM
+    boards = boards.to(out.device)
+    # one hot piece planes, every square is compared against all 12 piece codes at once
+    out[:, :PIECE_PLANES].view(n, PIECE_PLANES, squares).copy_(boards.view(n, 1, squares) == _PIECE_CODES.to(out.device))
+    out[:, SIDE_PLANE].copy_(sides.to(out.device).view(n, 1, 1).expand(n, BOARD_DIM, BOARD_DIM))
+    rights = (castling.view(n, 1) & _CASTLING_BITS) != 0
+    out[:, CASTLING_PLANE:CASTLING_PLANE + 4].copy_(rights.to(out.device).view(n, 4, 1, 1).expand(n, 4, BOARD_DIM, BOARD_DIM))
+    enPassantPlane = out[:, EN_PASSANT_PLANE].view(n, squares)
+    enPassantPlane.zero_()
+    hasEnPassant = enPassant >= 0
+    enPassantPlane[torch.arange(n)[hasEnPassant].to(out.device), enPassant[hasEnPassant].to(out.device)] = 1
+    return out
@@ -4,7 +4,12 @@ Generates chess moves using a NN (probably gonna be a recurrent nn or an lstm id
 
 import torch
 import ChessEngine
+import BoardEncoder
 import random
+import time
+import math
+import threading
+from TranspositionTable import TranspositionTable, encodeMove, EXACT, LOWER_BOUND, UPPER_BOUND
 
 # https://blogs.cornell.edu/info2040/2022/09/30/game-theory-how-stockfish-mastered-chess/
 
@@ -14,3 +19,468 @@ def RandomBot (gameState):
     move = random.randint(0, len(allMoves) - 1)
     return allMoves[move]
 
+MATE_SCORE = 30000
+MATE_BOUND = MATE_SCORE - 1000 # any score past this is a mate in some number of plies
+INFINITY = 32000
+TIME_CHECK_INTERVAL = 128 # nodes between clock checks, a few milliseconds at the speed this searches
+NULL_MOVE_REDUCTION = 2 # a null move is searched this many plies shallower than a real one
+NULL_MOVE_MIN_DEPTH = 3
+MCTS_EXPLORATION = 1.4
+VIRTUAL_LOSS = 1.0 # taken off a node's value while its leaf waits in the evaluation queue so other simulations spread out
+VALUE_SCALE = 4.0 # pawns, a model score becomes a value between -1 and 1 as tanh(score / VALUE_SCALE)
+BOARD_SQUARES = ChessEngine.BOARD_DIM * ChessEngine.BOARD_DIM
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+# checks if the side to move has a piece besides its king and pawns
+# without one zugzwang is common and passing can look better than every real move
+def hasPieces(gameState):
+    first = 2 if gameState.whitesMove else 8 # queen code, the rook, bishop and knight follow it
+    for piece in gameState.board:
+        if first <= piece <= first + 3:
+            return True
+    return False
+
+
+"""
+Iterative deepening negamax with alpha beta pruning, a transposition table and a captures only quiescence search
+Keeps its transposition table between calls so it can be reused move after move
+evaluate scores a quiet position from the side to move's view, GameState.evaluate by default or NNUE.evaluate for the network
+tablebases is a Tablebase.Tablebases, positions with few enough pieces to be in it are scored from the tables instead of searched
+"""
+class AlphaBetaSearch():
+    def __init__(self, ttSizeMB = 16, evaluate = ChessEngine.GameState.evaluate, tablebases = None):
+        self.tt = TranspositionTable(ttSizeMB)
+        self.evaluate = evaluate
+        self.tablebases = tablebases
+        self.resetStats()
+
+    def resetStats(self):
+        self.nodes = 0
+        self.depthReached = 0
+        self.elapsed = 0.0
+        self.nps = 0
+        self.bestScore = 0
+        self.bestMove = None
+        self.stopEvent = None
+
+    """
+    searches until the time limit (seconds), node limit or max depth runs out or stopEvent (a threading.Event) is set
+    returns the best move of the deepest finished iteration, or a better root move found by the unfinished one
+    infoCallback is called with the stats dict after every finished iteration
+    """
+    def search(self, gameState, timeLimit = None, nodeLimit = None, maxDepth = 64, infoCallback = None, stopEvent = None):
+        self.resetStats()
+        self.tt.newSearch()
+        self.startTime = time.perf_counter()
+        self.deadline = self.startTime + timeLimit if timeLimit is not None else None
+        self.nodeLimit = nodeLimit
+        self.stopEvent = stopEvent
+        rootLength = len(gameState.moveLog)
+        rootMoves = gameState.getValidMoves()
+        if rootMoves == []:
+            return None
+        self.bestMove = rootMoves[0]
+        try:
+            for depth in range(1, maxDepth + 1):
+                self.searchRoot(gameState, rootMoves, depth)
+                self.depthReached = depth
+                self.updateTiming()
+                if infoCallback is not None:
+                    infoCallback(self.info())
+                # no point going deeper once a forced mate is found
+                if abs(self.bestScore) > MATE_BOUND:
+                    break
+        except SearchTimeout:
+            # unwind the moves the interrupted search left on the board, None is a null move
+            while len(gameState.moveLog) > rootLength:
+                if gameState.moveLog[-1] is None:
+                    gameState.undoNullMove()
+                else:
+                    gameState.undoMove()
+        self.updateTiming()
+        return self.bestMove
+
+    def updateTiming(self):
+        self.elapsed = time.perf_counter() - self.startTime
+        self.nps = int(self.nodes / self.elapsed) if self.elapsed > 0 else 0
+
+    def info(self):
+        return {
+            "depth": self.depthReached,
+            "score": self.bestScore,
+            "nodes": self.nodes,
+            "nps": self.nps,
+            "time": self.elapsed,
+            "move": self.bestMove.getAlgebraicNotation() if self.bestMove is not None else None,
+        }
+
+    """
+    Best line from the root, the best move and then the best moves stored in the transposition table, as Move objects
+    Every move is checked against generateMoves before it is made and the line stops at a repeated position
+    only call it while the game state is at the root, between iterations or after the search
+    """
+    def principalVariation(self, gameState, maxLength = None):
+        if self.bestMove is None:
+            return []
+        maxLength = maxLength or max(self.depthReached, 1)
+        line = [self.bestMove]
+        gameState.makeMove(self.bestMove)
+        while len(line) < maxLength and gameState.repition == 0:
+            entry = self.tt.probe(gameState.zobristKey)
+            if entry is None or entry[3] == 0:
+                break
+            move = next(gameState.generateMoves(entry[3]), None) # the hash move comes first if it is legal
+            if move is None or encodeMove(move) != entry[3]:
+                break
+            line.append(move)
+            gameState.makeMove(move)
+        for _ in line:
+            gameState.undoMove()
+        return line
+
+    # raises SearchTimeout once the node or time budget is spent or the search is told to stop
+    def checkBudget(self):
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise SearchTimeout()
+        if self.stopEvent is not None and self.stopEvent.is_set():
+            raise SearchTimeout()
+        if self.deadline is not None and self.nodes % TIME_CHECK_INTERVAL == 0 and time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+
+    # searches the root moves, the previous best move goes first so a partial iteration can still improve on it
+    def searchRoot(self, gameState, rootMoves, depth):
+        rootMoves.sort(key = lambda move: move is not self.bestMove)
+        alpha = -INFINITY
+        for move in rootMoves:
+            gameState.makeMove(move)
+            score = -self.negamax(gameState, depth - 1, -INFINITY, -alpha, 1)
+            gameState.undoMove()
+            if score > alpha:
+                alpha = score
+                self.bestMove = move
+                self.bestScore = score
+        self.tt.store(gameState.zobristKey, depth, alpha, EXACT, encodeMove(self.bestMove))
+
+    # allowNull is off right after a null move so two passes in a row can't happen
+    def negamax(self, gameState, depth, alpha, beta, ply, allowNull = True):
+        self.nodes += 1
+        self.checkBudget()
+        # repetition and the 50 move rule are draws, set by makeMove
+        if gameState.repition > 0 or gameState.isStaleMate:
+            return 0
+        if self.tablebases is not None:
+            score = self.probeTablebases(gameState, ply)
+            if score is not None:
+                return score
+        if depth <= 0:
+            return self.quiescence(gameState, alpha, beta, ply)
+
+        key = gameState.zobristKey
+        hashMove = 0
+        entry = self.tt.probe(key)
+        if entry is not None:
+            entryDepth, entryScore, bound, hashMove = entry
+            if entryDepth >= depth:
+                entryScore = scoreFromTT(entryScore, ply)
+                if bound == EXACT or (bound == LOWER_BOUND and entryScore >= beta) or (bound == UPPER_BOUND and entryScore <= alpha):
+                    return entryScore
+
+        # null move pruning, if the opponent can't make use of a free move a real move will fail high too
+        if allowNull and depth >= NULL_MOVE_MIN_DEPTH and beta < MATE_BOUND and hasPieces(gameState) and not gameState.isKingAttacked():
+            gameState.makeNullMove()
+            score = -self.negamax(gameState, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1, ply + 1, False)
+            gameState.undoNullMove()
+            if score >= beta:
+                return beta
+
+        # moves come hash move first then captures, quiet moves are only generated if nothing before them cuts off
+        originalAlpha = alpha
+        bestScore = -INFINITY
+        bestMove = 0
+        for move in gameState.generateMoves(hashMove):
+            gameState.makeMove(move)
+            score = -self.negamax(gameState, depth - 1, -beta, -alpha, ply + 1)
+            gameState.undoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMove = encodeMove(move)
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        if bestScore == -INFINITY: # no legal moves
+            return -MATE_SCORE + ply if gameState.inCheck else 0
+
+        if bestScore >= beta:
+            bound = LOWER_BOUND
+        elif bestScore > originalAlpha:
+            bound = EXACT
+        else:
+            bound = UPPER_BOUND
+        self.tt.store(key, depth, scoreToTT(bestScore, ply), bound, bestMove)
+        return bestScore
+
+    # the exact score of a position in the tablebases or None, counting the pieces first keeps the probe off every other node
+    def probeTablebases(self, gameState, ply):
+        if BOARD_SQUARES - gameState.board.count(0) > self.tablebases.maxPieces:
+            return None
+        found = self.tablebases.probe(gameState)
+        if found is None:
+            return None
+        result, distance = found # result is 1, 0 or -1
+        return result * (MATE_SCORE - ply - distance)
+
+    # only looks at captures so the search doesn't stop in the middle of an exchange
+    def quiescence(self, gameState, alpha, beta, ply):
+        if self.tablebases is not None: # a capture is how a position gets down to tablebase material
+            score = self.probeTablebases(gameState, ply)
+            if score is not None:
+                return score
+        standPat = self.evaluate(gameState)
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        hasMoves = False
+        for move in gameState.generateMoves(quiets = False):
+            hasMoves = True
+            self.nodes += 1
+            self.checkBudget()
+            gameState.makeMove(move)
+            score = -self.quiescence(gameState, -beta, -alpha, ply + 1)
+            gameState.undoMove()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        # with no captures the quiet moves are only generated to tell mate and stalemate apart from a quiet position
+        if not hasMoves and next(gameState.generateMoves(), None) is None:
+            return -MATE_SCORE + ply if gameState.inCheck else 0
+        return alpha
+
+
+# mate scores are stored relative to the node so they stay right when the position is reached at another ply
+def scoreToTT(score, ply):
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+def scoreFromTT(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+_searcher = None
+
+# searching bot, one shared searcher keeps its transposition table from move to move
+# book is an OpeningBook.PolyglotBook that is asked for a move before searching, tablebases a Tablebase.Tablebases for the search to probe
+# infoCallback is called once per move with the search's stats dict, or {"book": True, "move": ...} for a book move
+def AlphaBetaBot (gameState, timeLimit = 1.0, nodeLimit = None, book = None, tablebases = None, infoCallback = None):
+    global _searcher
+    if book is not None:
+        move = book.choose(gameState)
+        if move is not None:
+            if infoCallback is not None:
+                infoCallback({"book": True, "move": move.getAlgebraicNotation()})
+            return move
+    if _searcher is None:
+        _searcher = AlphaBetaSearch()
+    if tablebases is not None:
+        _searcher.tablebases = tablebases
+    move = _searcher.search(gameState, timeLimit = timeLimit, nodeLimit = nodeLimit)
+    if infoCallback is not None:
+        infoCallback(_searcher.info())
+    return move
+
+
+"""
+Collects leaf positions from a search and evaluates them in batches, one torch.no_grad() forward pass per batch
+model takes BoardEncoder planes (N x 18 x 8 x 8) and returns N scores from the side to move's view, like NNUE.NNUENetwork
+A batch runs as soon as batchSize positions are waiting, or once the oldest one has waited maxWait seconds
+Single threaded searches call submit with a callback and flush when they have nothing else to do,
+searches running in several threads can call evaluate, which blocks until the score is back
+"""
+class EvaluationQueue():
+    def __init__(self, model, batchSize = 32, maxWait = 0.005):
+        self.model = model
+        self.batchSize = batchSize
+        self.maxWait = maxWait
+        self.encoder = BoardEncoder.BoardEncoder(batchSize)
+        self.lock = threading.Condition()
+        self.pending = [] # (snapshot, callback) pairs
+        self.oldest = None # time the oldest pending position was submitted
+        self.resetStats()
+
+    def resetStats(self):
+        self.batches = 0
+        self.evaluations = 0
+        self.fullBatches = 0 # batches that ran because batchSize positions were waiting
+        self.forwardTime = 0.0 # seconds spent encoding and in the model
+        self.startTime = time.perf_counter()
+
+    # queues the position, callback(score) is called by whichever call runs its batch
+    def submit(self, gameState, callback):
+        with self.lock:
+            if not self.pending:
+                self.oldest = time.perf_counter()
+            self.pending.append((BoardEncoder.snapshot(gameState), callback))
+            if len(self.pending) >= self.batchSize or time.perf_counter() - self.oldest >= self.maxWait:
+                self.flush()
+
+    # runs one batch of the oldest pending positions and hands the scores to their callbacks, returns the batch size
+    def flush(self):
+        with self.lock:
+            batch = self.pending[:self.batchSize]
+            if not batch:
+                return 0
+            del self.pending[:self.batchSize]
+            self.oldest = time.perf_counter() if self.pending else None
+            start = time.perf_counter()
+            with torch.no_grad():
+                planes = self.encoder.encode([position for position, callback in batch])
+                scores = self.model(planes).view(len(batch)).tolist()
+            self.forwardTime += time.perf_counter() - start
+            self.batches += 1
+            self.evaluations += len(batch)
+            if len(batch) == self.batchSize:
+                self.fullBatches += 1
+            for (position, callback), score in zip(batch, scores):
+                callback(score)
+            self.lock.notify_all()
+            return len(batch)
+
+    # runs every pending position
+    def drain(self):
+        while self.flush():
+            pass
+
+    # blocking evaluation for searches running in threads, waits at most about maxWait for other threads to fill the batch
+    def evaluate(self, gameState):
+        result = []
+        self.submit(gameState, result.append)
+        with self.lock:
+            while not result:
+                if not self.lock.wait_for(lambda: result, self.maxWait):
+                    self.flush()
+        return result[0]
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.startTime
+        return {
+            "batches": self.batches,
+            "evaluations": self.evaluations,
+            "averageBatch": self.evaluations / self.batches if self.batches else 0.0,
+            "fillRate": self.evaluations / (self.batches * self.batchSize) if self.batches else 0.0,
+            "fullBatches": self.fullBatches,
+            "evalsPerSecond": int(self.evaluations / self.forwardTime) if self.forwardTime > 0 else 0, # model throughput
+            "wallEvalsPerSecond": int(self.evaluations / elapsed) if elapsed > 0 else 0, # including the search's own time
+        }
+
+
+class MCTSNode():
+    __slots__ = ("move", "children", "visits", "valueSum", "terminal")
+
+    def __init__(self, move):
+        self.move = move
+        self.children = None # None until the node is expanded
+        self.visits = 0
+        self.valueSum = 0.0 # from the view of the side that played move
+        self.terminal = None # value of a finished game from the same view
+
+
+"""
+Monte Carlo tree search over getValidMoves with leaves scored by a model through an EvaluationQueue
+Every simulation walks down the tree by UCT, expands the leaf and queues it, then goes straight on to the next simulation
+with a virtual loss on the path, the values are backed up when the queue runs the batch the leaf is in
+"""
+class MCTSSearch():
+    def __init__(self, model, batchSize = 32, maxWait = 0.005, exploration = MCTS_EXPLORATION):
+        self.queue = EvaluationQueue(model, batchSize, maxWait)
+        self.exploration = exploration
+        self.simulations = 0
+
+    # returns the most visited root move after the simulations or the time limit (seconds) run out
+    def search(self, gameState, simulations = 800, timeLimit = None):
+        self.queue.resetStats()
+        self.simulations = 0
+        self.root = MCTSNode(None)
+        self.root.children = [MCTSNode(move) for move in gameState.getValidMoves()]
+        if self.root.children == []:
+            return None
+        deadline = time.perf_counter() + timeLimit if timeLimit is not None else None
+        while self.simulations < simulations and (deadline is None or time.perf_counter() < deadline):
+            self.simulate(gameState)
+            self.simulations += 1
+        self.queue.drain()
+        return max(self.root.children, key = lambda child: child.visits).move
+
+    def simulate(self, gameState):
+        node = self.root
+        path = [node]
+        while node.children:
+            node = self.select(node)
+            gameState.makeMove(node.move)
+            path.append(node)
+        for pathNode in path:
+            pathNode.visits += 1
+            pathNode.valueSum -= VIRTUAL_LOSS
+
+        if node.terminal is None and node.children is None:
+            if gameState.repition > 0 or gameState.isStaleMate:
+                node.terminal = 0.0
+            else:
+                moves = gameState.getValidMoves()
+                if moves == []:
+                    node.terminal = 1.0 if gameState.inCheck else 0.0 # the move into the node gave mate
+                else:
+                    node.children = [MCTSNode(move) for move in moves]
+        if node.terminal is not None:
+            self.backup(path, node.terminal)
+        else:
+            self.queue.submit(gameState, lambda score, path = path: self.backup(path, -math.tanh(score / VALUE_SCALE)))
+        for _ in range(len(path) - 1):
+            gameState.undoMove()
+
+    # UCT, unvisited children first, values are from the view of the side to move at node
+    def select(self, node):
+        logVisits = math.log(max(node.visits, 1)) # the root has no visits before its first simulation
+        best = None
+        bestScore = -INFINITY
+        for child in node.children:
+            if child.visits == 0:
+                return child
+            score = child.valueSum / child.visits + self.exploration * math.sqrt(logVisits / child.visits)
+            if score > bestScore:
+                best = child
+                bestScore = score
+        return best
+
+    # value is from the view of the side that played the last move on the path, it flips every ply going up
+    def backup(self, path, value):
+        for node in reversed(path):
+            node.valueSum += value + VIRTUAL_LOSS
+            value = -value
+
+    def info(self):
+        stats = self.queue.stats()
+        stats["simulations"] = self.simulations
+        return stats
+
+
+# Monte Carlo tree search bot, model scores positions from BoardEncoder planes like NNUE.NNUENetwork
+def MCTSBot (gameState, model, simulations = 800, timeLimit = 1.0, batchSize = 32):
+    searcher = MCTSSearch(model, batchSize)
+    move = searcher.search(gameState, simulations = simulations, timeLimit = timeLimit)
+    info = searcher.info()
+    print("simulations: " + str(info["simulations"]) + " batches: " + str(info["batches"]) + " fill rate: " + str(round(info["fillRate"], 2)) +
+          " evals/sec: " + str(info["evalsPerSecond"]))
+    return move
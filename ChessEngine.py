@@ -2,6 +2,9 @@
 Stores board state and determines valid moves and keeps game history
 """
 import torch
+import random
+import functools
+from PieceSquareTables import MG_VALUES, EG_VALUES, PHASE_WEIGHTS, MAX_PHASE, MG_TABLES, EG_TABLES
 
 # initial board set up from whites veiw
 STARTINGFEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
@@ -10,17 +13,119 @@ LASTWHITEPIECE = 6
 LASTBLACKPIECE = 12
 BOARD_DIM = 8
 
-# creates dictionary of distances from edge
-distanceToEdge = {}
-for row in range(BOARD_DIM):
-    for col in range(BOARD_DIM):
-        code = row*10 + col
-        northDis = row + 1
-        westDis = col + 1
-        southDis = BOARD_DIM - row
-        eastDis = BOARD_DIM - col
-        maxDisToEdge = max((northDis,westDis,southDis,eastDis))
-        distanceToEdge[code] = maxDisToEdge
+# precomputed move tables, built once at import so move generation never does bounds checks
+# squares are mailbox indexes, row * 8 + col
+SQUARE_TO_POS = tuple((sq // BOARD_DIM, sq % BOARD_DIM) for sq in range(BOARD_DIM * BOARD_DIM))
+
+# ray directions as (row step, col step), the first four are rook directions and the last four bishop directions
+DIRECTIONS = ((-1,0), (0,-1), (1,0), (0,1), (-1,-1), (-1,1), (1,-1), (1,1))
+ROOK_DIRECTIONS = (0, 1, 2, 3)
+BISHOP_DIRECTIONS = (4, 5, 6, 7)
+OPPOSITE_DIRECTION = (2, 3, 0, 1, 7, 6, 5, 4)
+DIRECTIONS_ALL = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+def _stepTargets(steps):
+    table = []
+    for row, col in SQUARE_TO_POS:
+        table.append(tuple((row + dr)*BOARD_DIM + col + dc for dr, dc in steps if 0 <= row + dr < BOARD_DIM and 0 <= col + dc < BOARD_DIM))
+    return tuple(table)
+
+# squares a knight or king can jump to from each square
+KNIGHT_TARGETS = _stepTargets(((2,1), (1,2), (-2,1), (-1,2), (2,-1), (1,-2), (-2,-1), (-1,-2)))
+KING_TARGETS = _stepTargets(((-1,0), (0,1), (1,0), (0,-1), (1,1), (-1,1), (1,-1), (-1,-1)))
+
+def _pawnCaptures(directions):
+    table = []
+    for row, col in SQUARE_TO_POS:
+        captures = []
+        for d in directions:
+            r, c = row + DIRECTIONS[d][0], col + DIRECTIONS[d][1]
+            if 0 <= r < BOARD_DIM and 0 <= c < BOARD_DIM:
+                captures.append((r*BOARD_DIM + c, d))
+        table.append(tuple(captures))
+    return tuple(table)
+
+# pawn captures from each square as (target square, direction) pairs, index 0 is white and 1 is black
+PAWN_CAPTURES = (_pawnCaptures((4, 5)), _pawnCaptures((6, 7)))
+
+def _buildRays():
+    rays = []
+    for row, col in SQUARE_TO_POS:
+        squareRays = []
+        for dr, dc in DIRECTIONS:
+            ray = []
+            r, c = row + dr, col + dc
+            while 0 <= r < BOARD_DIM and 0 <= c < BOARD_DIM:
+                ray.append(r*BOARD_DIM + c)
+                r, c = r + dr, c + dc
+            squareRays.append(tuple(ray))
+        rays.append(tuple(squareRays))
+    return tuple(rays)
+
+# RAYS[sq][d] lists the squares from sq to the edge of the board in direction d, nearest first
+RAYS = _buildRays()
+
+def _buildLines():
+    between = [[0] * (BOARD_DIM * BOARD_DIM) for _ in range(BOARD_DIM * BOARD_DIM)]
+    line = [[0] * (BOARD_DIM * BOARD_DIM) for _ in range(BOARD_DIM * BOARD_DIM)]
+    for start in range(BOARD_DIM * BOARD_DIM):
+        for d in range(len(DIRECTIONS)):
+            lineMask = 1 << start
+            for sq in RAYS[start][d] + RAYS[start][OPPOSITE_DIRECTION[d]]:
+                lineMask |= 1 << sq
+            betweenMask = 0
+            for sq in RAYS[start][d]:
+                between[start][sq] = betweenMask
+                line[start][sq] = lineMask
+                betweenMask |= 1 << sq
+    return between, line
+
+# bitmasks (bit i is square i) of the squares strictly between two squares on a shared line and of the whole line
+# both are 0 when the squares don't share a rank, file or diagonal
+BETWEEN, LINE = _buildLines()
+
+def _toMask(squares):
+    mask = 0
+    for sq in squares:
+        mask |= 1 << sq
+    return mask
+
+# bitmasks of the squares a knight or king on each square attacks
+KNIGHT_ATTACKS = [_toMask(targets) for targets in KNIGHT_TARGETS]
+KING_ATTACKS = [_toMask(targets) for targets in KING_TARGETS]
+# squares a pawn of each colour on a square attacks, index 0 is white and 1 is black
+PAWN_ATTACKS = tuple([_toMask(sq for sq, d in captures) for captures in PAWN_CAPTURES[color]] for color in (0, 1))
+# ray directions for a queen, rook and bishop, indexed by piece code minus the king code of the same colour
+SLIDER_DIRECTIONS = (None, DIRECTIONS_ALL, ROOK_DIRECTIONS, BISHOP_DIRECTIONS)
+# up to this many squares are tested for attackers one at a time, past it one attack map for the whole position is cheaper
+ATTACK_MAP_THRESHOLD = 3
+# the 50 move rule counts 50 moves by each side, movesSinceCapture counts plies like the FEN half move clock
+FIFTY_MOVE_PLIES = 100
+
+# zobrist keys for hashing positions, the generator is seeded so keys are the same on every run
+_zobristRandom = random.Random(20230601)
+# ZOBRIST_PIECES[piece][sq], piece 0 (empty) is all zeros so capturing nothing changes nothing
+ZOBRIST_PIECES = [[0] * (BOARD_DIM * BOARD_DIM)] + [[_zobristRandom.getrandbits(64) for _ in range(BOARD_DIM * BOARD_DIM)] for _ in range(12)]
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+# indexed by castling rights bits, see GameState.getCastlingRights
+ZOBRIST_CASTLING = [_zobristRandom.getrandbits(64) for _ in range(16)]
+# indexed by the file of the en passant square
+ZOBRIST_EN_PASSANT = [_zobristRandom.getrandbits(64) for _ in range(BOARD_DIM)]
+
+def _buildEvalTables(values, tables):
+    evalTables = [[0] * (BOARD_DIM * BOARD_DIM)]
+    for sign, flip in ((1, 0), (-1, 56)):
+        for kind in range(6):
+            evalTables.append([sign * (values[kind] + tables[kind][sq ^ flip]) for sq in range(BOARD_DIM * BOARD_DIM)])
+    return evalTables
+
+# material plus piece square value of each piece on each square, EVAL_MG[piece][sq], white positive and black negative
+# black reads the white tables upside down, piece 0 is all zeros like ZOBRIST_PIECES
+EVAL_MG = _buildEvalTables(MG_VALUES, MG_TABLES)
+EVAL_EG = _buildEvalTables(EG_VALUES, EG_TABLES)
+PHASE = (0,) + PHASE_WEIGHTS + PHASE_WEIGHTS
+# rook moved by castling, (rook, start square, end square) by the end square of the king
+CASTLING_ROOKS = {58: (3, 56, 59), 62: (3, 63, 61), 2: (9, 0, 3), 6: (9, 7, 5)}
 
 # algebraic notation dictionary
 ALGNDIC = {
@@ -77,266 +182,394 @@ def AlgToMove (AlgN, gameState):
             return move
     return "invalid move"
 
-# sets board according to the Forsyth?Edwards Notation (FEN) string passed in
-def set_board (FEN = STARTINGFEN):
-    board = torch.zeros(8,8)
-    row = 0
-    col = 0
-    whiteKingLoc = ()
-    blackKingLoc = ()
-    # sets board
-    splitFen = FEN.split()
-    for letter in splitFen[0]:
-        if letter == ' ':
-            break
-        
-        # new row
-        if (col > 8 or letter == '/'):
-            row += 1
-            col = 0
-
-        # skips x number of coloumns 
-        if letter.isnumeric():
-            col += int(letter)
-
-        # adds piece
-        if letter.isalpha():
-            board[row][col] = decoder[letter]
-            if letter == 'K':
-                whiteKingLoc = (row, col)
-            elif letter == 'k':
-                blackKingLoc = (row, col)
-            col += 1
-
-    # initilizes the game
-    gameState = GameState(board)
-    gameState.whiteKingLoc = whiteKingLoc
-    gameState.blackKingLoc = blackKingLoc
-    if splitFen[1] == 'b': # determines turn
-        gameState.whitesMove = False
-
-    # set castling rights
-    gameState.noWKRMove = 'K' in splitFen[2] # white king side castle
-    gameState.noWQRMove = 'Q' in splitFen[2] # white queen side castle
-    gameState.noBKRMove = 'k' in splitFen[2] # black king side castle
-    gameState.noBQRMove = 'q' in splitFen[2] # black queen side castle
-    # here we ignore en passant and half move counter
-    # set full move counter
-    gameState.turn = int(splitFen[5])
-
-    return gameState
+# FEN placement to one character per square, digits become that many empty squares ('*' in decoder) and the row slashes go
+_EXPAND_PLACEMENT = str.maketrans({**{str(n): '*' * n for n in range(1, BOARD_DIM + 1)}, '/': ''})
+# byte of a piece letter or '*' to its piece code, any other character maps to 255 so a bad placement is caught
+_PLACEMENT_CODES = bytes(decoder.get(chr(byte), 255) for byte in range(256))
+_CASTLING_LETTERS = {'K': 1, 'Q': 2, 'k': 4, 'q': 8}
+# piece code to its FEN letter as a bytes.translate table, empty squares are '*' like decoder
+_PIECE_LETTERS = bytes(ord(inverseDecoder.get(code, '*')) for code in range(256))
+FEN_CACHE_SIZE = 128
+
+"""
+Parses a Forsyth-Edwards Notation (FEN) string into an immutable position
+(board as a tuple of piece codes, white to move, castling rights bits as in getCastlingRights, en passant (row, col) or (),
+half move clock, full move number), the fields after the placement are optional
+The placement is expanded with str.translate and turned into piece codes with bytes.translate so there is no Python step per square
+"""
+def parseFen(FEN):
+    fields = FEN.split()
+    if not fields:
+        raise ValueError("empty FEN")
+    board = fields[0].translate(_EXPAND_PLACEMENT).encode('ascii', 'replace').translate(_PLACEMENT_CODES)
+    if len(board) != BOARD_DIM * BOARD_DIM or 255 in board:
+        raise ValueError("FEN placement doesn't describe 64 squares: " + fields[0])
+    whitesMove = len(fields) < 2 or fields[1] != 'b'
+    castling = 0
+    if len(fields) > 2:
+        for letter in fields[2]:
+            castling |= _CASTLING_LETTERS.get(letter, 0)
+    enPassant = ()
+    if len(fields) > 3 and fields[3] != '-':
+        if len(fields[3]) != 2 or fields[3][0] not in inverseALGNDIC or fields[3][1] not in "36":
+            raise ValueError("bad en passant square in FEN: " + fields[3])
+        enPassant = (8 - int(fields[3][1]), inverseALGNDIC[fields[3][0]])
+    movesSinceCapture = int(fields[4]) if len(fields) > 4 else 0
+    turn = int(fields[5]) if len(fields) > 5 else 1
+    return (tuple(board), whitesMove, castling, enPassant, movesSinceCapture, turn)
+
+# the same as parseFen with the last FEN_CACHE_SIZE FENs kept, the start position and benchmark positions are parsed once
+# the results are tuples so a cached position can't be changed by a game played from it, cachedParseFen.cache_info() shows the hit rate
+cachedParseFen = functools.lru_cache(maxsize = FEN_CACHE_SIZE)(parseFen)
+
+# sets board according to the Forsyth-Edwards Notation (FEN) string passed in, including en passant and the half move clock
+# backend picks the move generator, "mailbox" for GameState or "bitboard" for BitboardEngine.BitboardGameState
+# cache = False parses the FEN every time instead of going through cachedParseFen
+def set_board (FEN = STARTINGFEN, backend = "mailbox", cache = True):
+    board, *position = cachedParseFen(FEN) if cache else parseFen(FEN)
+    if backend == "bitboard":
+        from BitboardEngine import BitboardGameState
+        return BitboardGameState(list(board), *position)
+    elif backend == "mailbox":
+        return GameState(list(board), *position)
+    raise ValueError("unknown backend: " + str(backend))
 
 
 class GameState():
-    def __init__(self, board):
-        # board is 8 x 8 array with ints represeting pieces according to decoder above
-        # 0 represents no piece
+    # the arguments after board are the rest of a FEN, see parseFen, castling is rights bits as in getCastlingRights
+    def __init__(self, board, whitesMove = True, castling = 15, enPassant = (), movesSinceCapture = 0, turn = 1):
+        # board is a flat 64 square mailbox with ints represeting pieces according to decoder above
+        # square (row, col) is stored at index row * 8 + col and 0 represents no piece
         self.board = board
-        self.whitesMove = True
-        # holds objects from class Move
+        self.whitesMove = whitesMove
+        # holds objects from class Move, None for a null move
         self.moveLog = [] 
-        self.turn = 1
-        self.whiteKingLoc = (7,4)
-        self.blackKingLoc = (0,4)
+        self.turn = turn
+        self.whiteKingLoc = SQUARE_TO_POS[board.index(1)] if 1 in board else ()
+        self.blackKingLoc = SQUARE_TO_POS[board.index(7)] if 7 in board else ()
         self.inCheck = False
-        self.enPassant = () # holds which square en passant is possible on
-        self.pins = []
+        self.enPassant = enPassant # holds which square en passant is possible on
+        self.pins = {}
         self.checks = []
+        self.attackMap = None # squares the side not to move attacks, see getAttackMap
         # castling rights
-        self.noWKRMove = True
-        self.noWQRMove = True
-        self.noBKRMove = True
-        self.noBQRMove = True
-        self.castleLog = []
+        self.noWKRMove = bool(castling & 1)
+        self.noWQRMove = bool(castling & 2)
+        self.noBKRMove = bool(castling & 4)
+        self.noBQRMove = bool(castling & 8)
         # end game conditions
         self.WhiteInCheckMate = False
         self.BlackInCheckMate = False
         self.isStaleMate = False
-        self.repition = 0
-        self.movesSinceCapture = 0
+        self.repition = 0 # number of earlier times the current position has been on the board
+        self.movesSinceCapture = movesSinceCapture
+        # one record per move in moveLog with the state the move can't be undone from, see makeMove
+        self.undoLog = []
+        # 64 bit zobrist key of the position, keyHistory holds the key before each move in moveLog
+        self.zobristKey = self.computeZobristKey()
+        self.keyHistory = []
+        # running totals for evaluate, makeMove keeps them up to date
+        self.mgScore, self.egScore, self.phase = self.computeEvaluation()
+        # NNUE.Accumulator told about every piece makeMove adds and removes, None when no network is attached
+        self.accumulator = None
+
+    # copies the mailbox into an 8 x 8 float tensor for the machine learning side
+    def to_tensor(self):
+        return torch.tensor(self.board, dtype=torch.float32).view(BOARD_DIM, BOARD_DIM)
+
+    # castling rights packed into 4 bits, white king side 1, white queen side 2, black king side 4, black queen side 8
+    def getCastlingRights(self):
+        return self.noWKRMove | (self.noWQRMove << 1) | (self.noBKRMove << 2) | (self.noBQRMove << 3)
+
+    # the position as a FEN string, the inverse of set_board
+    # the en passant square is written after every double pawn push whether or not a pawn can take it, like the enPassant attribute
+    def to_fen(self):
+        squares = bytes(self.board).translate(_PIECE_LETTERS).decode('ascii')
+        placement = '/'.join(squares[row*BOARD_DIM:(row + 1)*BOARD_DIM] for row in range(BOARD_DIM))
+        for run in range(BOARD_DIM, 0, -1): # longest runs of empty squares first so a run of 8 doesn't become 4 and 4
+            placement = placement.replace('*' * run, str(run))
+        castling = ''.join(letter for letter, bit in _CASTLING_LETTERS.items() if self.getCastlingRights() & bit) or '-'
+        enPassant = ALGNDIC[self.enPassant[1]] + str(8 - self.enPassant[0]) if self.enPassant != () else '-'
+        return (placement + (' w ' if self.whitesMove else ' b ') + castling + ' ' + enPassant + ' ' +
+                str(self.movesSinceCapture) + ' ' + str(self.turn))
+
+    # the en passant square only changes the key when the side to move has a pawn next to the pawn that can be captured
+    # so positions that can't actually be told apart still repeat
+    def getEnPassantKey(self):
+        if self.enPassant == ():
+            return 0
+        row, col = self.enPassant
+        if self.whitesMove:
+            pawn, pawnRow = 6, row + 1
+        else:
+            pawn, pawnRow = 12, row - 1
+        if (col > 0 and self.board[pawnRow*BOARD_DIM + col - 1] == pawn) or (col < BOARD_DIM - 1 and self.board[pawnRow*BOARD_DIM + col + 1] == pawn):
+            return ZOBRIST_EN_PASSANT[col]
+        return 0
+
+    # builds the zobrist key from scratch, makeMove and undoMove keep it up to date after this
+    def computeZobristKey(self):
+        key = 0
+        for sq, piece in enumerate(self.board):
+            if piece:
+                key ^= ZOBRIST_PIECES[piece][sq]
+        if not self.whitesMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key ^ ZOBRIST_CASTLING[self.getCastlingRights()] ^ self.getEnPassantKey()
+
+    # middlegame score, endgame score and game phase from scratch
+    def computeEvaluation(self):
+        mg = 0
+        eg = 0
+        phase = 0
+        for sq, piece in enumerate(self.board):
+            if piece:
+                mg += EVAL_MG[piece][sq]
+                eg += EVAL_EG[piece][sq]
+                phase += PHASE[piece]
+        return mg, eg, phase
+
+    """
+    Material and piece square score from the side to move's view in centipawns
+    Blends the middlegame and endgame scores by how much material is left, it only reads the running totals so it costs the same in any position
+    """
+    def evaluate(self):
+        phase = min(self.phase, MAX_PHASE) # an early promotion can push the phase past the starting position
+        score = self.mgScore * phase + self.egScore * (MAX_PHASE - phase)
+        if not self.whitesMove:
+            score = -score
+        return score // MAX_PHASE
+
+    # number of times the current position came up before, only looks back to the last capture or pawn move
+    # and only at positions with the same side to move
+    def getRepetitionCount(self):
+        count = 0
+        key = self.zobristKey
+        history = self.keyHistory
+        for i in range(len(history) - 2, max(len(history) - self.movesSinceCapture, 0) - 1, -2):
+            if history[i] == key:
+                count += 1
+        return count
 
     # updates board when move is made
     def makeMove(self, thisMove):
-        thisMove.executeMove(self.board)
-        # losing castling rights
-        self.castleLog.append((self.noWQRMove, self.noWKRMove, self.noBQRMove,  self.noBKRMove))
+        # everything about the position before the move that undoMove can't work out from the move itself
+        self.undoLog.append((self.noWQRMove, self.noWKRMove, self.noBQRMove, self.noBKRMove, self.enPassant, self.movesSinceCapture,
+                             self.repition, self.isStaleMate, self.WhiteInCheckMate, self.BlackInCheckMate, self.mgScore, self.egScore, self.phase))
+        self.keyHistory.append(self.zobristKey)
+        self.attackMap = None
+        # take the old castling rights and en passant square out of the key
+        rights = self.getCastlingRights()
+        key = self.zobristKey ^ ZOBRIST_CASTLING[rights] ^ self.getEnPassantKey()
+        mg = self.mgScore
+        eg = self.egScore
+        code = thisMove.code
+        startSq = code & SQUARE_MASK
+        endSq = (code >> 6) & SQUARE_MASK
+        movingPiece = thisMove.movingPiece
+        capturedPiece = thisMove.capturedPiece
+        board = self.board
+        board[endSq] = movingPiece # moves piece to new pos
+        board[startSq] = 0 # sets old position to 0
         # toggles castling right off forever if king or rook is moved
-        self.noWQRMove = self.noWQRMove and ((not (thisMove.movingPiece == 1 or (thisMove.movingPiece == 3 and thisMove.startRow == 7 and thisMove.startCol == 0))) and (not (thisMove.endRow == 7 and thisMove.endCol == 0)))
-        self.noWKRMove = self.noWKRMove and ((not (thisMove.movingPiece == 1 or (thisMove.movingPiece == 3 and thisMove.startRow == 7 and thisMove.startCol == 7))) and (not (thisMove.endRow == 7 and thisMove.endCol == 7)))
-        self.noBQRMove = self.noBQRMove and ((not (thisMove.movingPiece == 7 or (thisMove.movingPiece == 9 and thisMove.startRow == 0 and thisMove.startCol == 0))) and (not (thisMove.endRow == 0 and thisMove.endCol == 0)))
-        self.noBKRMove = self.noBKRMove and ((not (thisMove.movingPiece == 7 or (thisMove.movingPiece == 9 and thisMove.startRow == 0 and thisMove.startCol == 7))) and (not (thisMove.endRow == 0 and thisMove.endCol == 7)))
+        if rights:
+            self.noWQRMove = self.noWQRMove and ((not (movingPiece == 1 or (movingPiece == 3 and startSq == 56))) and endSq != 56)
+            self.noWKRMove = self.noWKRMove and ((not (movingPiece == 1 or (movingPiece == 3 and startSq == 63))) and endSq != 63)
+            self.noBQRMove = self.noBQRMove and ((not (movingPiece == 7 or (movingPiece == 9 and startSq == 0))) and endSq != 0)
+            self.noBKRMove = self.noBKRMove and ((not (movingPiece == 7 or (movingPiece == 9 and startSq == 7))) and endSq != 7)
+            rights = self.getCastlingRights()
         # castling move
-        if thisMove.isCastling:
+        if code & FLAG_CASTLING:
             if self.whitesMove: # white castle
-                if thisMove.endCol == 2: # white queen side castle
-                    self.board[7][0] = 0 # remove white queen side rook
-                    self.board[7][3] = 3 # sets new position to white rook
+                if endSq == 58: # white queen side castle
+                    board[56] = 0 # remove white queen side rook
+                    board[59] = 3 # sets new position to white rook
+                    key ^= ZOBRIST_PIECES[3][56] ^ ZOBRIST_PIECES[3][59]
                 else: # king side castle
-                    self.board[7][7] = 0 # remove white king side rook
-                    self.board[7][5] = 3 # sets new position to white rook
+                    board[63] = 0 # remove white king side rook
+                    board[61] = 3 # sets new position to white rook
+                    key ^= ZOBRIST_PIECES[3][63] ^ ZOBRIST_PIECES[3][61]
             else: # black castle
-                if thisMove.endCol == 2: # black queen side castle
-                    self.board[0][0] = 0 # remove black queen side rook
-                    self.board[0][3] = 9 # sets new position to black rook
+                if endSq == 2: # black queen side castle
+                    board[0] = 0 # remove black queen side rook
+                    board[3] = 9 # sets new position to black rook
+                    key ^= ZOBRIST_PIECES[9][0] ^ ZOBRIST_PIECES[9][3]
                 else: # king side castle
-                    self.board[0][7] = 0 # remove black king side rook
-                    self.board[0][5] = 9 # sets new position to black rook
+                    board[7] = 0 # remove black king side rook
+                    board[5] = 9 # sets new position to black rook
+                    key ^= ZOBRIST_PIECES[9][7] ^ ZOBRIST_PIECES[9][5]
+            rook, rookStart, rookEnd = CASTLING_ROOKS[endSq]
+            mg += EVAL_MG[rook][rookEnd] - EVAL_MG[rook][rookStart]
+            eg += EVAL_EG[rook][rookEnd] - EVAL_EG[rook][rookStart]
         # pawn promotion
-        if thisMove.isPawnPromotion:
+        if code & FLAG_PROMOTION:
             piece = thisMove.promotionChoice
             if self.whitesMove:
                 piece = piece.upper()
             else:
                 piece = piece.lower()
-            self.board[thisMove.endRow][thisMove.endCol] = decoder[piece] # changes piece to chosen piece
+            board[endSq] = decoder[piece] # changes piece to chosen piece
+
+        # moves the piece in the key, the piece on the end square is the promoted piece after a promotion
+        finalPiece = board[endSq]
+        key ^= ZOBRIST_PIECES[movingPiece][startSq] ^ ZOBRIST_PIECES[finalPiece][endSq]
+        mg += EVAL_MG[finalPiece][endSq] - EVAL_MG[movingPiece][startSq]
+        eg += EVAL_EG[finalPiece][endSq] - EVAL_EG[movingPiece][startSq]
+        self.phase += PHASE[finalPiece] - PHASE[movingPiece] - PHASE[capturedPiece]
 
         # enpassant
-        if thisMove.isEnPassant:
-            self.board[thisMove.startRow][thisMove.endCol] = 0 # captures pawn
+        if code & FLAG_EN_PASSANT:
+            capturedSq = (startSq & ~7) | (endSq & 7) # the captured pawn sits beside the capturing pawn
+            board[capturedSq] = 0 # captures pawn
+            key ^= ZOBRIST_PIECES[capturedPiece][capturedSq]
+        else:
+            capturedSq = endSq
+            key ^= ZOBRIST_PIECES[capturedPiece][endSq]
+        self.mgScore = mg - EVAL_MG[capturedPiece][capturedSq]
+        self.egScore = eg - EVAL_EG[capturedPiece][capturedSq]
+        if self.accumulator is not None:
+            removed = [(movingPiece, startSq)]
+            added = [(finalPiece, endSq)]
+            if capturedPiece != 0:
+                removed.append((capturedPiece, capturedSq))
+            if code & FLAG_CASTLING:
+                removed.append((rook, rookStart))
+                added.append((rook, rookEnd))
+            self.accumulator.push(removed, added)
 
         # update if enpassant is possible
-        if (thisMove.movingPiece == 6 or thisMove.movingPiece == 12) and abs(thisMove.startRow - thisMove.endRow) == 2: # checks that pawn advanced two sqaures
-            self.enPassant = ((thisMove.startRow + thisMove.endRow)//2, thisMove.endCol)
+        if (movingPiece == 6 or movingPiece == 12) and abs(startSq - endSq) == 16: # checks that pawn advanced two sqaures
+            self.enPassant = SQUARE_TO_POS[(startSq + endSq) // 2]
         else:
             self.enPassant = ()
         
         # keeps track of moves since pawn move or piece capture for 50 move rule
-        if not (thisMove.movingPiece == 6 or thisMove.movingPiece == 12) and thisMove.capturedPiece == 0:
+        if not (movingPiece == 6 or movingPiece == 12) and capturedPiece == 0:
             self.movesSinceCapture += 1
         else:
             self.movesSinceCapture = 0
 
         # 50 move rule
-        if self.movesSinceCapture >= 50:
-            self.isStaleMate = True
-
-        # checks that move is the same as two half moves ago
-        # three fold repition stalemate checker
-        if len(self.moveLog) > 4:
-            if thisMove == self.moveLog[-4]: # this is 4 half moves, or two whole moves in the past
-                self.repition += 1
-            else:
-                self.repition = 0
-
-        if self.repition == 6: # six half moves, ie 3 move repitions
+        if self.movesSinceCapture >= FIFTY_MOVE_PLIES:
             self.isStaleMate = True
 
         if not self.whitesMove:
             self.turn += 1
         self.moveLog.append(thisMove)
         self.whitesMove = not self.whitesMove # swap players
-        if thisMove.movingPiece == 1:
-            self.whiteKingLoc = (thisMove.endRow, thisMove.endCol)
-        elif thisMove.movingPiece == 7:
-            self.blackKingLoc = (thisMove.endRow, thisMove.endCol)
+
+        # put the new side to move, castling rights and en passant square into the key
+        self.zobristKey = key ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[rights] ^ self.getEnPassantKey()
+
+        # three fold repition stalemate checker, the position has been on the board twice before
+        # a position can't come back in under 4 plies so there is nothing to look for right after a capture or pawn move
+        if self.movesSinceCapture >= 4:
+            self.repition = self.getRepetitionCount()
+            if self.repition >= 2:
+                self.isStaleMate = True
+        else:
+            self.repition = 0
+        if movingPiece == 1:
+            self.whiteKingLoc = SQUARE_TO_POS[endSq]
+        elif movingPiece == 7:
+            self.blackKingLoc = SQUARE_TO_POS[endSq]
 
     # undoes the previous move
     def undoMove(self):
         if len(self.moveLog) != 0: # make sure there is a move to undo
             previousMove = self.moveLog.pop() # removes last index in list and returns its value
+            self.attackMap = None
+            code = previousMove.code
+            startSq = code & SQUARE_MASK
+            endSq = (code >> 6) & SQUARE_MASK
+            board = self.board
             # resets piece moved
-            self.board[previousMove.startRow][previousMove.startCol] = previousMove.movingPiece
+            board[startSq] = previousMove.movingPiece
             # resets piece taken
-            self.board[previousMove.endRow][previousMove.endCol] = previousMove.capturedPiece
+            board[endSq] = previousMove.capturedPiece
             self.whitesMove = not self.whitesMove # switch turns back
+            if not self.whitesMove:
+                self.turn -= 1
             if previousMove.movingPiece == 1:
-                self.whiteKingLoc = (previousMove.startRow, previousMove.startCol)
+                self.whiteKingLoc = SQUARE_TO_POS[startSq]
             elif previousMove.movingPiece == 7:
-                self.blackKingLoc = (previousMove.startRow, previousMove.startCol)
+                self.blackKingLoc = SQUARE_TO_POS[startSq]
             # undo enpassant
-            if previousMove.isEnPassant:
-                self.board[previousMove.endRow][previousMove.endCol] = 0 # make square pawn ends up on blank
-                self.board[previousMove.startRow][previousMove.endCol] = previousMove.capturedPiece
-                self.enPassant = (previousMove.endRow, previousMove.endCol)
-            # undo 2 square pawn move
-            if (previousMove.movingPiece == 6 or previousMove.movingPiece == 12) and abs(previousMove.startRow - previousMove.endRow) == 2:
-                if len(self.moveLog) != 0:
-                    moveBefore = self.moveLog[-1]
-                    # in case two double pawn moves were made in sequence
-                    if (moveBefore.movingPiece == 6 or moveBefore.movingPiece == 12) and abs(moveBefore.startRow - moveBefore.endRow) == 2:
-                        self.enPassant = ((moveBefore.startRow + moveBefore.endRow)//2, moveBefore.endCol)
-                    else:
-                        self.enPassant = ()
-                else:
-                    self.enPassant = ()
+            if code & FLAG_EN_PASSANT:
+                board[endSq] = 0 # make square pawn ends up on blank
+                board[(startSq & ~7) | (endSq & 7)] = previousMove.capturedPiece
 
             # undo castling
-            if previousMove.isCastling:
+            if code & FLAG_CASTLING:
                 if self.whitesMove: # white castle
-                    if previousMove.endCol == 2: # white queen side castle
-                        self.board[7][0] = 3 # undoes rook move
-                        self.board[7][3] = 0
+                    if endSq == 58: # white queen side castle
+                        board[56] = 3 # undoes rook move
+                        board[59] = 0
                     else: # king side castle
-                        self.board[7][7] = 3 
-                        self.board[7][5] = 0 
+                        board[63] = 3 
+                        board[61] = 0 
                 else: # black castle
-                    if previousMove.endCol == 2: # black queen side castle
-                        self.board[0][0] = 9 # undoes rook move
-                        self.board[0][3] = 0 
+                    if endSq == 2: # black queen side castle
+                        board[0] = 9 # undoes rook move
+                        board[3] = 0 
                     else: # king side castle
-                        self.board[0][7] = 9 
-                        self.board[0][5] = 0 
-            
-            # reset stalemate conditions
-            if self.repition > 0:
-                self.repition -= 1
-            if self.movesSinceCapture > 0:
-                self.movesSinceCapture -= 1
-            if self.isStaleMate:
-                self.isStaleMate = False
-            if self.BlackInCheckMate:
-                self.BlackInCheckMate = False
-            if self.WhiteInCheckMate:
-                self.WhiteInCheckMate = False
+                        board[7] = 9 
+                        board[5] = 0 
 
-            # reset castling rights forfeiture  
-            castlingFlags = self.castleLog.pop()
-            self.noWQRMove = castlingFlags[0]
-            self.noWKRMove = castlingFlags[1]
-            self.noBQRMove = castlingFlags[2]
-            self.noBKRMove = castlingFlags[3]
+            # castling rights, en passant square, 50 move counter, repetitions and game end flags go back to what they were
+            (self.noWQRMove, self.noWKRMove, self.noBQRMove, self.noBKRMove, self.enPassant, self.movesSinceCapture,
+             self.repition, self.isStaleMate, self.WhiteInCheckMate, self.BlackInCheckMate, self.mgScore, self.egScore, self.phase) = self.undoLog.pop()
+            self.zobristKey = self.keyHistory.pop()
+            if self.accumulator is not None:
+                self.accumulator.pop()
 
+    """
+    Passes the turn without moving for null move pruning in the search
+    Never make one while in check, and undo it with undoNullMove before undoing any real move under it
+    """
+    def makeNullMove(self):
+        self.undoLog.append((self.noWQRMove, self.noWKRMove, self.noBQRMove, self.noBKRMove, self.enPassant, self.movesSinceCapture,
+                             self.repition, self.isStaleMate, self.WhiteInCheckMate, self.BlackInCheckMate, self.mgScore, self.egScore, self.phase))
+        self.keyHistory.append(self.zobristKey)
+        self.attackMap = None
+        self.zobristKey ^= self.getEnPassantKey() ^ ZOBRIST_BLACK_TO_MOVE
+        self.enPassant = ()
+        # nothing before a pass can repeat after it, starting the count again keeps getRepetitionCount from looking past it
+        self.movesSinceCapture = 0
+        self.repition = 0
+        if not self.whitesMove:
+            self.turn += 1
+        self.moveLog.append(None)
+        self.whitesMove = not self.whitesMove
+        if self.accumulator is not None:
+            self.accumulator.push((), ())
+
+    def undoNullMove(self):
+        self.moveLog.pop()
+        self.whitesMove = not self.whitesMove
+        if not self.whitesMove:
             self.turn -= 1
+        self.attackMap = None
+        (self.noWQRMove, self.noWKRMove, self.noBQRMove, self.noBKRMove, self.enPassant, self.movesSinceCapture,
+         self.repition, self.isStaleMate, self.WhiteInCheckMate, self.BlackInCheckMate, self.mgScore, self.egScore, self.phase) = self.undoLog.pop()
+        self.zobristKey = self.keyHistory.pop()
+        if self.accumulator is not None:
+            self.accumulator.pop()
+
+    # checks if the king of the side to move is attacked without working out pins
+    def isKingAttacked(self):
+        if self.whitesMove:
+            return self.isSquareAttacked(self.whiteKingLoc[0]*BOARD_DIM + self.whiteKingLoc[1])
+        return self.isSquareAttacked(self.blackKingLoc[0]*BOARD_DIM + self.blackKingLoc[1])
 
     # checks for valid moves considering checks
     def getValidMoves(self):
-        moves = []
-        self.inCheck, self.pins, self.checks = self.getPinsChecks()
-        if self.whitesMove:
-            kingRow = self.whiteKingLoc[0]
-            kingCol = self.whiteKingLoc[1]
-        else:
-            kingRow = self.blackKingLoc[0]
-            kingCol = self.blackKingLoc[1]
-
-        if self.inCheck:
-            if len(self.checks) == 1: # only one check so can block check
-                moves = self.getAllPossibleMoves()
-                check = self.checks[0]
-                checkRow = check[0]
-                checkCol = check[1]
-                pieceChecking = int(self.board[checkRow][checkCol].item())
-                validSquares = [] # squares that king can move to
-                if pieceChecking == 5 or pieceChecking == 11: # knights
-                    validSquares = [(checkRow, checkCol)]
-                else:
-                    for i in range(1,BOARD_DIM):
-                        validSquare = (kingRow + check[2] * i, kingCol + check[3] * i) # Check 2 and 3 are the directions the attack is coming from
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol: # once iterable gets to tile with piece doing the checking
-                            break
-                # get rid of moves that dont block check or move the king
-                for j in range(len(moves) - 1, -1, -1): # removing items from list so decrementing through moves
-                    if moves[j].movingPiece != 1 and moves[j].movingPiece != 7: # if move doesn't move king
-                        if not (moves[j].endRow, moves[j].endCol) in validSquares: # move doesnt block check
-                            moves.remove(moves[j])
-            else: # double king check, king has to move
-                self.getKingMoves(kingRow, kingCol, moves)
-        else: # not in check so all moves are fine
-            moves = self.getAllPossibleMoves()
-            self.getCanCastle(self.board,moves)
+        moves = list(self.generateMoves())
+        self.setGameOver(moves)
+        return moves
 
-        # if no moves are left determine type of game end
+    # if no moves are left determine type of game end
+    def setGameOver(self, moves):
         if moves == []:
             if self.inCheck:
                 if self.whitesMove:
@@ -345,346 +578,539 @@ class GameState():
                     self.BlackInCheckMate = True
             else:
                 self.isStaleMate = True
-        return moves
+
+    """
+    Yields the legal moves in stages, each stage is only generated once the one before it has been used up
+    so a search that cuts off on the hash move or a capture never pays for the quiet moves
+    stages: the hash move, captures and promotions (most valuable victim first), quiet moves, castling
+    hashMove is a packed move (Move.code & PACKED_MOVE_MASK) or 0, it is only yielded if it is legal here
+    it is matched on its start and end squares and keeps its promotion piece, so an underpromotion takes the queen's place
+    quiets = False stops after the captures, for a quiescence search
+    Making and undoing moves between yields is fine as long as the board is back where it was when the next move is asked for
+    """
+    def generateMoves(self, hashMove = 0, quiets = True):
+        inCheck, pins, checks = self.getPinsChecks()
+        attackMap = None
+        self.inCheck, self.pins, self.checks, self.attackMap = inCheck, pins, checks, attackMap
+        if self.whitesMove:
+            kingRow, kingCol = self.whiteKingLoc
+        else:
+            kingRow, kingCol = self.blackKingLoc
+        kingSq = kingRow*BOARD_DIM + kingCol
+        doubleCheck = len(checks) > 1
+        if len(checks) == 1:
+            checkSq = checks[0]
+            # squares that block the check or capture the checker, a knight check can't be blocked and isn't on a line
+            validSquares = BETWEEN[kingSq][checkSq] | (1 << checkSq)
+        else:
+            checkSq = -1
+            validSquares = 0
+
+        # hash move, only the piece on its start square is generated to check it is legal
+        yielded = 0
+        if hashMove:
+            start = hashMove & SQUARE_MASK
+            piece = self.board[start]
+            if piece != 0 and (piece <= LASTWHITEPIECE) == self.whitesMove and (not doubleCheck or start == kingSq):
+                moves = []
+                self.getPieceMoves(start, moves)
+                if start == kingSq and not inCheck:
+                    self.getCanCastle(self.board, moves)
+                attackMap = self.attackMap
+                for move in moves:
+                    if move.code & MOVE_SQUARES_MASK == hashMove & MOVE_SQUARES_MASK and \
+                            (checkSq == -1 or self.evadesCheck(move, checkSq, validSquares)):
+                        if move.code & FLAG_PROMOTION and hashMove & PROMOTION_BITS:
+                            move.code = (move.code & ~PROMOTION_BITS) | (hashMove & PROMOTION_BITS)
+                        yielded = hashMove & MOVE_SQUARES_MASK
+                        yield move
+                        break
+
+        for captures in ((True, False) if quiets else (True,)):
+            # searching the moves already yielded changes the pins and checks, put them back before generating more
+            self.inCheck, self.pins, self.checks, self.attackMap = inCheck, pins, checks, attackMap
+            moves = []
+            if doubleCheck: # double king check, king has to move
+                self.getKingMoves(kingRow, kingCol, moves, captures, not captures)
+            else:
+                self.getAllPossibleMoves(moves, captures, not captures)
+            attackMap = self.attackMap
+            if captures:
+                moves.sort(key = captureOrder)
+            for move in moves:
+                if yielded and move.code & MOVE_SQUARES_MASK == yielded:
+                    continue
+                if checkSq == -1 or doubleCheck or self.evadesCheck(move, checkSq, validSquares):
+                    yield move
+
+        # castling is never legal in check
+        self.inCheck, self.pins, self.checks, self.attackMap = inCheck, pins, checks, attackMap
+        if quiets and not inCheck:
+            moves = []
+            self.getCanCastle(self.board, moves)
+            for move in moves:
+                if not yielded or move.code & MOVE_SQUARES_MASK != yielded:
+                    yield move
+        # searching the moves changes these, leave them as they were for this position
+        self.inCheck, self.pins, self.checks, self.attackMap = inCheck, pins, checks, attackMap
+
+    # single check, the king moves away or another piece blocks or captures the checker
+    def evadesCheck(self, move, checkSq, validSquares):
+        if move.movingPiece == 1 or move.movingPiece == 7:
+            return True
+        code = move.code
+        if code & FLAG_EN_PASSANT and (code & SQUARE_MASK & ~7) | ((code >> 6) & 7) == checkSq: # en passant captures the checking pawn
+            return True
+        return (validSquares >> ((code >> 6) & SQUARE_MASK)) & 1 == 1
+
+    # number of legal moves with each pawn promotion counted once per promotion piece
+    def countValidMoves(self):
+        count = 0
+        for move in self.getValidMoves():
+            count += 4 if move.code & FLAG_PROMOTION else 1
+        return count
 
+    # looks outward from the king along every ray and knight jump
+    # pins maps each pinned square to the direction from the king to the pinning piece
+    # checks lists the squares of the pieces giving check
     def getPinsChecks(self):
-        pins = []
+        pins = {}
         checks = []
         inCheck = False
+        board = self.board
         if self.whitesMove:
-            startRow = self.whiteKingLoc[0]
-            startCol = self.whiteKingLoc[1]
+            kingSq = self.whiteKingLoc[0]*BOARD_DIM + self.whiteKingLoc[1]
+            enemyKing, enemyQueen, enemyRook, enemyBishop, enemyKnight, enemyPawn = 7, 8, 9, 10, 11, 12
+            pawnDirections = (4, 5) # black pawns attack the white king from above
         else:
-            startRow = self.blackKingLoc[0]
-            startCol = self.blackKingLoc[1]
+            kingSq = self.blackKingLoc[0]*BOARD_DIM + self.blackKingLoc[1]
+            enemyKing, enemyQueen, enemyRook, enemyBishop, enemyKnight, enemyPawn = 1, 2, 3, 4, 5, 6
+            pawnDirections = (6, 7) # white pawns attack the black king from below
+        kingRays = RAYS[kingSq]
         # checks outward in each direction
-        directions = ((-1,0), (0,-1), (1,0), (0,1), (-1,-1), (-1,1), (1,-1), (1,1))
-        for j in range(len(directions)):
-            d = directions[j]
-            possiblePin = () # temp potential pin counter
-            # i is distance to attacker
-            for i in range(1, BOARD_DIM):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < BOARD_DIM and 0 <= endCol < BOARD_DIM:
-                    endPiece = int(self.board[endRow][endCol].item())
-                    # checks for pins 
-                    if (0 < endPiece <= LASTWHITEPIECE and self.whitesMove) or (LASTWHITEPIECE < endPiece and (not self.whitesMove)):
-                        # excluding same color kings because we call this function with a new king position without removing the old one
-                        if (self.whitesMove and endPiece != 1) or (not self.whitesMove and endPiece != 7):
-                            if possiblePin == (): # no other piece is in the way yet
-                                possiblePin = (endRow, endCol, d[0], d[1]) 
-                            else: # second allied piece
-                                break
-                    
-                    # checks type of pin
-                    elif endPiece != 0:
-                        # checks if its a rook and moves in the first 4 directions
-                        # checks if its a bishop and moves in last four directions
-                        # checks if its a pawn and which directions it can attack
-                        # checks if its a queen or a king
-                        if (0 <= j <= 3 and (endPiece == 9 or endPiece == 3)) or \
-                                (4 <= j <= 7 and (endPiece == 10 or endPiece == 4)) or \
-                                (i == 1 and (endPiece == 6 or endPiece == 12) and ((not self.whitesMove and 6 <= j <= 7) or (self.whitesMove and 4 <= j <= 5))) or \
-                                (endPiece == 2 or endPiece == 8) or (i == 1 and (endPiece == 1 or endPiece == 7)):
-                            if possiblePin == (): # no piece blocking
+        for j in range(8):
+            enemySlider = enemyRook if j < 4 else enemyBishop
+            possiblePin = -1 # temp potential pin square
+            adjacent = True
+            for endSq in kingRays[j]:
+                endPiece = board[endSq]
+                if endPiece != 0:
+                    # checks for pins
+                    if (endPiece <= LASTWHITEPIECE) == self.whitesMove:
+                        if possiblePin == -1: # no other piece is in the way yet
+                            possiblePin = endSq
+                        else: # second allied piece
+                            break
+                    # enemy piece, checks if it attacks along this direction
+                    else:
+                        if endPiece == enemySlider or endPiece == enemyQueen or \
+                                (adjacent and (endPiece == enemyKing or (endPiece == enemyPawn and j in pawnDirections))):
+                            if possiblePin == -1: # no piece blocking
                                 inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else: #piece is blocking so pin
-                                pins.append(possiblePin)
-                                break
-                        else: # piece is not checking
-                            break
-                else:
-                    break # off board
-        
+                                checks.append(endSq)
+                            else: # piece is blocking so pin
+                                pins[possiblePin] = j
+                        break
+                adjacent = False
+
         # check in knight directions
-        knightDirs = ((2,1), (1,2), (-2,1), (-1,2), (2,-1), (1,-2), (-2,-1), (-1,-2))
-        for k in knightDirs:
-            endRow = startRow + k[0]
-            endCol = startCol + k[1]
-            if 0 <= endRow < BOARD_DIM and 0 <= endCol < BOARD_DIM:
-                endPiece = int(self.board[endRow][endCol].item())
-                if ((endPiece == 5 and not self.whitesMove) or (endPiece == 11 and self.whitesMove)): # enemy knight attacking
-                    inCheck = True
-                    checks.append((endRow, endCol, k[0], k[1]))
+        for endSq in KNIGHT_TARGETS[kingSq]:
+            if board[endSq] == enemyKnight: # enemy knight attacking
+                inCheck = True
+                checks.append(endSq)
         return inCheck, pins, checks
 
     # all moves without considering checks
-    def getAllPossibleMoves(self):
-        moves = []  
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col].item()
-                if (piece != 0 and ((piece <= LASTWHITEPIECE and self.whitesMove) or (piece > LASTWHITEPIECE and (not self.whitesMove)))):
-                    if piece == 1 or piece == 7:
-                        self.getKingMoves(row, col, moves)
-                    elif piece == 2 or piece == 8:
-                        self.getQueenMoves(row, col, moves)
-                    elif piece == 3 or piece == 9:
-                        self.getRookMoves(row, col, moves)
-                    elif piece == 4 or piece == 10:
-                        self.getBishopMoves(row, col, moves)
-                    elif piece == 5 or piece == 11:
-                        self.getKnightMoves(row, col, moves)
-                    elif piece == 6 or piece == 12:
-                        self.getPawnMoves(row, col, moves)
+    # captures covers captures and promotions, quiets everything else apart from castling
+    def getAllPossibleMoves(self, moves = None, captures = True, quiets = True):
+        if moves is None:
+            moves = []
+        board = self.board
+        for sq in range(BOARD_DIM * BOARD_DIM):
+            piece = board[sq]
+            if piece != 0 and (piece <= LASTWHITEPIECE) == self.whitesMove:
+                self.getPieceMoves(sq, moves, captures, quiets)
         return moves
+
+    # adds the moves of the piece on sq to the list
+    def getPieceMoves(self, sq, moves, captures = True, quiets = True):
+        piece = self.board[sq]
+        row, col = SQUARE_TO_POS[sq]
+        if piece == 1 or piece == 7:
+            self.getKingMoves(row, col, moves, captures, quiets)
+        elif piece == 2 or piece == 8:
+            self.getQueenMoves(row, col, moves, captures, quiets)
+        elif piece == 3 or piece == 9:
+            self.getRookMoves(row, col, moves, captures, quiets)
+        elif piece == 4 or piece == 10:
+            self.getBishopMoves(row, col, moves, captures, quiets)
+        elif piece == 5 or piece == 11:
+            self.getKnightMoves(row, col, moves, captures, quiets)
+        elif piece == 6 or piece == 12:
+            self.getPawnMoves(row, col, moves, captures, quiets)
 
     # finds if king can castle
+    # the king can't pass through or land on an attacked square, the caller makes sure it isn't in check
     def getCanCastle (self, board, moves):
-        # handle white queen side castling
-        if self.noWQRMove and self.whitesMove: # rook and king haven't moved
-            if board[7][1] == 0 and board[7][2] == 0 and board[7][3] == 0:
-                for i in (2,3):
-                    self.whiteKingLoc = (7,i)
-                    inCheck, pins, checks = self.getPinsChecks()
-                    if inCheck:
-                        break
-                self.whiteKingLoc = (7,4)
-                if not inCheck:
+        if self.whitesMove:
+            # handle white queen side castling
+            if self.noWQRMove: # rook and king haven't moved
+                if board[57] == 0 and board[58] == 0 and board[59] == 0 and not self.squaresAttacked((58, 59)):
                     moves.append(Move((7,4), (7,2), self.board, isCastling = True))
+            # white king side
+            if self.noWKRMove:
+                if board[61] == 0 and board[62] == 0 and not self.squaresAttacked((61, 62)):
+                    moves.append(Move((7,4), (7,6), self.board, isCastling = True))
+        else:
+            # handle black queen side castling
+            if self.noBQRMove:
+                if board[1] == 0 and board[2] == 0 and board[3] == 0 and not self.squaresAttacked((2, 3)):
+                    moves.append(Move((0,4), (0,2), self.board, isCastling = True))
+            # black king side
+            if self.noBKRMove:
+                if board[5] == 0 and board[6] == 0 and not self.squaresAttacked((5, 6)):
+                    moves.append(Move((0,4), (0,6), self.board, isCastling = True))
 
-        # white king side
-        if self.noWKRMove and self.whitesMove:
-            if board[7][5] == 0 and board[7][6] == 0:
-                for i in (5,6):
-                    self.whiteKingLoc = (7,i)
-                    inCheck, pins, checks = self.getPinsChecks()
-                    if inCheck:
-                        break
-                self.whiteKingLoc = (7,4)
-                if not inCheck:
-                    moves.append(Move((7,4), (7,6), self.board, isCastling = True))
+    # checks if the side not to move attacks any of the squares
+    # a couple of squares are cheaper to test one at a time, more than that builds the attack map for the position
+    def squaresAttacked(self, squares):
+        if self.attackMap is None and len(squares) <= ATTACK_MAP_THRESHOLD:
+            for sq in squares:
+                if self.isSquareAttacked(sq):
+                    return True
+            return False
+        attacked = self.getAttackMap()
+        for sq in squares:
+            if (attacked >> sq) & 1:
+                return True
+        return False
 
-        # handle black queen side castling
-        if self.noBQRMove  and not self.whitesMove:
-            if board[0][1] == 0 and board[0][2] == 0 and board[0][3] == 0:
-                for i in (2,3):
-                    self.blackKingLoc = (0,i)
-                    inCheck, pins, checks = self.getPinsChecks()
-                    if inCheck:
-                        break
-                self.blackKingLoc = (0,4)
-                if not inCheck:
-                    moves.append(Move((0,4), (0,2), self.board, isCastling = True))
+    # bitmask of every square the side not to move attacks, worked out at most once per position
+    # makeMove and undoMove throw it away
+    def getAttackMap(self):
+        if self.attackMap is None:
+            self.attackMap = self.computeAttackMap()
+        return self.attackMap
 
-        # black king side
-        if self.noBKRMove and not self.whitesMove:
-            if board[0][5] == 0 and board[0][6] == 0:
-                for i in (5,6):
-                    self.blackKingLoc = (0,i)
-                    inCheck, pins, checks = self.getPinsChecks()
-                    if inCheck:
-                        break
-                self.blackKingLoc = (0,4)
-                if not inCheck:
-                    moves.append(Move((0,4), (0,6), self.board, isCastling = True))
+    # sliders see through the king of the side to move so it can't step back along the line of a check
+    def computeAttackMap(self):
+        board = self.board
+        if self.whitesMove:
+            kingSq = self.whiteKingLoc[0]*BOARD_DIM + self.whiteKingLoc[1]
+            enemyKing, color = 7, 1
+        else:
+            kingSq = self.blackKingLoc[0]*BOARD_DIM + self.blackKingLoc[1]
+            enemyKing, color = 1, 0
+        attacked = 0
+        pawnAttacks = PAWN_ATTACKS[color]
+        sq = -1
+        for piece in board:
+            sq += 1
+            if piece == 0:
+                continue
+            kind = piece - enemyKing # 0 king, 1 queen, 2 rook, 3 bishop, 4 knight, 5 pawn
+            if kind < 0 or kind > 5:
+                continue
+            if kind == 5:
+                attacked |= pawnAttacks[sq]
+            elif kind == 4:
+                attacked |= KNIGHT_ATTACKS[sq]
+            elif kind == 0:
+                attacked |= KING_ATTACKS[sq]
+            else:
+                rays = RAYS[sq]
+                for d in SLIDER_DIRECTIONS[kind]:
+                    for endSq in rays[d]:
+                        attacked |= 1 << endSq
+                        if board[endSq] != 0 and endSq != kingSq:
+                            break
+        return attacked
+
+    # looks outward from one square for an attacker and stops at the first one, sees through the king of the side to move
+    def isSquareAttacked(self, sq):
+        board = self.board
+        if self.whitesMove:
+            kingSq = self.whiteKingLoc[0]*BOARD_DIM + self.whiteKingLoc[1]
+            enemyKing, enemyQueen, enemyRook, enemyBishop, enemyKnight, enemyPawn, color = 7, 8, 9, 10, 11, 12, 0
+        else:
+            kingSq = self.blackKingLoc[0]*BOARD_DIM + self.blackKingLoc[1]
+            enemyKing, enemyQueen, enemyRook, enemyBishop, enemyKnight, enemyPawn, color = 1, 2, 3, 4, 5, 6, 1
+        # an enemy pawn attacks sq from the squares our own pawn on sq would capture on
+        for endSq, d in PAWN_CAPTURES[color][sq]:
+            if board[endSq] == enemyPawn:
+                return True
+        for endSq in KNIGHT_TARGETS[sq]:
+            if board[endSq] == enemyKnight:
+                return True
+        for endSq in KING_TARGETS[sq]:
+            if board[endSq] == enemyKing:
+                return True
+        rays = RAYS[sq]
+        for d in DIRECTIONS_ALL:
+            enemySlider = enemyRook if d < 4 else enemyBishop
+            for endSq in rays[d]:
+                endPiece = board[endSq]
+                if endPiece != 0 and endSq != kingSq:
+                    if endPiece == enemySlider or endPiece == enemyQueen:
+                        return True
+                    break
+        return False
 
     # get all king  moves and adds the moves to the list
-    def getKingMoves(self, r, c, moves):
-        directions = ((r-1,c), (r,c+1), (r+1,c), (r,c-1), (r+1,c+1), (r-1,c+1), (r+1,c-1), (r-1,c-1))
-        for d in directions:
-            # checks that new direction is in bounds
-            if d[0] >= 0 and d[0] < BOARD_DIM and d[1] >= 0 and d[1] < BOARD_DIM:
-                piece = self.board[d[0]][d[1]]
-                # checks that piece is capturable
-                if piece == 0 or (piece <= LASTWHITEPIECE and (not self.whitesMove)) or (piece > LASTWHITEPIECE and self.whitesMove):
-                    # temporarily set kings location to potential move location
-                    if self.whitesMove:
-                        self.whiteKingLoc = (d[0], d[1])
-                    else:
-                        self.blackKingLoc = (d[0], d[1])
-                    inCheck, pins, checks = self.getPinsChecks()
-                    if not inCheck:
-                        moves.append(Move((r,c), d, self.board)) # if not in check it is a valid move
-                    # set kings back to origianal location
-                    if self.whitesMove:
-                        self.whiteKingLoc = (r, c)
-                    else:
-                        self.blackKingLoc = (r, c)
+    def getKingMoves(self, r, c, moves, captures = True, quiets = True):
+        board = self.board
+        sq = r*BOARD_DIM + c
+        king = board[sq]
+        targets = []
+        for endSq in KING_TARGETS[sq]:
+            piece = board[endSq]
+            # checks that piece is capturable
+            if (piece == 0 and quiets) or (piece != 0 and captures and (piece <= LASTWHITEPIECE) != self.whitesMove):
+                targets.append(endSq)
+        if not targets:
+            return
+        if self.attackMap is None and len(targets) <= ATTACK_MAP_THRESHOLD:
+            for endSq in targets:
+                if not self.isSquareAttacked(endSq): # if not attacked it is a valid move
+                    moves.append(packedMove(sq | (endSq << 6), king, board[endSq]))
+        else:
+            attacked = self.getAttackMap()
+            for endSq in targets:
+                if not (attacked >> endSq) & 1:
+                    moves.append(packedMove(sq | (endSq << 6), king, board[endSq]))
 
     # get all queen moves and adds the moves to the list
-    def getQueenMoves(self, r, c, moves):
+    def getQueenMoves(self, r, c, moves, captures = True, quiets = True):
         # a queen is just a bishop and rook
-        self.getRookMoves(r, c, moves) # rook has to go first based on how pins are handled
-        self.getBishopMoves(r, c, moves)
+        self.getSlidingMoves(r, c, DIRECTIONS_ALL, moves, captures, quiets)
 
     # get all rook moves and adds the moves to the list
-    def getRookMoves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1): # decrement through pin list
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                if self.board[r][c] != 2 and self.board[r][c] != 8: # this does not remove the queen pin, that is done in the bishop moves
-                    self.pins.remove(self.pins[i])
-                break
-        code = r*10 + c
-        maxDisToEdge = distanceToEdge[code]
-        directions = ((1,0), (-1,0), (0,1), (0,-1))
-        for d in directions:
-            for tile in range(1, maxDisToEdge):
-                endRow = r + d[0] * tile
-                endCol = c + d[1] * tile
-                if 0 <= endRow < BOARD_DIM and 0 <= endCol < BOARD_DIM:
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = int(self.board[endRow][endCol].item())
-                        if endPiece == 0: # empty space
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                        elif (endPiece <= LASTWHITEPIECE and (not self.whitesMove)) or (endPiece > LASTWHITEPIECE and self.whitesMove): # capturable piece
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                            break
-                        else: # friendly piece
-                            break
-                else: # off board
-                    break
+    def getRookMoves(self, r, c, moves, captures = True, quiets = True):
+        self.getSlidingMoves(r, c, ROOK_DIRECTIONS, moves, captures, quiets)
 
     # get all bishop moves and adds the moves to the list
-    def getBishopMoves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1): # decrement through pin list
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+    def getBishopMoves(self, r, c, moves, captures = True, quiets = True):
+        self.getSlidingMoves(r, c, BISHOP_DIRECTIONS, moves, captures, quiets)
 
-        code = r*10 + c
-        maxDisToEdge = distanceToEdge[code]
-        directions = ((1,1), (-1,1), (1,-1), (-1,-1))
+    # walks the precomputed rays in the given directions until a piece blocks the way
+    def getSlidingMoves(self, r, c, directions, moves, captures = True, quiets = True):
+        board = self.board
+        sq = r*BOARD_DIM + c
+        pinDirection = self.pins.get(sq, -1)
+        movingPiece = board[sq]
+        rays = RAYS[sq]
         for d in directions:
-            for tile in range(1, maxDisToEdge):
-                endRow = r + d[0] * tile
-                endCol = c + d[1] * tile
-                if 0 <= endRow < BOARD_DIM and 0 <= endCol < BOARD_DIM:
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = int(self.board[endRow][endCol].item())
-                        if endPiece == 0: # empty space
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                        elif (endPiece <= LASTWHITEPIECE and (not self.whitesMove)) or (endPiece > LASTWHITEPIECE and self.whitesMove): # capturable piece
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                            break
-                        else: # friendly piece
-                            break
-                else: # off board
-                    break
+            # a pinned piece can only slide along the pin
+            if pinDirection == -1 or pinDirection == d or pinDirection == OPPOSITE_DIRECTION[d]:
+                for endSq in rays[d]:
+                    endPiece = board[endSq]
+                    if endPiece == 0: # empty space
+                        if quiets:
+                            moves.append(packedMove(sq | (endSq << 6), movingPiece, 0))
+                    elif (endPiece <= LASTWHITEPIECE) != self.whitesMove: # capturable piece
+                        if captures:
+                            moves.append(packedMove(sq | (endSq << 6), movingPiece, endPiece))
+                        break
+                    else: # friendly piece
+                        break
 
     # get all knight moves and adds the moves to the list
-    def getKnightMoves(self, r, c, moves):
-        piecePinned = False
-        for i in range(len(self.pins) - 1, -1, -1): # decrement through pin list
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                self.pins.remove(self.pins[i])
-                break
-               
-        directions = ((r+2,c+1), (r+1,c+2), (r-2,c+1), (r-1,c+2), (r+2,c-1), (r+1,c-2), (r-2,c-1), (r-1,c-2))
-        for d in directions:
-            # checks that new direction is in bounds
-            if d[0] >= 0 and d[0] < BOARD_DIM and d[1] >= 0 and d[1] < BOARD_DIM:
-                if not piecePinned:
-                    piece = self.board[d[0]][d[1]]
-                    # checks that piece is capturable
-                    if piece == 0 or (piece <= LASTWHITEPIECE and (not self.whitesMove)) or (piece > LASTWHITEPIECE and self.whitesMove):
-                        moves.append(Move((r,c), d, self.board))
+    def getKnightMoves(self, r, c, moves, captures = True, quiets = True):
+        sq = r*BOARD_DIM + c
+        if sq in self.pins: # a pinned knight can never move
+            return
+        board = self.board
+        knight = board[sq]
+        for endSq in KNIGHT_TARGETS[sq]:
+            piece = board[endSq]
+            # checks that piece is capturable
+            if (piece == 0 and quiets) or (piece != 0 and captures and (piece <= LASTWHITEPIECE) != self.whitesMove):
+                moves.append(packedMove(sq | (endSq << 6), knight, piece))
 
     # get all pawn moves and adds the moves to the list
-    def getPawnMoves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1): # decrement through pin list
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
-        # moves for white pawn
-        if self.whitesMove and r - 1 >= 0:
-            # move forward
-            if self.board[r-1][c] == 0: # square in front of pawn is empty
-                if not piecePinned or pinDirection == (-1,0): # check if pawn is pinned
-                    moves.append(Move((r,c), (r-1,c), self.board))
-                    if r == 6 and self.board[r-2][c] == 0: # two square pawn advance
-                        moves.append(Move((r,c), (r-2,c), self.board))
-
-            # capture to the left
-            if c - 1 >= 0 and r - 1 >= 0:
-                if not piecePinned or pinDirection == (-1, -1): # check if pawn is pinned
-                    if self.board[r-1][c-1] > LASTWHITEPIECE:          
-                        moves.append(Move((r,c), (r-1,c-1), self.board))    
-                    elif (r-1,c-1) == self.enPassant:
-                        moves.append(Move((r,c), (r-1,c-1), self.board, isEnPassant = True)) 
-
-            # capture to the right
-            if c + 1 < BOARD_DIM and r - 1 >= 0:
-                if not piecePinned or pinDirection == (-1,1): # check if pawn is pinned
-                    if self.board[r-1][c+1] > LASTWHITEPIECE:
-                            moves.append(Move((r,c), (r-1,c+1), self.board))
-                    elif (r-1,c+1) == self.enPassant:
-                        moves.append(Move((r,c), (r-1,c+1), self.board, isEnPassant = True)) 
-
-        # moves for black pawn
-        elif r+1 < BOARD_DIM and not self.whitesMove:
-            # move forward
-            if self.board[r+1][c] == 0: # square in front of pawn is empty
-                if not piecePinned or pinDirection == (1,0): # check if pawn is pinned
-                    moves.append(Move((r,c), (r+1,c), self.board))
-                    if r == 1 and self.board[r+2][c] == 0: # two square pawn advance
-                        moves.append(Move((r,c), (r+2,c), self.board))
+    def getPawnMoves(self, r, c, moves, captures = True, quiets = True):
+        board = self.board
+        sq = r*BOARD_DIM + c
+        pinDirection = self.pins.get(sq, -1)
+        if self.whitesMove:
+            step, forward, doubleRow, color, pawn, enemyPawn = -BOARD_DIM, 0, 6, 0, 6, 12
+        else:
+            step, forward, doubleRow, color, pawn, enemyPawn = BOARD_DIM, 2, 1, 1, 12, 6
+        # every move from the row before the back row is a promotion
+        promotion = DEFAULT_PROMOTION if r == 7 - doubleRow else 0
 
-            # capture to the left
-            if c - 1 >= 0 and r + 1 < BOARD_DIM:
-                if not piecePinned or pinDirection == (1,-1): # check if pawn is pinned
-                    if self.board[r+1][c-1] != 0 and self.board[r+1][c-1] <= LASTWHITEPIECE:
-                        moves.append(Move((r,c), (r+1,c-1), self.board))
-                    elif (r+1,c-1) == self.enPassant:
-                        moves.append(Move((r,c), (r+1,c-1), self.board, isEnPassant = True)) 
+        # move forward
+        endSq = sq + step
+        if board[endSq] == 0 and (captures if promotion else quiets): # square in front of pawn is empty, promotions go with the captures
+            if pinDirection == -1 or pinDirection == forward or pinDirection == OPPOSITE_DIRECTION[forward]: # check if pawn is pinned
+                moves.append(packedMove(sq | (endSq << 6) | promotion, pawn, 0))
+                if r == doubleRow and board[endSq + step] == 0: # two square pawn advance
+                    moves.append(packedMove(sq | ((endSq + step) << 6), pawn, 0))
 
-            # capture to the right
-            if c + 1 < BOARD_DIM and r + 1 < BOARD_DIM:
-                if not piecePinned or pinDirection == (1,1): # check if pawn is pinned
-                    if self.board[r+1][c+1] != 0 and self.board[r+1][c+1] <= LASTWHITEPIECE:
-                        moves.append(Move((r,c), (r+1,c+1), self.board))
-                    elif (r+1,c+1) == self.enPassant:
-                        moves.append(Move((r,c), (r+1,c+1), self.board, isEnPassant = True)) 
+        # captures
+        if not captures:
+            return
+        for endSq, d in PAWN_CAPTURES[color][sq]:
+            if pinDirection == -1 or pinDirection == d or pinDirection == OPPOSITE_DIRECTION[d]: # check if pawn is pinned
+                endPiece = board[endSq]
+                if endPiece != 0 and (endPiece <= LASTWHITEPIECE) != self.whitesMove:
+                    moves.append(packedMove(sq | (endSq << 6) | promotion, pawn, endPiece))
+                elif SQUARE_TO_POS[endSq] == self.enPassant and not self.enPassantExposesKing(r, c, endSq & 7):
+                    moves.append(packedMove(sq | (endSq << 6) | FLAG_EN_PASSANT, pawn, enemyPawn))
+
+    # checks if removing both pawns in an en passant capture leaves the king in check along their row
+    # this is the one case the pin detection misses because two pieces leave the row at once
+    def enPassantExposesKing(self, r, c, capturedCol):
+        if self.whitesMove:
+            kingRow, kingCol = self.whiteKingLoc
+            enemyRook, enemyQueen = 9, 8
+        else:
+            kingRow, kingCol = self.blackKingLoc
+            enemyRook, enemyQueen = 3, 2
+        if kingRow != r:
+            return False
+        step = 1 if kingCol < c else -1
+        col = kingCol + step
+        while 0 <= col < BOARD_DIM:
+            if col != c and col != capturedCol:
+                endPiece = self.board[r*BOARD_DIM + col]
+                if endPiece != 0:
+                    return endPiece == enemyRook or endPiece == enemyQueen
+            col += step
+        return False
 
 
+# packed move layout, low bits first: 6 bits start square, 6 bits end square, 3 bits promotion piece, then the flags
+# the low 15 bits are enough to find the move again so they double as the transposition table move
+SQUARE_MASK = 0x3F
+MOVE_SQUARES_MASK = 0xFFF # start and end square, all that move equality looks at
+PACKED_MOVE_MASK = 0x7FFF
+PROMOTION_SHIFT = 12
+PROMOTION_BITS = 0x7 << PROMOTION_SHIFT
+FLAG_EN_PASSANT = 1 << 15
+FLAG_CASTLING = 1 << 16
+FLAG_PROMOTION = 1 << 17
+# promotion piece letters to the 3 bit code, 0 is a move that isn't a promotion and reads back as the default queen
+PROMOTION_CODES = {'q': 1, 'r': 2, 'b': 3, 'n': 4}
+PROMOTION_LETTERS = ('q', 'q', 'r', 'b', 'n')
+# a pawn move onto a back row carries the promotion flag and a queen by default
+DEFAULT_PROMOTION = FLAG_PROMOTION | (1 << PROMOTION_SHIFT)
+
+_newObject = object.__new__
+
+# rough piece values for ordering captures, most valuable victim first then least valuable attacker
+CAPTURE_VALUES = (0, 10000, 900, 500, 330, 320, 100, 10000, 900, 500, 330, 320, 100)
+
+# sort key that puts the best captures first
+def captureOrder(move):
+    return CAPTURE_VALUES[move.movingPiece] - 10 * CAPTURE_VALUES[move.capturedPiece]
+
+"""
+Fast constructor used by the move generators, skips the board lookups and keyword handling of Move()
+code is start | end << 6 plus any promotion and flag bits
+"""
+def packedMove(code, movingPiece, capturedPiece):
+    move = _newObject(Move)
+    move.code = code
+    move.movingPiece = movingPiece
+    move.capturedPiece = capturedPiece
+    return move
+
+
+"""
+A move packed into one int plus the moving and captured piece
+__slots__ keeps each move to a small fixed size object with no attribute dict, perft and search make millions of them
+The row, column and flag attributes are read from the packed code
+"""
 class Move():
+    __slots__ = ("code", "movingPiece", "capturedPiece")
+
     def __init__(self, startPos, endPos, board, promotionChoice = 'Q', isEnPassant = False, isCastling = False):
-        self.startRow = startPos[0]
-        self.startCol = startPos[1]
-        self.endRow = endPos[0]
-        self.endCol = endPos[1]
-        self.movingPiece = int(board[self.startRow][self.startCol].item())
-        self.capturedPiece = int(board[self.endRow][self.endCol].item())
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
-        self.promotionChoice = promotionChoice # defaults pawn promotion to queen
-        self.isEnPassant = isEnPassant
+        start = startPos[0]*BOARD_DIM + startPos[1]
+        end = endPos[0]*BOARD_DIM + endPos[1]
+        code = start | (end << 6)
+        self.movingPiece = board[start]
+        self.capturedPiece = board[end]
         if isEnPassant: # note that enpassant moves capture pawns
+            code |= FLAG_EN_PASSANT
             if self.movingPiece == 6:
                 self.capturedPiece = 12
             else:
                 self.capturedPiece = 6
-        self.isPawnPromotion = ((self.movingPiece == 6 or self.movingPiece == 12) and (self.endRow == 0 or self.endRow == 7)) # a pawn reaches the back row
-        self.isCastling = isCastling
+        if isCastling:
+            code |= FLAG_CASTLING
+        if (self.movingPiece == 6 or self.movingPiece == 12) and (endPos[0] == 0 or endPos[0] == 7): # a pawn reaches the back row
+            code |= FLAG_PROMOTION | (PROMOTION_CODES[promotionChoice.lower()] << PROMOTION_SHIFT) # defaults pawn promotion to queen
+        self.code = code
+
+    @property
+    def startSq(self):
+        return self.code & SQUARE_MASK
+
+    @property
+    def endSq(self):
+        return (self.code >> 6) & SQUARE_MASK
+
+    @property
+    def startRow(self):
+        return (self.code & SQUARE_MASK) >> 3
+
+    @property
+    def startCol(self):
+        return self.code & 7
+
+    @property
+    def endRow(self):
+        return ((self.code >> 6) & SQUARE_MASK) >> 3
+
+    @property
+    def endCol(self):
+        return (self.code >> 6) & 7
+
+    # same number the old attribute held, start row, start col, end row, end col as decimal digits
+    @property
+    def moveID(self):
+        return self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+
+    @property
+    def isEnPassant(self):
+        return (self.code & FLAG_EN_PASSANT) != 0
+
+    @property
+    def isCastling(self):
+        return (self.code & FLAG_CASTLING) != 0
+
+    @property
+    def isPawnPromotion(self):
+        return (self.code & FLAG_PROMOTION) != 0
+
+    # perft and the GUI set this to pick the promotion piece before making the move
+    @property
+    def promotionChoice(self):
+        return PROMOTION_LETTERS[(self.code >> PROMOTION_SHIFT) & 0x7]
+
+    @promotionChoice.setter
+    def promotionChoice(self, piece):
+        self.code = (self.code & ~PROMOTION_BITS) | (PROMOTION_CODES[piece.lower()] << PROMOTION_SHIFT)
 
     """
     overriding == method
     """
     def __eq__(self, other):
         if isinstance(other, Move):
-            return self.moveID == other.moveID
+            return (self.code & MOVE_SQUARES_MASK) == (other.code & MOVE_SQUARES_MASK)
         return False
 
     def executeMove(self, board):
-        board[self.endRow][self.endCol] = self.movingPiece # moves piece to new pos
-        board[self.startRow][self.startCol] = 0 # sets old position to 0
+        code = self.code
+        board[(code >> 6) & SQUARE_MASK] = self.movingPiece # moves piece to new pos
+        board[code & SQUARE_MASK] = 0 # sets old position to 0
 
     def getAlgebraicNotation (self):
         return (ALGNDIC[self.startCol] + str(8 - self.startRow) + ALGNDIC[self.endCol] + str(8 - self.endRow))
-            
\ No newline at end of file
+
+    # UCI long algebraic notation, the squares plus the promotion piece when there is one (e7e8q)
+    def getUCINotation (self):
+        if self.code & FLAG_PROMOTION:
+            return self.getAlgebraicNotation() + self.promotionChoice
+        return self.getAlgebraicNotation()
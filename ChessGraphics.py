@@ -3,9 +3,7 @@ Handels user input and displays game animation
 """
 
 import pygame as pyg
-import torch
-import ChessEngine
-from ChessEngine import Move, set_board, LASTWHITEPIECE, LASTBLACKPIECE, inverseDecoder, inverseALGNDIC
+from ChessEngine import Move, set_board, LASTWHITEPIECE, LASTBLACKPIECE, inverseDecoder
 import ChessBot
 
 pyg.init()
@@ -19,6 +17,7 @@ COLORS = [pyg.Color("#eeeed2"), pyg.Color("#769656")] # light color first dark s
 HIGHLIGHT = [pyg.Color("#CCCCFF"), pyg.Color("#AA98A9")] # highlights the square the piece came 
 ATTACK_HIGHLIGHT = [pyg.Color("#FFBF00"), pyg.Color("#CD7F32")] # highlights squares piece can be moved to
 SIDE_LETTERS = ('a', 'b', 'c', 'd', 'e', 'f', 'g', 'h')
+BOT_TIME_LIMIT = 2.0 # seconds the bot gets to search each move
 
 """
 loads images into pygame
@@ -62,7 +61,7 @@ draws the pieces on the board based on gameState
 def drawPieces(screen, board):
     for row in range(BOARD_DIM):
         for col in range(BOARD_DIM):
-            piece = board[row][col].item()
+            piece = board[row*BOARD_DIM + col]
             if piece != 0: # is not empty square
                 screen.blit(IMAGES[piece], pyg.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
@@ -80,6 +79,15 @@ def drawPreviousMoveHighlight(screen, gameState, moveUndone):
         movedFromSquareColor = HIGHLIGHT[(previousMove.startCol+previousMove.startRow) % 2]
         pyg.draw.rect(screen, movedFromSquareColor, pyg.Rect(previousMove.startCol*SQ_SIZE, previousMove.startRow*SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
+"""
+prints the bot's search stats after each of its moves
+"""
+def printBotInfo(info):
+    if info.get("book"):
+        print("book move: " + info["move"])
+    else:
+        print("depth: " + str(info["depth"]) + " nodes: " + str(info["nodes"]) + " nodes/sec: " + str(info["nps"]) + " score: " + str(info["score"]))
+
 """
 will handle user input and updating graphics
 drag and drop
@@ -117,7 +125,7 @@ def main():
 
         # play bots move
         if SinglePlayer and not (PlayerColorWhite and whitesMove):
-            botMove = ChessBot.RandomBot(gameState)
+            botMove = ChessBot.AlphaBetaBot(gameState, timeLimit = BOT_TIME_LIMIT, infoCallback = printBotInfo)
             gameState.makeMove(botMove)
             print(botMove.getAlgebraicNotation())
             validMoves = gameState.getValidMoves()
@@ -143,11 +151,11 @@ def main():
                     location = pyg.mouse.get_pos()
                     mouse_down_col = location[0] // SQ_SIZE
                     mouse_down_row = location[1] // SQ_SIZE
-                    piece = int(gameState.board[mouse_down_row][mouse_down_col].item())
+                    piece = gameState.board[mouse_down_row*BOARD_DIM + mouse_down_col]
                     for pieceOfIntrest in validMoves:
                             if piece == pieceOfIntrest.movingPiece and mouse_down_row == pieceOfIntrest.startRow and mouse_down_col == pieceOfIntrest.startCol:
                                 validMoveSquaresToHighlight.append(pieceOfIntrest)
-                    if gameState.board[mouse_down_row][mouse_down_col] != 0:
+                    if gameState.board[mouse_down_row*BOARD_DIM + mouse_down_col] != 0:
                         dragging = True
                         # highlight potential move squares
                         highlightingPotMoves = True
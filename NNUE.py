@@ -0,0 +1,217 @@
+"""
+Efficiently updatable neural network evaluation (NNUE) for the search, CPU torch only
+The first layer is a 768 -> hidden feature transformer over (piece, square) features, one accumulator for white's view of the board
+and one for black's view (the board flipped and the colours swapped), then two small dense layers on top
+makeMove and undoMove tell the attached Accumulator which pieces moved so the first layer is kept up to date by adding and subtracting
+weight columns instead of being recomputed for every leaf
+"""
+
+import sys
+import time
+import random
+import torch
+from torch import nn
+from ChessEngine import BOARD_DIM, set_board
+from BoardEncoder import PIECE_PLANES, SIDE_PLANE
+
+SQUARES = BOARD_DIM * BOARD_DIM
+NUM_FEATURES = PIECE_PLANES * SQUARES # one per piece code and square, (piece - 1) * 64 + sq like the BoardEncoder piece planes
+DEFAULT_HIDDEN = 256
+DENSE_SIZE = 32
+OUTPUT_SCALE = 100 # the network outputs pawns from the side to move's view, evaluate returns centipawns
+
+# feature of the same piece in black's view, the board is flipped top to bottom and the colours swap
+MIRROR_FEATURES = [((piece + 6) % 12)*SQUARES + (sq ^ 56) for piece in range(PIECE_PLANES) for sq in range(SQUARES)]
+# BoardEncoder piece planes in the order black's view sees them, black pieces first
+MIRROR_PLANES = list(range(6, PIECE_PLANES)) + list(range(6))
+
+
+class NNUENetwork(nn.Module):
+    def __init__(self, hidden = DEFAULT_HIDDEN):
+        super().__init__()
+        self.hiddenSize = hidden
+        self.featureTransformer = nn.Linear(NUM_FEATURES, hidden)
+        self.dense = nn.Linear(2 * hidden, DENSE_SIZE)
+        self.output = nn.Linear(DENSE_SIZE, 1)
+        self.columns = None
+
+    # runs the layers after the feature transformer on accumulators that are already in side to move, other side order
+    def head(self, accumulators):
+        x = torch.clamp(accumulators, 0, 1).flatten(start_dim = -2)
+        x = torch.clamp(self.dense(x), 0, 1)
+        return self.output(x)
+
+    """
+    Full batched forward pass for training and batch evaluation
+    planes is the N x 18 x 8 x 8 output of BoardEncoder.encodeBatch, returns N scores in pawns from the side to move's view
+    """
+    def forward(self, planes):
+        n = planes.shape[0]
+        whiteView = planes[:, :PIECE_PLANES].reshape(n, NUM_FEATURES)
+        blackView = planes[:, MIRROR_PLANES].flip(2).reshape(n, NUM_FEATURES)
+        whiteAccumulator = self.featureTransformer(whiteView)
+        blackAccumulator = self.featureTransformer(blackView)
+        whitesMove = planes[:, SIDE_PLANE, 0, 0].view(n, 1) > 0
+        ours = torch.where(whitesMove, whiteAccumulator, blackAccumulator)
+        theirs = torch.where(whitesMove, blackAccumulator, whiteAccumulator)
+        return self.head(torch.stack((ours, theirs), dim = 1)).view(n)
+
+    """
+    Caches the weights in the shapes single position evaluation wants, call it again after changing the weights
+    columns[feature] is (white view column, black view column) so one index gives the change to both accumulators
+    denseWeights has the dense layer for white to move and for black to move, with black to move the two halves swap
+    so the accumulators never have to be put in side to move order
+    """
+    def prepare(self):
+        with torch.no_grad():
+            columns = self.featureTransformer.weight.t().contiguous()
+            self.columns = torch.stack((columns, columns[MIRROR_FEATURES]), dim = 1)
+            weight = self.dense.weight.detach()
+            self.denseWeights = (weight.clone(), torch.cat((weight[:, self.hiddenSize:], weight[:, :self.hiddenSize]), dim = 1))
+            self.denseBias = self.dense.bias.detach().clone()
+            self.outputWeight = self.output.weight.detach().view(DENSE_SIZE).clone()
+            self.outputBias = float(self.output.bias)
+        self.eval()
+
+    # score in centipawns from the side to move's view for one position's accumulators, white's view first
+    def evaluateAccumulators(self, accumulators, whitesMove):
+        with torch.no_grad():
+            x = torch.addmv(self.denseBias, self.denseWeights[0 if whitesMove else 1], accumulators.clamp(0, 1).view(-1)).clamp_(0, 1)
+            return int((float(torch.dot(x, self.outputWeight)) + self.outputBias) * OUTPUT_SCALE)
+
+    # both accumulators from scratch, row 0 is white's view and row 1 black's
+    def refresh(self, board):
+        if self.columns is None:
+            self.prepare()
+        features = [(piece - 1)*SQUARES + sq for sq, piece in enumerate(board) if piece != 0]
+        with torch.no_grad():
+            return self.columns[features].sum(dim = 0) + self.featureTransformer.bias
+
+    # the naive way to evaluate one position, builds the input features and runs every layer
+    def evaluateBoard(self, board, whitesMove):
+        active = [(piece - 1)*SQUARES + sq for sq, piece in enumerate(board) if piece != 0]
+        features = torch.zeros(2, NUM_FEATURES)
+        features[0, active] = 1
+        features[1, [MIRROR_FEATURES[feature] for feature in active]] = 1
+        with torch.no_grad():
+            accumulators = self.featureTransformer(features)
+            if not whitesMove:
+                accumulators = accumulators.flip(0)
+            return int(float(self.head(accumulators)) * OUTPUT_SCALE)
+
+
+"""
+Stack of accumulators that follows a GameState through makeMove and undoMove
+A move only records which pieces it added and removed, the accumulator for it is worked out the first time a position under it is evaluated,
+so interior nodes that are never evaluated cost nothing and undoing a move just drops the top of the stack
+"""
+class Accumulator():
+    def __init__(self, network, gameState):
+        self.network = network
+        self.stack = [network.refresh(gameState.board)]
+        self.changes = [None] # (removed, added) lists of (piece, square) for the move that led to each entry
+        gameState.accumulator = self
+
+    def push(self, removed, added):
+        self.stack.append(None)
+        self.changes.append((removed, added))
+
+    def pop(self):
+        self.stack.pop()
+        self.changes.pop()
+
+    # brings the accumulators of the current position up to date from the nearest position above it that has them
+    def current(self):
+        stack = self.stack
+        i = len(stack) - 1
+        while stack[i] is None:
+            i -= 1
+        columns = self.network.columns
+        while i < len(stack) - 1:
+            removed, added = self.changes[i + 1]
+            accumulators = stack[i]
+            if added:
+                accumulators = accumulators + columns[(added[0][0] - 1)*SQUARES + added[0][1]]
+                for piece, sq in added[1:]:
+                    accumulators += columns[(piece - 1)*SQUARES + sq]
+                for piece, sq in removed:
+                    accumulators -= columns[(piece - 1)*SQUARES + sq]
+            i += 1
+            stack[i] = accumulators
+        return stack[-1]
+
+    def evaluate(self, whitesMove):
+        return self.network.evaluateAccumulators(self.current(), whitesMove)
+
+    def detach(self, gameState):
+        if gameState.accumulator is self:
+            gameState.accumulator = None
+
+
+# evaluation for AlphaBetaSearch(evaluate = NNUE.evaluate), the game state needs an Accumulator attached
+def evaluate(gameState):
+    return gameState.accumulator.evaluate(gameState.whitesMove)
+
+
+def saveNetwork(network, path):
+    torch.save(network.state_dict(), path)
+
+# loads weights saved by saveNetwork from a local file onto the cpu, the hidden size is read from the weights
+def loadNetwork(path):
+    state = torch.load(path, map_location = "cpu", weights_only = True)
+    network = NNUENetwork(state["featureTransformer.weight"].shape[0])
+    network.load_state_dict(state)
+    network.prepare()
+    return network
+
+
+"""
+Times evals/sec the way a search uses them, one move made, the position evaluated and the move undone, over positions from random games
+compares the accumulator against a full forward pass of evaluateBoard and returns (incremental evals/sec, full forward evals/sec)
+"""
+def benchmark(network, games = 20, seed = 0):
+    rng = random.Random(seed)
+    positions = []
+    for _ in range(games):
+        gameState = set_board()
+        for _ in range(rng.randrange(10, 80)):
+            moves = gameState.getValidMoves()
+            if not moves:
+                break
+            gameState.makeMove(rng.choice(moves))
+        positions.append(gameState)
+
+    torch.set_grad_enabled(False)
+    evals = 0
+    start = time.perf_counter()
+    for gameState in positions:
+        accumulator = Accumulator(network, gameState)
+        for move in gameState.getValidMoves():
+            gameState.makeMove(move)
+            accumulator.evaluate(gameState.whitesMove)
+            gameState.undoMove()
+            evals += 1
+        accumulator.detach(gameState)
+    incremental = evals / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for gameState in positions:
+        for move in gameState.getValidMoves():
+            gameState.makeMove(move)
+            network.evaluateBoard(gameState.board, gameState.whitesMove)
+            gameState.undoMove()
+    full = evals / (time.perf_counter() - start)
+    torch.set_grad_enabled(True)
+    return incremental, full
+
+
+if __name__ == "__main__":
+    torch.set_num_threads(1)
+    if len(sys.argv) > 1:
+        network = loadNetwork(sys.argv[1])
+    else:
+        network = NNUENetwork()
+        network.prepare()
+    incremental, full = benchmark(network)
+    print("hidden size: " + str(network.hiddenSize))
+    print("incremental: " + str(int(incremental)) + " evals/sec full forward: " + str(int(full)) + " evals/sec")
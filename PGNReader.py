@@ -0,0 +1,267 @@
+"""
+Streams PGN archives and UCI move lists through the engine to pull positions out of them
+Games are read one at a time from the file so memory stays at one game however big the archive is, every move (SAN like Nbxd7+
+or UCI coordinates like e7e8q) is looked up in an index of the legal moves of the position it is played from and made with makeMove
+A game with a move that can't be read or isn't legal is skipped and counted, the rest of the archive carries on
+"""
+
+import re
+import time
+import argparse
+import ChessEngine
+from ChessEngine import BOARD_DIM, SQUARE_MASK, PROMOTION_CODES, DEFAULT_PROMOTION, inverseALGNDIC, packedMove
+from BitboardEngine import BitboardGameState, BACK_RANKS
+from PositionDataset import PositionWriter, positionRecord
+
+RESULTS = {"1-0": 1, "1/2-1/2": 0, "0-1": -1, "*": None}
+# comments, brackets of variations, NAGs, move numbers and everything else as one token each
+TOKEN = re.compile(r"\{[^}]*\}?|;[^\n]*|\(|\)|\$\d+|\d+\.+|[^\s(){};$]+")
+SAN = re.compile(r"([KQRBN])?([a-h])?([1-8])?[-x]?([a-h][1-8])(?:=?([QRBNqrbn]))?[+#!?]*$")
+UCI = re.compile(r"([a-h][1-8])([a-h][1-8])([qrbn])?$")
+CASTLING = re.compile(r"(O-O-O|0-0-0|O-O|0-0)[+#!?]*$")
+TAG = re.compile(r'\[(\w+)\s+"(.*)"\]')
+# SAN piece letters to white's piece code, black's is 6 more
+PIECE_CODES = {'K': 1, 'Q': 2, 'R': 3, 'B': 4, 'N': 5, None: 6}
+
+
+def squareIndex(name):
+    return (8 - int(name[1]))*BOARD_DIM + inverseALGNDIC[name[0]]
+
+
+"""
+Reads games from a PGN file, or any iterable of lines, one at a time and yields (tags, movetext) for each
+A file of UCI move lists with one game per line and no tags works too, every line is its own game
+"""
+def readGames(source):
+    lines = open(source) if isinstance(source, str) else source
+    try:
+        tags = {}
+        movetext = []
+        for line in lines:
+            line = line.strip()
+            if line.startswith('['):
+                if movetext: # a tag after movetext starts the next game
+                    yield tags, '\n'.join(movetext)
+                    tags = {}
+                    movetext = []
+                tag = TAG.match(line)
+                if tag:
+                    tags[tag.group(1)] = tag.group(2)
+            elif line and not line.startswith('%'):
+                movetext.append(line)
+                # without tags there is nothing to tell one game from the next but the end of a line
+                if not tags:
+                    yield tags, '\n'.join(movetext)
+                    movetext = []
+        if tags or movetext:
+            yield tags, '\n'.join(movetext)
+    finally:
+        if lines is not source:
+            lines.close()
+
+
+# the moves of the main line and the result at the end of it if there is one, comments, variations, NAGs and move numbers are dropped
+def mainLine(movetext):
+    moves = []
+    result = None
+    depth = 0
+    for token in TOKEN.findall(movetext):
+        first = token[0]
+        if first == '(':
+            depth += 1
+        elif first == ')':
+            depth -= 1
+        elif depth > 0 or first == '{' or first == ';' or first == '$' or token[-1] == '.':
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            moves.append(token)
+    return moves, result
+
+
+"""
+Legal moves of one position looked up by moving piece and end square, so a move is found without building a Move
+for the token and comparing it against every legal move like AlgToMove
+On the bitboard backend the index is the (start square, target bitboard) list from getMoveTargets and only the Move that is played gets built,
+the mailbox backend indexes the Move objects of getValidMoves by (moving piece, end square)
+"""
+class MoveIndex():
+    def __init__(self, gameState):
+        self.gameState = gameState
+        if isinstance(gameState, BitboardGameState):
+            self.targetList, self.specialMoves = gameState.getMoveTargets()
+            self.index = None
+        else:
+            self.index = {}
+            for move in gameState.getValidMoves():
+                key = (move.movingPiece, (move.code >> 6) & SQUARE_MASK)
+                if key in self.index:
+                    self.index[key].append(move)
+                else:
+                    self.index[key] = [move]
+
+    # legal moves of piece that end on end
+    def candidates(self, piece, end):
+        if self.index is not None:
+            return self.index.get((piece, end), [])
+        board = self.gameState.board
+        moves = []
+        for start, targets in self.targetList:
+            if board[start] == piece and (targets >> end) & 1:
+                code = start | (end << 6)
+                if (piece == 6 or piece == 12) and (1 << end) & BACK_RANKS:
+                    code |= DEFAULT_PROMOTION
+                moves.append(packedMove(code, piece, board[end]))
+        for move in self.specialMoves:
+            if move.movingPiece == piece and (move.code >> 6) & SQUARE_MASK == end:
+                moves.append(move)
+        return moves
+
+    # the legal Move for a SAN or UCI token, raises ValueError if it can't be read, isn't legal or is ambiguous
+    def find(self, token):
+        uci = UCI.match(token)
+        if uci:
+            start = squareIndex(uci.group(1))
+            candidates = [move for move in self.candidates(self.gameState.board[start], squareIndex(uci.group(2)))
+                          if move.code & SQUARE_MASK == start]
+            return self.pick(token, candidates, uci.group(3))
+        castling = CASTLING.match(token)
+        if castling:
+            king, kingLoc = (1, self.gameState.whiteKingLoc) if self.gameState.whitesMove else (7, self.gameState.blackKingLoc)
+            if kingLoc == ():
+                raise ValueError("castling without a king: " + token)
+            kingSq = kingLoc[0]*BOARD_DIM + kingLoc[1]
+            end = kingSq - 2 if len(castling.group(1)) > 3 else kingSq + 2
+            candidates = [move for move in self.candidates(king, end) if move.isCastling]
+            return self.pick(token, candidates, None)
+        san = SAN.match(token)
+        if not san:
+            raise ValueError("can't read move: " + token)
+        letter, fromFile, fromRank, end, promotion = san.groups()
+        piece = PIECE_CODES[letter] + (0 if self.gameState.whitesMove else 6)
+        candidates = self.candidates(piece, squareIndex(end))
+        if fromFile is not None:
+            col = inverseALGNDIC[fromFile]
+            candidates = [move for move in candidates if move.code & 7 == col]
+        if fromRank is not None:
+            row = 8 - int(fromRank)
+            candidates = [move for move in candidates if (move.code & SQUARE_MASK) >> 3 == row]
+        return self.pick(token, candidates, promotion)
+
+    def pick(self, token, candidates, promotion):
+        if len(candidates) != 1:
+            raise ValueError(("illegal move: " if len(candidates) == 0 else "ambiguous move: ") + token)
+        move = candidates[0]
+        if promotion is not None:
+            if not move.isPawnPromotion or promotion.lower() not in PROMOTION_CODES:
+                raise ValueError("bad promotion: " + token)
+            move.promotionChoice = promotion
+        return move
+
+
+"""
+Replays games from readGames and keeps count of what it did
+backend is passed to set_board, the bitboard backend replays about 2.5 times as many moves/sec
+"""
+class PGNReplayer():
+    def __init__(self, backend = "bitboard"):
+        self.backend = backend
+        self.games = 0
+        self.skipped = 0
+        self.moves = 0
+        self.seconds = 0.0
+        self.lastError = None
+
+    # the games of source up to maxGames, the time spent reading and replaying them goes into seconds
+    def gamesFrom(self, source, maxGames):
+        start = time.perf_counter()
+        try:
+            for game in readGames(source):
+                if maxGames is not None and self.games + self.skipped >= maxGames:
+                    break
+                yield game
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    # yields (gameState, move, tags, result) for one game, raises ValueError at a move that can't be played
+    def replayGame(self, tags, movetext):
+        gameState = ChessEngine.set_board(tags.get("FEN", ChessEngine.STARTINGFEN), backend = self.backend)
+        tokens, ending = mainLine(movetext)
+        result = RESULTS.get(tags.get("Result", ending or "*"))
+        for token in tokens:
+            move = MoveIndex(gameState).find(token)
+            yield gameState, move, tags, result
+            gameState.makeMove(move)
+            self.moves += 1
+
+    def skip(self, error):
+        self.skipped += 1
+        self.lastError = str(error)
+
+    """
+    Yields (gameState, move, tags, result) for every position of every game before move is made from it,
+    result is 1, 0, -1 or None from white's view as in the Result tag or the end of the movetext
+    The game state is the replayer's own and the move is made as soon as the next position is asked for, so copy anything that has to be kept
+    A malformed game stops at the bad move and is counted in skipped, the positions before it were legal and have already been yielded
+    """
+    def positions(self, source, maxGames = None):
+        for tags, movetext in self.gamesFrom(source, maxGames):
+            try:
+                for position in self.replayGame(tags, movetext):
+                    yield position
+                self.games += 1
+            except (ValueError, IndexError, KeyError) as error: # set_board raises the last two on a broken FEN tag
+                self.skip(error)
+
+    """
+    Replays source into a PositionDataset file with the move played and the game result on every record
+    A game's records are only written once the whole game has replayed, so skipped games leave nothing behind
+    returns the number of positions written
+    """
+    def writeDataset(self, source, path, maxGames = None):
+        written = 0
+        with PositionWriter(path) as writer:
+            for tags, movetext in self.gamesFrom(source, maxGames):
+                try:
+                    records = [positionRecord(gameState, result = result, move = move)
+                               for gameState, move, tags, result in self.replayGame(tags, movetext)]
+                except (ValueError, IndexError, KeyError) as error:
+                    self.skip(error)
+                    continue
+                self.games += 1
+                writer.writePacked(records)
+                written += len(records)
+        return written
+
+    def stats(self):
+        return {
+            "games": self.games,
+            "skipped": self.skipped,
+            "moves": self.moves,
+            "seconds": self.seconds,
+            "gamesPerSecond": self.games / self.seconds if self.seconds > 0 else 0.0,
+            "movesPerSecond": self.moves / self.seconds if self.seconds > 0 else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "replay a PGN file or UCI move lists and report games/sec and moves/sec")
+    parser.add_argument("pgn")
+    parser.add_argument("--output", default = None, help = "PositionDataset file to append the positions to")
+    parser.add_argument("--backend", default = "bitboard", choices = ("mailbox", "bitboard"))
+    parser.add_argument("--max-games", type = int, default = None)
+    args = parser.parse_args()
+
+    replayer = PGNReplayer(args.backend)
+    if args.output:
+        print("positions written: " + str(replayer.writeDataset(args.pgn, args.output, args.max_games)))
+    else:
+        for position in replayer.positions(args.pgn, args.max_games):
+            pass
+    stats = replayer.stats()
+    print("games: " + str(stats["games"]) + " skipped: " + str(stats["skipped"]) + " moves: " + str(stats["moves"]) +
+          " time: " + str(round(stats["seconds"], 2)) + " s games/sec: " + str(round(stats["gamesPerSecond"], 1)) +
+          " moves/sec: " + str(int(stats["movesPerSecond"])))
+    if replayer.lastError:
+        print("last skipped game: " + replayer.lastError)
@@ -0,0 +1,300 @@
+"""
+Packed position dataset for training, one fixed width binary record per position in a file that is read through mmap
+FEN text has to be split and parsed one string at a time and takes about 60 bytes per position, a record here is 42 bytes
+and a batch of records decodes straight into the arrays BoardEncoder.encodeArrays takes with a handful of numpy ops
+The reader never loads the file, the OS pages in the records a batch touches, so a file of hundreds of millions of positions
+can be shuffle sampled with only the index of the current window of blocks in memory
+"""
+
+import os
+import sys
+import time
+import mmap
+import struct
+import numpy as np
+import torch
+import ChessEngine
+from ChessEngine import BOARD_DIM, SQUARE_TO_POS, PACKED_MOVE_MASK
+from BoardEncoder import NUM_PLANES, fensToArrays, encodeArrays
+
+SQUARES = BOARD_DIM * BOARD_DIM
+FILE_MAGIC = b"CPOS"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<4sHH") # magic, version, record size
+"""
+record layout, little endian:
+board (32 bytes, two squares per byte with the lower square in the low nibble), flags (bit 0 white to move,
+bits 1-4 castling rights as in GameState.getCastlingRights), en passant square + 1 (0 for none), half move clock, full move number (uint16),
+score in centipawns from the side to move's view (int16), result (1 white won, 0 draw, -1 black won), move played (Move.code & PACKED_MOVE_MASK)
+score, result and move are optional, a missing one holds NO_SCORE, NO_RESULT or NO_MOVE
+"""
+RECORD = struct.Struct("<32sBBBHhbH")
+RECORD_DTYPE = np.dtype([
+    ("board", np.uint8, (SQUARES // 2,)),
+    ("flags", np.uint8),
+    ("enPassant", np.uint8),
+    ("halfMoves", np.uint8),
+    ("fullMoves", "<u2"),
+    ("score", "<i2"),
+    ("result", np.int8),
+    ("move", "<u2"),
+])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+NO_SCORE = -32768
+NO_RESULT = -128
+NO_MOVE = 0 # a move from a8 to a8 can't be played
+MAX_SCORE = 32767
+
+
+def packBoard(board):
+    return bytes(low | (high << 4) for low, high in zip(board[0::2], board[1::2]))
+
+def unpackBoard(packed):
+    board = []
+    for byte in packed:
+        board.append(byte & 0xF)
+        board.append(byte >> 4)
+    return board
+
+
+# one record for the current position of gameState, the optional fields are left out with None
+def positionRecord(gameState, score = None, result = None, move = None):
+    enPassant = gameState.enPassant[0]*BOARD_DIM + gameState.enPassant[1] + 1 if gameState.enPassant != () else 0
+    return RECORD.pack(packBoard(gameState.board), gameState.whitesMove | (gameState.getCastlingRights() << 1), enPassant,
+                       min(gameState.movesSinceCapture, 255), min(gameState.turn, 0xFFFF),
+                       NO_SCORE if score is None else max(-MAX_SCORE, min(MAX_SCORE, score)),
+                       NO_RESULT if result is None else result,
+                       NO_MOVE if move is None else move.code & PACKED_MOVE_MASK)
+
+
+"""
+Builds records for a list of FEN strings without making GameStates, the placements go through BoardEncoder.fensToArrays in one batch
+scores and results are optional lists lined up with fens, returns a numpy array of RECORD_DTYPE
+"""
+def fensToRecords(fens, scores = None, results = None):
+    boards, sides, castling, enPassant = fensToArrays(fens)
+    records = np.zeros(len(fens), dtype = RECORD_DTYPE)
+    boards = boards.numpy()
+    records["board"] = boards[:, 0::2] | (boards[:, 1::2] << 4)
+    records["flags"] = sides.numpy() | (castling.numpy() << 1)
+    records["enPassant"] = enPassant.numpy() + 1
+    clocks = [fen.split()[4:6] for fen in fens]
+    records["halfMoves"] = [min(int(clock[0]), 255) if len(clock) > 0 else 0 for clock in clocks]
+    records["fullMoves"] = [min(int(clock[1]), 0xFFFF) if len(clock) > 1 else 1 for clock in clocks]
+    if scores is None:
+        records["score"] = NO_SCORE
+    else:
+        scores = np.asarray(scores)
+        records["score"] = np.where(scores == NO_SCORE, NO_SCORE, np.clip(scores, -MAX_SCORE, MAX_SCORE))
+    records["result"] = NO_RESULT if results is None else results
+    records["move"] = NO_MOVE
+    return records
+
+
+"""
+Appends records to a position file, the header is written when the file is new
+Records are gathered in memory and written bufferSize at a time, use it in a with block or call close so the last ones get written
+"""
+class PositionWriter():
+    def __init__(self, path, bufferSize = 4096):
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, RECORD.size))
+        else:
+            readHeader(path)
+        self.bufferSize = bufferSize
+        self.buffer = []
+        self.count = 0
+
+    def write(self, gameState, score = None, result = None, move = None):
+        self.buffer.append(positionRecord(gameState, score, result, move))
+        self.count += 1
+        if len(self.buffer) >= self.bufferSize:
+            self.flush()
+
+    # appends records already packed by positionRecord
+    def writePacked(self, records):
+        self.buffer.extend(records)
+        self.count += len(records)
+        if len(self.buffer) >= self.bufferSize:
+            self.flush()
+
+    # writes a numpy array of RECORD_DTYPE, for bulk conversions like fensToRecords
+    def writeRecords(self, records):
+        self.flush()
+        self.file.write(np.ascontiguousarray(records, dtype = RECORD_DTYPE).tobytes())
+        self.count += len(records)
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(b''.join(self.buffer))
+            self.buffer = []
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+def readHeader(path):
+    with open(path, "rb") as file:
+        header = file.read(FILE_HEADER.size)
+    if len(header) < FILE_HEADER.size:
+        raise ValueError(path + " is not a position file")
+    magic, version, recordSize = FILE_HEADER.unpack(header)
+    if magic != FILE_MAGIC or version != FILE_VERSION or recordSize != RECORD.size:
+        raise ValueError(path + " is not a version " + str(FILE_VERSION) + " position file")
+
+
+"""
+Random access reader over a position file
+dataset[i] is a numpy record viewing the mapped file and dataset[a:b] a view of a run of records, neither copies anything,
+batch and encode gather the records for a list of indexes in one numpy take
+"""
+class PositionDataset():
+    def __init__(self, path):
+        readHeader(path)
+        self.path = path
+        self.length = (os.path.getsize(path) - FILE_HEADER.size) // RECORD.size
+        with open(path, "rb") as file:
+            self.mapping = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        self.records = np.frombuffer(self.mapping, dtype = RECORD_DTYPE, count = self.length, offset = FILE_HEADER.size)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    # dict of torch tensors for the records at indexes (an int array, a list or a slice), see recordsToTensors
+    def batch(self, indexes):
+        return recordsToTensors(self.records[indexes])
+
+    # the N x 18 x 8 x 8 BoardEncoder planes for the records at indexes, out is an optional preallocated tensor as in encodeArrays
+    def encode(self, indexes, out = None, dtype = torch.float32):
+        batch = self.batch(indexes)
+        return encodeArrays(batch["boards"], batch["sides"], batch["castling"], batch["enPassant"], out, dtype)
+
+    # a GameState for one record to play on from, the optional fields are returned alongside as (gameState, score, result, move)
+    def gameState(self, index, backend = "mailbox"):
+        return recordToGameState(self.records[index], backend)
+
+    """
+    Yields shuffled index arrays of batchSize covering every record once per pass
+    Shuffling every index of a huge file would need 8 bytes per record in memory, so the file is cut into blocks of blockSize records,
+    the block order is shuffled and windowBlocks blocks at a time are pooled and shuffled together
+    Each batch comes back sorted so the take walks the mapped file forwards, the order inside a batch doesn't matter to training
+    """
+    def shuffledIndexes(self, batchSize, seed = 0, blockSize = 4096, windowBlocks = 64, dropLast = False):
+        rng = np.random.default_rng(seed)
+        blocks = rng.permutation((self.length + blockSize - 1) // blockSize)
+        leftover = np.empty(0, dtype = np.int64)
+        for first in range(0, len(blocks), windowBlocks):
+            starts = blocks[first:first + windowBlocks] * blockSize
+            window = np.concatenate([leftover] + [np.arange(start, min(start + blockSize, self.length)) for start in starts])
+            rng.shuffle(window)
+            full = len(window) - len(window) % batchSize
+            for i in range(0, full, batchSize):
+                yield np.sort(window[i:i + batchSize])
+            leftover = window[full:]
+        if len(leftover) > 0 and not dropLast:
+            yield np.sort(leftover)
+
+    def close(self):
+        self.records = None
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+
+"""
+Decodes a numpy array of records into torch tensors:
+boards N x 64 piece codes, sides N bools, castling N rights bits and enPassant N squares with -1 for none, the arguments of encodeArrays,
+plus halfMoves, fullMoves, score, result and move with the missing values left as NO_SCORE, NO_RESULT and NO_MOVE
+"""
+def recordsToTensors(records):
+    records = np.atleast_1d(records)
+    packed = records["board"]
+    boards = np.empty((len(records), SQUARES), dtype = np.uint8)
+    boards[:, 0::2] = packed & 0xF
+    boards[:, 1::2] = packed >> 4
+    flags = records["flags"]
+    return {
+        "boards": torch.from_numpy(boards),
+        "sides": torch.from_numpy((flags & 1).astype(bool)),
+        "castling": torch.from_numpy(flags >> 1),
+        "enPassant": torch.from_numpy(records["enPassant"].astype(np.int64) - 1),
+        "halfMoves": torch.from_numpy(records["halfMoves"].copy()),
+        "fullMoves": torch.from_numpy(records["fullMoves"].astype(np.int32)),
+        "score": torch.from_numpy(records["score"].astype(np.int16)),
+        "result": torch.from_numpy(records["result"].copy()),
+        "move": torch.from_numpy(records["move"].astype(np.int32)),
+    }
+
+
+def recordToGameState(record, backend = "mailbox"):
+    flags = int(record["flags"])
+    enPassant = int(record["enPassant"])
+    position = (bool(flags & 1), flags >> 1, SQUARE_TO_POS[enPassant - 1] if enPassant != 0 else (), int(record["halfMoves"]), int(record["fullMoves"]))
+    board = unpackBoard(bytes(record["board"]))
+    if backend == "bitboard":
+        from BitboardEngine import BitboardGameState
+        gameState = BitboardGameState(board, *position)
+    elif backend == "mailbox":
+        gameState = ChessEngine.GameState(board, *position)
+    else:
+        raise ValueError("unknown backend: " + str(backend))
+    score = int(record["score"])
+    result = int(record["result"])
+    move = int(record["move"])
+    return gameState, None if score == NO_SCORE else score, None if result == NO_RESULT else result, None if move == NO_MOVE else move
+
+
+"""
+Converts a text file with one FEN per line to a position file, a number after the FEN's six fields is taken as its score
+returns the number of positions written
+"""
+def convertFens(textPath, path, chunkSize = 100000):
+    written = 0
+    with open(textPath) as text, PositionWriter(path) as writer:
+        while True:
+            chunk = [text.readline() for _ in range(chunkSize)]
+            # blank lines are skipped, only readline returning '' is the end of the file
+            lines = [line.split() for line in chunk if line.strip()]
+            if lines:
+                fens = [' '.join(fields[:6]) for fields in lines]
+                scores = [int(fields[6]) if len(fields) > 6 else NO_SCORE for fields in lines]
+                writer.writeRecords(fensToRecords(fens, scores))
+                written += len(fens)
+            if chunk[-1] == '':
+                break
+    return written
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python PositionDataset.py positions.bin [fens.txt to convert first]")
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        print("converted " + str(convertFens(sys.argv[2], sys.argv[1])) + " positions")
+    dataset = PositionDataset(sys.argv[1])
+    print("positions: " + str(len(dataset)))
+    if len(dataset) > 0:
+        out = torch.empty((256, NUM_PLANES, BOARD_DIM, BOARD_DIM))
+        positions = 0
+        start = time.perf_counter()
+        for indexes in dataset.shuffledIndexes(256, dropLast = True):
+            dataset.encode(indexes, out = out)
+            positions += len(indexes)
+            if time.perf_counter() - start > 5:
+                break
+        seconds = time.perf_counter() - start
+        print("shuffled batches of 256 encoded at " + str(int(positions / seconds)) + " positions/sec")
@@ -0,0 +1,204 @@
+"""
+Plays bots against each other across a process pool and streams the games to an append-only binary file
+Every position of a game is one fixed width record with the move played from it and the final result of the game,
+the records of a game are appended as soon as it finishes so nothing piles up in memory however many games are played
+"""
+
+import time
+import random
+import struct
+import argparse
+from multiprocessing import Pool
+import ChessEngine
+import ChessBot
+from OpeningBook import PolyglotBook
+import numpy as np
+from ChessEngine import BOARD_DIM, PACKED_MOVE_MASK
+from PositionDataset import RECORD_DTYPE, NO_SCORE, PositionWriter, packBoard, unpackBoard
+
+FILE_MAGIC = b"CSPG"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<4sHH") # magic, version, record size
+"""
+record layout, little endian:
+game number (uint32), ply (uint16), board (32 bytes, two squares per byte with the lower square in the low nibble),
+flags (bit 0 white to move, bits 1-4 castling rights as in GameState.getCastlingRights), en passant square + 1 (0 for none),
+move played (Move.code & PACKED_MOVE_MASK), result (1 white won, 0 draw, -1 black won)
+"""
+RECORD = struct.Struct("<IH32sBBHb")
+RECORD_FIELDS = np.dtype([("game", "<u4"), ("ply", "<u2"), ("board", np.uint8, (32,)), ("flags", np.uint8), ("enPassant", np.uint8),
+                          ("move", "<u2"), ("result", np.int8)])
+
+WHITE_WON = 1
+DRAW = 0
+BLACK_WON = -1
+RESULT_NAMES = {WHITE_WON: "1-0", DRAW: "1/2-1/2", BLACK_WON: "0-1"}
+
+
+# the parts of a record known before the game ends
+def positionFields(gameState, move):
+    enPassant = gameState.enPassant[0]*BOARD_DIM + gameState.enPassant[1] + 1 if gameState.enPassant != () else 0
+    return (packBoard(gameState.board), gameState.whitesMove | (gameState.getCastlingRights() << 1), enPassant, move.code & PACKED_MOVE_MASK)
+
+def unpackRecord(data, offset = 0):
+    gameNumber, ply, board, flags, enPassant, move, result = RECORD.unpack_from(data, offset)
+    return {
+        "game": gameNumber,
+        "ply": ply,
+        "board": unpackBoard(board),
+        "whitesMove": bool(flags & 1),
+        "castling": flags >> 1,
+        "enPassant": enPassant - 1,
+        "move": move,
+        "result": result,
+    }
+
+# reads every record of a self play file, for checking output, training should read it through toPositionDataset
+def readRecords(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    magic, version, recordSize = FILE_HEADER.unpack_from(data, 0)
+    if magic != FILE_MAGIC or recordSize != RECORD.size:
+        raise ValueError(path + " is not a version " + str(FILE_VERSION) + " self play file")
+    for offset in range(FILE_HEADER.size, len(data) - RECORD.size + 1, RECORD.size):
+        yield unpackRecord(data, offset)
+
+
+"""
+Converts a self play file to a PositionDataset file for training, returns the number of positions written
+the half move clock isn't recorded during self play so it is left at 0, the full move number comes from the ply
+"""
+def toPositionDataset(path, datasetPath, chunkSize = 100000):
+    with open(path, "rb") as file:
+        magic, version, recordSize = FILE_HEADER.unpack(file.read(FILE_HEADER.size))
+    if magic != FILE_MAGIC or recordSize != RECORD.size:
+        raise ValueError(path + " is not a version " + str(FILE_VERSION) + " self play file")
+    games = np.memmap(path, dtype = RECORD_FIELDS, mode = "r", offset = FILE_HEADER.size)
+    with PositionWriter(datasetPath) as writer:
+        for first in range(0, len(games), chunkSize):
+            chunk = games[first:first + chunkSize]
+            records = np.zeros(len(chunk), dtype = RECORD_DTYPE)
+            for field in ("board", "flags", "enPassant", "move", "result"):
+                records[field] = chunk[field]
+            records["fullMoves"] = chunk["ply"] // 2 + 1
+            records["score"] = NO_SCORE
+            writer.writeRecords(records)
+    return len(games)
+
+
+"""
+Builds a move function from a bot name and options
+"random" plays ChessBot.RandomBot, "alphabeta" searches with ChessBot.AlphaBetaSearch (nodeLimit, timeLimit, ttSizeMB, maxDepth)
+"""
+def makeBot(name, options = None):
+    options = dict(options or {})
+    if name == "random":
+        return ChessBot.RandomBot
+    if name == "alphabeta":
+        searcher = ChessBot.AlphaBetaSearch(options.pop("ttSizeMB", 4))
+        if "nodeLimit" not in options and "timeLimit" not in options:
+            options["nodeLimit"] = 2000
+        return lambda gameState: searcher.search(gameState, **options)
+    raise ValueError("unknown bot: " + str(name))
+
+
+_workerBooks = {} # PolyglotBook by path, opened once per worker process and kept for every game it plays
+
+def workerBook(path):
+    if path not in _workerBooks:
+        _workerBooks[path] = PolyglotBook(path)
+    return _workerBooks[path]
+
+
+"""
+Plays one game in a worker process and returns (game number, result, plies, packed records)
+the first few plies are random moves so games between deterministic bots don't all repeat, they aren't recorded
+after them both bots play from the opening book at bookPath while the position is in it
+"""
+def PlayGame(args):
+    gameNumber, seed, whiteBot, blackBot, openingPlies, maxPlies, bookPath = args
+    random.seed(seed) # RandomBot and the book use the module level generator
+    bots = (makeBot(*whiteBot), makeBot(*blackBot))
+    book = workerBook(bookPath) if bookPath else None
+    gameState = ChessEngine.set_board()
+    positions = []
+    result = DRAW
+    moves = gameState.getValidMoves()
+    for ply in range(maxPlies):
+        if moves == []:
+            break
+        if ply < openingPlies:
+            move = random.choice(moves)
+        else:
+            move = book.choose(gameState) if book is not None else None
+            if move is None:
+                move = bots[0 if gameState.whitesMove else 1](gameState)
+            positions.append(positionFields(gameState, move))
+        gameState.makeMove(move)
+        # getValidMoves sets the checkmate flags, makeMove already set isStaleMate for repetition and the 50 move rule
+        moves = gameState.getValidMoves()
+        if gameState.WhiteInCheckMate:
+            result = BLACK_WON
+            break
+        if gameState.BlackInCheckMate:
+            result = WHITE_WON
+            break
+        if gameState.isStaleMate:
+            break
+    # games cut off at maxPlies count as draws
+    records = b''.join(RECORD.pack(gameNumber, openingPlies + i, board, flags, enPassant, move, result)
+                       for i, (board, flags, enPassant, move) in enumerate(positions))
+    return gameNumber, result, len(gameState.moveLog), records
+
+
+"""
+Plays games across workers processes (defaults to the cpu count) and appends them to path as they finish
+each game's opening is a random number of random plies up to openingPlies then moves from the Polyglot book at book if one is given,
+seeds are seed + game number so a run can be repeated
+returns a summary dict with the results and speed
+"""
+def RunSelfPlay (path, games = 100, workers = None, whiteBot = ("random",), blackBot = ("random",), openingPlies = 8, maxPlies = 300,
+                 seed = 0, firstGame = 0, book = None):
+    rng = random.Random(seed)
+    tasks = [(firstGame + i, seed + firstGame + i, whiteBot, blackBot, rng.randint(0, openingPlies), maxPlies, book) for i in range(games)]
+    summary = {"games": 0, "positions": 0, "plies": 0, WHITE_WON: 0, DRAW: 0, BLACK_WON: 0}
+    start = time.perf_counter()
+    with open(path, "ab") as file:
+        if file.tell() == 0:
+            file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, RECORD.size))
+        with Pool(processes = workers) as pool:
+            for gameNumber, result, plies, records in pool.imap_unordered(PlayGame, tasks):
+                file.write(records)
+                file.flush()
+                summary["games"] += 1
+                summary["positions"] += len(records) // RECORD.size
+                summary["plies"] += plies
+                summary[result] += 1
+    summary["seconds"] = time.perf_counter() - start
+    summary["gamesPerSecond"] = summary["games"] / summary["seconds"] if summary["seconds"] > 0 else 0.0
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "play bots against each other and append the positions to a binary file")
+    parser.add_argument("output")
+    parser.add_argument("--games", type = int, default = 100)
+    parser.add_argument("--workers", type = int, default = None, help = "worker processes, defaults to the cpu count")
+    parser.add_argument("--white", default = "random", choices = ("random", "alphabeta"))
+    parser.add_argument("--black", default = "random", choices = ("random", "alphabeta"))
+    parser.add_argument("--nodes", type = int, default = 2000, help = "node limit per move for alphabeta bots")
+    parser.add_argument("--opening-plies", type = int, default = 8, help = "most random plies at the start of a game")
+    parser.add_argument("--max-plies", type = int, default = 300, help = "games this long are stopped and scored as draws")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--book", default = None, help = "Polyglot opening book both bots play from before searching")
+    parser.add_argument("--first-game", type = int, default = 0, help = "number of the first game, to keep numbers unique when adding to a file")
+    args = parser.parse_args()
+
+    options = {"nodeLimit": args.nodes}
+    whiteBot = (args.white, options if args.white == "alphabeta" else None)
+    blackBot = (args.black, options if args.black == "alphabeta" else None)
+    summary = RunSelfPlay(args.output, args.games, args.workers, whiteBot, blackBot, args.opening_plies, args.max_plies, args.seed, args.first_game,
+                          args.book)
+    print("games: " + str(summary["games"]) + " positions: " + str(summary["positions"]) + " white won: " + str(summary[WHITE_WON]) +
+          " draws: " + str(summary[DRAW]) + " black won: " + str(summary[BLACK_WON]) + " time: " + str(round(summary["seconds"], 1)) +
+          " s games/sec: " + str(round(summary["gamesPerSecond"], 2)))
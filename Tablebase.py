@@ -0,0 +1,392 @@
+"""
+Endgame tablebases generated on this machine by retrograde analysis, for the endings the search is too slow to convert (KQK, KRK, KPK, KBNK)
+Every position of a material signature gets one byte, win, draw or loss for the side to move and the distance to mate in plies,
+in a file that is read through mmap so a probe only pages in what it touches
+Generation needs no downloads, the moves come from GameState.generateMoves and the same signature always gives the same file
+"""
+
+import os
+import sys
+import mmap
+import time
+import struct
+import argparse
+from multiprocessing import Pool
+import numpy as np
+import ChessEngine
+from ChessEngine import BOARD_DIM, SQUARE_MASK
+
+SQUARES = BOARD_DIM * BOARD_DIM
+FILE_MAGIC = b"CETB"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<4sH8sI") # magic, version, signature, number of positions
+TABLE_EXTENSION = ".ctb"
+TABLE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+DEFAULT_SIGNATURES = ("KQK", "KRK", "KPK", "KBNK")
+CHUNK_SIZE = 8192 # positions per task handed to a worker process
+
+"""
+value byte of a position, from the side to move's view:
+0 draw, ILLEGAL for index slots that aren't a legal position, otherwise distance to mate in plies + 1
+mate is always delivered by the side that moves last so an odd distance is a win and an even one a loss (0 is checkmated)
+"""
+DRAW = 0
+ILLEGAL = 255
+MAX_DISTANCE = 253
+WIN = 1
+LOSS = -1
+
+# what the forward pass found for each position before the retrograde passes
+NORMAL = 0
+NOT_LEGAL = 1
+MATED = 2
+STALEMATE = 3
+
+# signature letters by white piece code, black codes are 6 more
+LETTERS = " KQRBNP"
+LETTER_ORDER = "KQRBNP"
+VALUES = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+PROMOTION_PIECES = (2, 3, 4, 5) # queen, rook, bishop, knight for white
+BACK_RANKS = frozenset(list(range(BOARD_DIM)) + list(range(SQUARES - BOARD_DIM, SQUARES)))
+
+
+# the 8 symmetries of the board as square maps, identity first, the first two only mirror the files and are the only ones pawns allow
+def _buildSymmetries():
+    symmetries = []
+    for transpose in (False, True):
+        for flipRows in (False, True):
+            for flipCols in (False, True):
+                mapping = []
+                for sq in range(SQUARES):
+                    row, col = sq >> 3, sq & 7
+                    if transpose:
+                        row, col = col, row
+                    if flipRows:
+                        row = BOARD_DIM - 1 - row
+                    if flipCols:
+                        col = BOARD_DIM - 1 - col
+                    mapping.append(row*BOARD_DIM + col)
+                symmetries.append(tuple(mapping))
+    return symmetries
+
+SYMMETRIES = _buildSymmetries()
+# squares the white king is moved into, a8-d8-d5 triangle (10 squares) without pawns and the a to d files (32 squares) with them
+PAWNLESS_REGION = tuple(sq for sq in range(SQUARES) if (sq & 7) < 4 and (sq >> 3) <= (sq & 7))
+PAWN_REGION = tuple(sq for sq in range(SQUARES) if (sq & 7) < 4)
+
+
+# "KBNK" to the piece codes in index order, white's king first, raises ValueError for anything that isn't a signature
+def parseSignature(signature):
+    signature = signature.upper()
+    split = signature.find('K', 1)
+    if not signature.startswith('K') or split < 0 or 'K' in signature[split + 1:] or any(letter not in LETTER_ORDER for letter in signature):
+        raise ValueError("not a material signature: " + signature)
+    return tuple(LETTERS.index(letter) for letter in signature[:split]) + tuple(LETTERS.index(letter) + 6 for letter in signature[split:])
+
+def sideLetters(codes):
+    return ''.join(sorted((LETTERS[code] for code in codes), key = LETTER_ORDER.index))
+
+"""
+Signature tables are stored under and whether the colours have to be swapped to look the material up in it
+the side with more material is white, so KRK covers a lone rook of either colour
+"""
+def canonicalSignature(codes):
+    white = sideLetters(code for code in codes if code <= 6)
+    black = sideLetters(code - 6 for code in codes if code > 6)
+    strength = lambda side: (sum(VALUES[letter] for letter in side), len(side), [-LETTER_ORDER.index(letter) for letter in side])
+    if strength(black) > strength(white):
+        return black + white, True
+    return white + black, False
+
+# a lone minor piece or bare kings can't mate, these are draws without a table
+def isInsufficient(codes):
+    others = [code for code in codes if code != 1 and code != 7]
+    return len(others) == 0 or (len(others) == 1 and others[0] in (4, 5, 10, 11))
+
+# the signatures one capture or promotion away that need a table of their own
+def childSignatures(signature):
+    codes = parseSignature(signature)
+    children = []
+    for i, code in enumerate(codes):
+        if code == 1 or code == 7:
+            continue
+        rest = codes[:i] + codes[i + 1:]
+        changed = [rest]
+        if code == 6 or code == 12:
+            changed += [rest + (piece + (code - 6),) for piece in PROMOTION_PIECES]
+        for child in changed:
+            name = canonicalSignature(child)[0]
+            if not isInsufficient(child) and name not in children:
+                children.append(name)
+    return children
+
+def tablePath(signature, directory = TABLE_DIRECTORY):
+    return os.path.join(directory, signature + TABLE_EXTENSION)
+
+
+"""
+Index of every placement of a signature's pieces, shared by the generator and the probe
+index = side to move, then the white king's slot in its region, then the other pieces' squares in signature order (6 bits each)
+a position is first mirrored so the white king is in the region, a king on the diagonal of the triangle leaves both mirror images in the table
+"""
+class TableLayout():
+    def __init__(self, signature):
+        self.signature = signature
+        self.pieces = parseSignature(signature)
+        self.hasPawns = 6 in self.pieces or 12 in self.pieces
+        region = PAWN_REGION if self.hasPawns else PAWNLESS_REGION
+        symmetries = SYMMETRIES[:2] if self.hasPawns else SYMMETRIES
+        self.region = region
+        self.slots = {sq: slot for slot, sq in enumerate(region)}
+        # the symmetry that takes a white king on each square into the region
+        self.kingSymmetry = [next(symmetry for symmetry in symmetries if symmetry[sq] in self.slots) for sq in range(SQUARES)]
+        self.sideSize = len(region) * SQUARES ** (len(self.pieces) - 1)
+        self.size = 2 * self.sideSize
+
+    def index(self, squares, whitesMove):
+        symmetry = self.kingSymmetry[squares[0]]
+        index = self.slots[symmetry[squares[0]]]
+        for sq in squares[1:]:
+            index = index * SQUARES + symmetry[sq]
+        return index if whitesMove else index + self.sideSize
+
+    # the squares of the pieces in signature order and the side to move of an index
+    def squares(self, index):
+        whitesMove = index < self.sideSize
+        if not whitesMove:
+            index -= self.sideSize
+        squares = []
+        for _ in self.pieces[1:]:
+            squares.append(index & SQUARE_MASK)
+            index >>= 6
+        squares.append(self.region[index])
+        squares.reverse()
+        return squares, whitesMove
+
+
+"""
+The tables in a directory, opened with mmap
+probe looks a GameState up in whichever table has its material, with the colours swapped if the table has them the other way round
+"""
+class Tablebases():
+    def __init__(self, directory = TABLE_DIRECTORY):
+        self.directory = directory
+        self.tables = {} # signature: (TableLayout, mmap)
+        if os.path.isdir(directory):
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(TABLE_EXTENSION):
+                    self.open(os.path.join(directory, name))
+        # the search only probes positions with at most this many pieces on the board
+        self.maxPieces = max((len(layout.pieces) for layout, mapping in self.tables.values()), default = 0)
+
+    def open(self, path):
+        with open(path, "rb") as file:
+            header = file.read(FILE_HEADER.size)
+            if len(header) < FILE_HEADER.size:
+                raise ValueError(path + " is not a tablebase file")
+            magic, version, signature, positions = FILE_HEADER.unpack(header)
+            signature = signature.rstrip(b'\0').decode('ascii')
+            layout = TableLayout(signature)
+            if magic != FILE_MAGIC or version != FILE_VERSION or positions != layout.size:
+                raise ValueError(path + " is not a version " + str(FILE_VERSION) + " tablebase file")
+            self.tables[signature] = (layout, mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ))
+
+    def __len__(self):
+        return len(self.tables)
+
+    # value byte of pieces [(piece, sq)] with whitesMove to move, None when there is no table for the material
+    def lookup(self, pieces, whitesMove):
+        signature, swap = canonicalSignature([piece for piece, sq in pieces])
+        table = self.tables.get(signature)
+        if table is None:
+            return None
+        layout, mapping = table
+        if swap:
+            pieces = [(piece + 6 if piece <= 6 else piece - 6, sq ^ (SQUARES - BOARD_DIM)) for piece, sq in pieces]
+            whitesMove = not whitesMove
+        squaresOf = {}
+        for piece, sq in pieces:
+            squaresOf.setdefault(piece, []).append(sq)
+        squares = [squaresOf[piece].pop() for piece in layout.pieces]
+        return mapping[FILE_HEADER.size + layout.index(squares, whitesMove)]
+
+    """
+    (result, distance) for the side to move, result is WIN, DRAW or LOSS and distance the plies to mate (0 for a draw)
+    None when the material has no table or the position has castling rights or an en passant capture, which the tables leave out
+    distances are with perfect play and ignore the 50 move rule
+    """
+    def probe(self, gameState):
+        if gameState.getCastlingRights() != 0 or gameState.getEnPassantKey() != 0:
+            return None
+        value = self.lookup([(piece, sq) for sq, piece in enumerate(gameState.board) if piece], gameState.whitesMove)
+        if value is None or value == ILLEGAL:
+            return None
+        if value == DRAW:
+            return DRAW, 0
+        return (WIN if (value - 1) & 1 else LOSS), value - 1
+
+    def close(self):
+        for layout, mapping in self.tables.values():
+            mapping.close()
+        self.tables = {}
+        self.maxPieces = 0
+
+
+_workerTables = {} # Tablebases by directory, opened once per worker process
+
+"""
+Forward pass over the indexes start to stop of a signature in a worker process
+returns (status, move counts, successors), successors holds each position's children one after another, a child in the table is its index
+and a child with other material (a capture or promotion) is size + its value byte, looked up in the tables already in directory
+"""
+def expandChunk(args):
+    signature, directory, start, stop = args
+    layout = TableLayout(signature)
+    if directory not in _workerTables:
+        _workerTables[directory] = Tablebases(directory)
+    tables = _workerTables[directory]
+    status = np.full(stop - start, NOT_LEGAL, dtype = np.uint8)
+    counts = np.zeros(stop - start, dtype = np.uint8)
+    successors = []
+    for index in range(start, stop):
+        squares, whitesMove = layout.squares(index)
+        if len(set(squares)) < len(squares):
+            continue
+        if layout.hasPawns and any((piece == 6 or piece == 12) and sq in BACK_RANKS for piece, sq in zip(layout.pieces, squares)):
+            continue
+        board = [0] * SQUARES
+        for piece, sq in zip(layout.pieces, squares):
+            board[sq] = piece
+        # the side that just moved can't be left in check
+        gameState = ChessEngine.GameState(board, not whitesMove, 0)
+        if gameState.isKingAttacked():
+            continue
+        gameState.whitesMove = whitesMove
+        moves = list(gameState.generateMoves())
+        if moves == []:
+            status[index - start] = MATED if gameState.inCheck else STALEMATE
+            continue
+        status[index - start] = NORMAL
+        first = len(successors)
+        for move in moves:
+            moveStart, moveEnd = move.code & SQUARE_MASK, (move.code >> 6) & SQUARE_MASK
+            if move.capturedPiece == 0 and not move.isPawnPromotion:
+                successors.append(layout.index([moveEnd if sq == moveStart else sq for sq in squares], not whitesMove))
+                continue
+            pieces = [(piece, moveEnd if sq == moveStart else sq) for piece, sq in zip(layout.pieces, squares) if sq != moveEnd]
+            promotions = [piece + (move.movingPiece - 6) for piece in PROMOTION_PIECES] if move.isPawnPromotion else [move.movingPiece]
+            for promotion in promotions:
+                child = [(promotion if sq == moveEnd else piece, sq) for piece, sq in pieces]
+                value = tables.lookup(child, not whitesMove)
+                if value is None:
+                    if not isInsufficient([piece for piece, sq in child]):
+                        raise ValueError("no table for " + canonicalSignature([piece for piece, sq in child])[0] + " in " + directory)
+                    value = DRAW
+                successors.append(layout.size + value)
+        counts[index - start] = len(successors) - first
+    return status, counts, np.array(successors, dtype = np.int32)
+
+
+"""
+Retrograde analysis over the successor lists, one pass per distance
+at an odd distance n a position is won if a child is lost in fewer than n plies, at an even distance it is lost once every child is won
+in fewer than n plies, children outside the table are extra nodes after the positions that already hold their value byte
+returns the value byte of every position
+"""
+def solve(status, counts, successors):
+    size = len(status)
+    external = np.arange(ILLEGAL + 1)
+    distance = np.concatenate((np.where(status == MATED, 0, -1), np.where((external > 0) & (external < ILLEGAL), external - 1, -1))).astype(np.int16)
+    hasMoves = counts > 0
+    starts = (np.cumsum(counts, dtype = np.int64) - counts)[hasMoves]
+    unresolved = hasMoves.copy()
+    lastExternal = int(distance[size + np.unique(successors[successors >= size] - size)].max(initial = -1)) if len(successors) else -1
+    n = 1
+    idle = 0
+    while idle < 2 or n <= lastExternal + 1:
+        known = (distance >= 0) & (distance < n)
+        if n & 1:
+            found = np.logical_or.reduceat((known & (distance & 1 == 0))[successors], starts) if len(starts) else np.zeros(0, dtype = bool)
+        else:
+            found = np.logical_and.reduceat((known & (distance & 1 == 1))[successors], starts) if len(starts) else np.zeros(0, dtype = bool)
+        solved = np.zeros(size, dtype = bool)
+        solved[hasMoves] = found
+        solved &= unresolved
+        if solved.any():
+            if n > MAX_DISTANCE:
+                raise ValueError("distance to mate past " + str(MAX_DISTANCE) + " plies doesn't fit in a byte")
+            distance[:size][solved] = n
+            unresolved &= ~solved
+            idle = 0
+        else:
+            idle += 1
+        n += 1
+    values = np.where(distance[:size] >= 0, distance[:size] + 1, DRAW).astype(np.uint8)
+    values[status == NOT_LEGAL] = ILLEGAL
+    return values
+
+
+"""
+Generates the table for signature into directory with workers processes (the cpu count by default), after the tables it depends on
+tables that are already there are kept, returns a summary dict with the counts and the time taken
+"""
+def generateTable(signature, directory = TABLE_DIRECTORY, workers = None, chunkSize = CHUNK_SIZE):
+    signature = canonicalSignature(parseSignature(signature))[0]
+    os.makedirs(directory, exist_ok = True)
+    for child in childSignatures(signature):
+        if not os.path.exists(tablePath(child, directory)):
+            generateTable(child, directory, workers, chunkSize)
+    layout = TableLayout(signature)
+    start = time.perf_counter()
+    tasks = [(signature, directory, first, min(first + chunkSize, layout.size)) for first in range(0, layout.size, chunkSize)]
+    with Pool(processes = workers) as pool:
+        parts = pool.map(expandChunk, tasks)
+    status = np.concatenate([part[0] for part in parts])
+    counts = np.concatenate([part[1] for part in parts])
+    successors = np.concatenate([part[2] for part in parts])
+    parts = None
+    values = solve(status, counts, successors)
+    path = tablePath(signature, directory)
+    with open(path + ".tmp", "wb") as file:
+        file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, signature.encode('ascii'), layout.size))
+        file.write(values.tobytes())
+    os.replace(path + ".tmp", path)
+    legal = values != ILLEGAL
+    distances = values[legal & (values != DRAW)].astype(np.int32) - 1
+    return {
+        "signature": signature,
+        "positions": int(legal.sum()),
+        "wins": int((distances & 1 == 1).sum()),
+        "losses": int((distances & 1 == 0).sum()),
+        "draws": int((values == DRAW).sum()),
+        "longest": int(distances[distances & 1 == 1].max(initial = 0)), # longest win in plies
+        "seconds": time.perf_counter() - start,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "generate endgame tablebases or look a position up in them")
+    parser.add_argument("--directory", default = TABLE_DIRECTORY)
+    commands = parser.add_subparsers(dest = "command")
+    generate = commands.add_parser("generate", help = "generate tables and the ones they depend on")
+    generate.add_argument("signatures", nargs = "*", default = list(DEFAULT_SIGNATURES))
+    generate.add_argument("--workers", type = int, default = None, help = "worker processes, defaults to the cpu count")
+    probe = commands.add_parser("probe", help = "look up the result and distance to mate of a position")
+    probe.add_argument("fen")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        for signature in args.signatures:
+            summary = generateTable(signature, args.directory, args.workers)
+            print(summary["signature"] + " positions: " + str(summary["positions"]) + " wins: " + str(summary["wins"]) +
+                  " draws: " + str(summary["draws"]) + " losses: " + str(summary["losses"]) + " longest win: " + str(summary["longest"]) +
+                  " plies time: " + str(round(summary["seconds"], 1)) + " s")
+    elif args.command == "probe":
+        found = Tablebases(args.directory).probe(ChessEngine.set_board(args.fen))
+        if found is None:
+            print("not in the tables")
+        else:
+            print({WIN: "win", DRAW: "draw", LOSS: "loss"}[found[0]] + (" mate in " + str(found[1]) + " plies" if found[0] != DRAW else ""))
+    else:
+        parser.print_help()
+        sys.exit(1)
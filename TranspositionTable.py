@@ -0,0 +1,143 @@
+"""
+Fixed size transposition table keyed by GameState.zobristKey
+Entries live in two flat arrays of 64 bit ints so memory use is set by the size in MB and never grows
+"""
+
+from array import array
+from ChessEngine import PACKED_MOVE_MASK
+
+# bound types, 0 marks an empty slot
+EXACT = 1
+LOWER_BOUND = 2 # score is at least this (search failed high)
+UPPER_BOUND = 3 # score is at most this (search failed low)
+
+ENTRY_BYTES = 16 # one 64 bit key and one 64 bit packed data word
+BUCKET_SIZE = 2 # slot 0 is depth preferred, slot 1 is always replace
+
+SCORE_OFFSET = 32768 # scores are stored as unsigned 16 bit ints
+MAX_SCORE = 32767
+
+"""
+Packs a move into 16 bits: start square, end square and promotion piece
+These are the low bits of Move.code, only used to recognise the move again by matching it against generated moves
+"""
+def encodeMove(move):
+    return move.code & PACKED_MOVE_MASK
+
+
+class TranspositionTable():
+    def __init__(self, sizeMB = 16):
+        self.sizeMB = sizeMB
+        # largest power of two bucket count that fits so a key can be masked into an index
+        buckets = 1
+        while buckets * 2 * BUCKET_SIZE * ENTRY_BYTES <= sizeMB * 1024 * 1024:
+            buckets *= 2
+        self.bucketMask = buckets - 1
+        self.numEntries = buckets * BUCKET_SIZE
+        self.keys = array('Q', bytes(8 * self.numEntries))
+        self.data = array('Q', bytes(8 * self.numEntries))
+        # bumped once per search so entries from old searches can be replaced
+        self.generation = 0
+        self.resetStats()
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0 # probes that found the bucket full of other positions
+        self.stores = 0
+        self.overwrites = 0 # stores that threw away a different position
+
+    # empties every slot
+    def clear(self):
+        self.keys = array('Q', bytes(8 * self.numEntries))
+        self.data = array('Q', bytes(8 * self.numEntries))
+        self.generation = 0
+        self.resetStats()
+
+    # call at the start of each search so depth preferred slots from earlier searches age out
+    def newSearch(self):
+        self.generation = (self.generation + 1) & 0xFF
+
+    """
+    data word layout, low bits first:
+    16 bits move, 16 bits score + SCORE_OFFSET, 8 bits depth, 2 bits bound, 8 bits generation
+    """
+    def pack(self, depth, score, bound, move):
+        score = max(-MAX_SCORE, min(MAX_SCORE, score))
+        return move | ((score + SCORE_OFFSET) << 16) | (min(depth, 255) << 32) | (bound << 40) | (self.generation << 42)
+
+    # returns (depth, score, bound, move) for the position or None if it isn't stored
+    def probe(self, key):
+        self.probes += 1
+        index = (key & self.bucketMask) * BUCKET_SIZE
+        keys = self.keys
+        for slot in (index, index + 1):
+            if keys[slot] == key:
+                word = self.data[slot]
+                if word != 0:
+                    self.hits += 1
+                    return ((word >> 32) & 0xFF, ((word >> 16) & 0xFFFF) - SCORE_OFFSET, (word >> 40) & 0x3, word & 0xFFFF)
+        if self.data[index] != 0 and self.data[index + 1] != 0:
+            self.collisions += 1
+        return None
+
+    # move is a packed move from encodeMove, 0 if there is no best move
+    def store(self, key, depth, score, bound, move = 0):
+        self.stores += 1
+        index = (key & self.bucketMask) * BUCKET_SIZE
+        keys = self.keys
+        data = self.data
+        word = self.pack(depth, score, bound, move)
+        deepWord = data[index]
+
+        # same position already in a slot, keep the old best move if this search didn't find one
+        for slot in (index, index + 1):
+            oldWord = data[slot]
+            if keys[slot] == key and oldWord != 0:
+                if move == 0:
+                    word |= oldWord & 0xFFFF
+                if slot == index + 1 or depth >= (oldWord >> 32) & 0xFF or bound == EXACT or (oldWord >> 42) != self.generation:
+                    data[slot] = word
+                return
+
+        # depth preferred slot takes the entry if it is empty, shallower or from an older search
+        if deepWord == 0 or depth >= (deepWord >> 32) & 0xFF or (deepWord >> 42) != self.generation:
+            if deepWord != 0:
+                # the old deep entry moves down to the always replace slot
+                if data[index + 1] != 0:
+                    self.overwrites += 1
+                keys[index + 1] = keys[index]
+                data[index + 1] = deepWord
+            keys[index] = key
+            data[index] = word
+        else:
+            if data[index + 1] != 0:
+                self.overwrites += 1
+            keys[index + 1] = key
+            data[index + 1] = word
+
+    # fraction of probes that found their position
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    # fraction of slots in use, sampled from the first 1000 buckets like UCI hashfull
+    def fill(self):
+        sample = min(self.numEntries, 1000 * BUCKET_SIZE)
+        used = 0
+        for i in range(sample):
+            if self.data[i] != 0:
+                used += 1
+        return used / sample
+
+    def stats(self):
+        return {
+            "sizeMB": self.sizeMB,
+            "entries": self.numEntries,
+            "probes": self.probes,
+            "hits": self.hits,
+            "hitRate": self.hitRate(),
+            "collisions": self.collisions,
+            "stores": self.stores,
+            "overwrites": self.overwrites,
+            "fill": self.fill(),
+        }
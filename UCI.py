@@ -0,0 +1,258 @@
+"""
+Universal Chess Interface (UCI) front end so the engine can be run by chess GUIs and match runners
+Commands are read from stdin by an asyncio loop while ChessBot.AlphaBetaSearch runs in a worker thread, so stop and isready are
+answered within milliseconds of arriving even in the middle of a search, and info lines are written as the search goes
+Run it with python UCI.py and point the GUI at that command
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import threading
+import ChessEngine
+from ChessBot import AlphaBetaSearch, MATE_SCORE, MATE_BOUND
+from PGNReader import MoveIndex
+from OpeningBook import PolyglotBook
+from Tablebase import Tablebases
+
+ENGINE_NAME = "Python-Chess-Engine"
+ENGINE_AUTHOR = "leonlenk"
+DEFAULT_HASH_MB = 16
+MAX_HASH_MB = 1024
+INFO_INTERVAL = 1.0 # seconds between the nodes and nps lines sent while an iteration is running
+MOVE_OVERHEAD = 0.05 # seconds kept back from every move for the GUI and the time checks
+DEFAULT_MOVES_TO_GO = 30 # moves the remaining time is shared between when the GUI doesn't send movestogo
+GO_NUMBERS = ("wtime", "btime", "winc", "binc", "movestogo", "movetime", "depth", "nodes", "mate")
+
+
+# UCI score, centipawns or mate in moves with negative numbers for being mated
+def scoreText(score):
+    if score > MATE_BOUND:
+        return "mate " + str((MATE_SCORE - score + 1) // 2)
+    if score < -MATE_BOUND:
+        return "mate -" + str((MATE_SCORE + score + 1) // 2)
+    return "cp " + str(score)
+
+
+"""
+Seconds to search for one move from the go parameters, None to search until stop
+movetime is used as given, otherwise the remaining time is shared between movestogo moves with most of the increment added
+and never more than half the clock is used
+"""
+def allocateTime(go, whitesMove):
+    if go.get("infinite") or go.get("ponder"):
+        return None
+    if "movetime" in go:
+        return max(go["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+    remaining = go.get("wtime" if whitesMove else "btime")
+    if remaining is None:
+        return None if "depth" in go or "nodes" in go or "mate" in go else 1.0
+    increment = go.get("winc" if whitesMove else "binc", 0)
+    budget = remaining / go.get("movestogo", DEFAULT_MOVES_TO_GO) + increment * 0.75
+    return max(min(budget, remaining / 2) / 1000 - MOVE_OVERHEAD, 0.01)
+
+
+def parseGo(words):
+    go = {}
+    i = 0
+    while i < len(words):
+        if words[i] in GO_NUMBERS and i + 1 < len(words):
+            go[words[i]] = int(words[i + 1])
+            i += 2
+        else:
+            go[words[i]] = True # infinite, ponder and anything not understood
+            i += 1
+    return go
+
+
+"""
+Keeps the position the GUI set up and the searcher, handle takes one command line at a time
+The search runs in a thread that writes its own info and bestmove lines, only one search runs at a time
+"""
+class UCIEngine():
+    def __init__(self, output = sys.stdout, backend = "mailbox"):
+        self.output = output
+        self.backend = backend
+        self.writeLock = threading.Lock()
+        self.searcher = AlphaBetaSearch(DEFAULT_HASH_MB)
+        self.gameState = ChessEngine.set_board(backend = backend)
+        self.searchThread = None
+        self.stopEvent = threading.Event()
+        self.searchStart = 0.0
+        self.book = None # OpeningBook.PolyglotBook from the BookFile option
+        self.tablebases = None # Tablebase.Tablebases from the TablebasePath option
+
+    def send(self, line):
+        with self.writeLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def isSearching(self):
+        return self.searchThread is not None and self.searchThread.is_alive()
+
+    # stops a running search and waits for its bestmove, the search checks stopEvent every node so this is quick
+    def stopSearch(self):
+        self.stopEvent.set()
+        if self.searchThread is not None:
+            self.searchThread.join()
+            self.searchThread = None
+
+    # returns False once the engine should quit
+    def handle(self, line):
+        words = line.split()
+        if not words:
+            return True
+        command = words[0]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default " + str(DEFAULT_HASH_MB) + " min 1 max " + str(MAX_HASH_MB))
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stopSearch()
+            self.searcher.tt.clear()
+            self.gameState = ChessEngine.set_board(backend = self.backend)
+        elif command == "setoption":
+            self.setOption(words[1:])
+        elif command == "position":
+            self.stopSearch()
+            self.setPosition(words[1:])
+        elif command == "go":
+            self.stopSearch()
+            self.startSearch(parseGo(words[1:]))
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "quit":
+            self.stopSearch()
+            return False
+        elif command == "d":
+            self.send("info string fen " + self.gameState.to_fen())
+        return True
+
+    # setoption name <name> value <value>, the options are Hash, BookFile and TablebasePath
+    def setOption(self, words):
+        text = ' '.join(words)
+        if "value" not in words:
+            return
+        if text.lower().startswith("name bookfile"):
+            path = ' '.join(words[words.index("value") + 1:])
+            try:
+                self.book = PolyglotBook(path) if path and path != "<empty>" else None
+            except (OSError, ValueError) as error:
+                self.book = None
+                self.send("info string can't use book: " + str(error))
+            return
+        if text.lower().startswith("name tablebasepath"):
+            path = ' '.join(words[words.index("value") + 1:])
+            self.stopSearch()
+            try:
+                self.tablebases = Tablebases(path) if path and path != "<empty>" else None
+            except (OSError, ValueError) as error:
+                self.tablebases = None
+                self.send("info string can't use tablebases: " + str(error))
+            if self.tablebases is not None and len(self.tablebases) == 0:
+                self.send("info string no tablebases in " + path)
+            self.searcher.tablebases = self.tablebases
+            return
+        if not text.lower().startswith("name hash"):
+            return
+        try:
+            sizeMB = max(1, min(MAX_HASH_MB, int(words[words.index("value") + 1])))
+        except (ValueError, IndexError):
+            return
+        self.stopSearch()
+        self.searcher = AlphaBetaSearch(sizeMB, tablebases = self.tablebases)
+
+    # position startpos | fen <fen> followed by moves in UCI notation, a move that isn't legal stops the list
+    def setPosition(self, words):
+        if "moves" in words:
+            split = words.index("moves")
+            setup, moves = words[:split], words[split + 1:]
+        else:
+            setup, moves = words, []
+        try:
+            if setup and setup[0] == "fen":
+                gameState = ChessEngine.set_board(' '.join(setup[1:]), backend = self.backend)
+            else:
+                gameState = ChessEngine.set_board(backend = self.backend)
+        except (ValueError, IndexError, KeyError) as error:
+            self.send("info string bad position: " + str(error))
+            return
+        for token in moves:
+            try:
+                gameState.makeMove(MoveIndex(gameState).find(token))
+            except ValueError as error:
+                self.send("info string " + str(error))
+                break
+        self.gameState = gameState
+
+    def startSearch(self, go):
+        self.stopEvent = threading.Event()
+        self.searchStart = time.perf_counter()
+        self.searchThread = threading.Thread(target = self.runSearch, args = (go, self.stopEvent), daemon = True)
+        self.searchThread.start()
+
+    # runs in the search thread, a book move is played without searching
+    def runSearch(self, go, stopEvent):
+        move = self.book.choose(self.gameState) if self.book is not None else None
+        if move is not None:
+            self.send("info string book move")
+            if go.get("infinite") or go.get("ponder"):
+                stopEvent.wait()
+            self.send("bestmove " + move.getUCINotation())
+            return
+        timeLimit = allocateTime(go, self.gameState.whitesMove)
+        maxDepth = go.get("depth", 64)
+        if "mate" in go:
+            maxDepth = min(maxDepth, 2 * go["mate"] - 1)
+        move = self.searcher.search(self.gameState, timeLimit = timeLimit, nodeLimit = go.get("nodes"), maxDepth = maxDepth,
+                                    infoCallback = self.sendInfo, stopEvent = stopEvent)
+        # infinite and ponder searches only answer once they are told to stop
+        if go.get("infinite") or go.get("ponder"):
+            stopEvent.wait()
+        self.send("bestmove " + (move.getUCINotation() if move is not None else "0000"))
+
+    # called by the search after every finished iteration
+    def sendInfo(self, info):
+        line = ' '.join(move.getUCINotation() for move in self.searcher.principalVariation(self.gameState))
+        self.send("info depth " + str(info["depth"]) + " score " + scoreText(info["score"]) + " nodes " + str(info["nodes"]) +
+                  " nps " + str(info["nps"]) + " time " + str(int(info["time"] * 1000)) + " pv " + line)
+
+    # the node count and speed while an iteration is still running, read from the searcher without touching the board
+    def sendProgress(self):
+        elapsed = time.perf_counter() - self.searchStart
+        nodes = self.searcher.nodes
+        self.send("info nodes " + str(nodes) + " nps " + str(int(nodes / elapsed) if elapsed > 0 else 0) + " time " + str(int(elapsed * 1000)))
+
+    async def reportProgress(self):
+        while True:
+            await asyncio.sleep(INFO_INTERVAL)
+            if self.isSearching():
+                self.sendProgress()
+
+    """
+    Reads commands from input until quit or the end of the input
+    readline runs in a thread of its own so the event loop, and with it stop and isready, never waits on a search
+    """
+    async def run(self, input = sys.stdin):
+        reporter = asyncio.create_task(self.reportProgress())
+        try:
+            while True:
+                line = await asyncio.to_thread(input.readline)
+                if not line or not self.handle(line):
+                    break
+        finally:
+            reporter.cancel()
+            self.stopSearch()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "run the engine as a UCI engine on stdin and stdout")
+    parser.add_argument("--backend", default = "mailbox", choices = ("mailbox", "bitboard"))
+    args = parser.parse_args()
+    asyncio.run(UCIEngine(backend = args.backend).run())